@@ -0,0 +1,129 @@
+'''
+        Batched datagram I/O benchmark
+
+        Measures the packets/sec the server loop can read and answer when only the
+        I/O is counted. A sender fills the server socket with bursts of -burst
+        datagrams of -size bytes, then the loop drains them and sends one response
+        per datagram to a sink socket. "recvfrom" is the loop of server.run (one
+        recvfrom and one sendto per datagram), the other rows are datagramRing
+        (-batch) at several batch sizes, with recvmmsg / sendmmsg and with
+        recvfrom_into / sendto. Only the draining loop is timed.
+
+        Usage : python batchBench.py [-packets N] [-burst N] [-size N]
+'''
+
+import os,sys,time,socket,errno
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+from datagramBatch import datagramRing
+from benchOptions import readOptions
+
+BATCH_SIZES = (1, 4, 16, 64, 256)
+
+
+def newSocket():
+    '''
+        Output  : socket (UDP socket on a local port with large buffers)
+    '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8 << 20)
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+def drainSink(sink):
+    '''
+        Input   : socket
+        Output  : Number (Datagrams read)
+    '''
+    count = 0
+    while True:
+        try:
+            sink.recv(65535, 0x40)
+            count += 1
+        except socket.error:
+            return count
+
+
+def plainLoop(server, sink, expected):
+    received = 0
+    while received < expected:
+        try:
+            data, address = server.recvfrom(4096, 0x40)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                break
+            raise
+        received += 1
+        server.sendto(data, sink)
+    return received
+
+
+def ringLoop(ring, sink, expected):
+    received = 0
+    while received < expected:
+        datagrams = ring.receive()
+        if not datagrams:
+            break
+        received += len(datagrams)
+        ring.send([[data, sink] for data, address in datagrams])
+    return received
+
+
+def measure(loop, options):
+    '''
+        Input   : function, Dictionary (Loop to time with (server socket, sink address,
+                    datagrams expected), options)
+        Output  : [float, Number] (Packets per second and datagrams lost)
+    '''
+    server, client, sink = newSocket(), newSocket(), newSocket()
+    payload = os.urandom(options["size"])
+    handle = loop(server)
+    elapsed = 0.0
+    handled = 0
+    sent = 0
+    while sent < options["packets"]:
+        burst = min(options["burst"], options["packets"] - sent)
+        for i in range(burst):
+            client.sendto(payload, server.getsockname())
+        sent += burst
+        start = time.time()
+        handled += handle(sink.getsockname(), burst)
+        elapsed += time.time() - start
+        drainSink(sink)
+    for sock in (server, client, sink):
+        sock.close()
+    return [handled / elapsed if elapsed else 0.0, sent - handled]
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "packets"   : 200000,
+        "burst"     : 512,
+        "size"      : 200,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    print "%-16s %6s %12s %8s" % ("loop", "batch", "packets/s", "lost")
+    rate, lost = measure(lambda server: lambda sink, expected: plainLoop(server, sink, expected), options)
+    print "%-16s %6s %12.0f %8d" % ("recvfrom", "-", rate, lost)
+    for multiMessage, name in ((True, "recvmmsg"), (False, "recvfrom_into")):
+        for size in BATCH_SIZES:
+            rings = []
+            def newLoop(server):
+                ring = datagramRing(server, size, multiMessage=multiMessage)
+                rings.append(ring)
+                return lambda sink, expected: ringLoop(ring, sink, expected)
+            rate, lost = measure(newLoop, options)
+            if multiMessage and not rings[0].usesMultiMessage():
+                print "%-16s %6s %12s" % (name, "-", "unavailable")
+                break
+            print "%-16s %6d %12.0f %8d" % (name, size, rate, lost)
@@ -0,0 +1,26 @@
+'''
+        Command line of the benchmarks
+
+        Every benchmark takes optional "-flag <number>" pairs, the flags being the
+        keys of its default options.
+'''
+
+import sys
+
+
+def readOptions(options, usage):
+    '''
+        Input   : Dictionary, String (Default options of the benchmark, text printed
+                    when the command line is wrong)
+        Output  : Dictionary (The options, with the values given on the command line)
+    '''
+    args = sys.argv[1:]
+    if len(args) % 2:
+        print usage
+        sys.exit(0)
+    for flag, value in zip(args[0::2], args[1::2]):
+        if not flag.startswith("-") or flag[1:] not in options:
+            print usage
+            sys.exit(0)
+        options[flag[1:]] = int(value)
+    return options
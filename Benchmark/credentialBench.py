@@ -0,0 +1,76 @@
+'''
+        Credential lookup benchmark
+
+        Writes a SERVER.conf style file with the given number of users and compares
+        the cost of a login lookup when the whole file is parsed on every login (the
+        old __findPasswordHashForUser) with the in memory credentialStore.
+
+        Usage : python credentialBench.py [-users N] [-lookups N]
+'''
+
+import os,sys,json,time,random,tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+from credentialStore import credentialStore
+from benchOptions import readOptions
+
+
+def writeConfig(path, users):
+    '''
+        Input   : String, Number (Path of the file and the number of users)
+        Output  : None
+    '''
+    obj = {"salt": 1055321098333477550561901414932439633}
+    for i in range(users):
+        obj["user" + str(i)] = random.getrandbits(1536)
+    with open(path, "w") as outfile:
+        json.dump(obj, outfile)
+
+
+def parseEveryLogin(path, user):
+    '''
+        Input   : String, String (Path of the config file and the user name)
+        Output  : False or the password hash
+        Purpose : The lookup as it used to be done for every quiz-response
+    '''
+    with open(path) as json_file:
+        json_data = json.load(json_file)
+        if user.lower() in json_data:
+            return json_data[user.lower()]
+        return False
+
+
+def timeLookups(lookup, users, lookups):
+    '''
+        Input   : function, Number, Number (Lookup function, users in file, lookups to do)
+        Output  : Number (Average micro seconds per lookup)
+    '''
+    start = time.time()
+    for i in range(lookups):
+        lookup("user" + str(random.randint(0, users - 1)))
+    return (time.time() - start) / lookups * 1000000
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "users"     : 100000,
+        "lookups"   : 20,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    path = os.path.join(tempfile.mkdtemp(), "SERVER.conf")
+    print "%10s %18s %18s" % ("users", "parse/login us", "indexed us")
+    for users in (1000, 10000, options["users"]):
+        writeConfig(path, users)
+        store = credentialStore(path, 0)
+        parsed = timeLookups(lambda user: parseEveryLogin(path, user), users, options["lookups"])
+        indexed = timeLookups(store.lookup, users, options["lookups"] * 1000)
+        print "%10d %18.1f %18.2f" % (users, parsed, indexed)
+    os.remove(path)
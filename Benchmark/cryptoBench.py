@@ -0,0 +1,218 @@
+'''
+        Crypto primitive benchmark
+
+        Times every primitive of the protocol on its own, with the parameters the
+        client and the server use: Diffie Hellman key generation, shared key and
+        g^bw, RSA OAEP encrypt / decrypt of a compressed quiz-response, RSA PSS
+        sign / verify of the password hash, symetric encrypt / decrypt at several
+        payload sizes and the now-online puzzle search at several sizes.
+
+        Each primitive runs -repeat batches, a batch is sized to last about -batch ms.
+        The result is printed as JSON (per operation micro seconds: best, median and
+        worst batch, and operations per second of the median) with the versions of
+        Python, cryptography and OpenSSL, so runs on different machines or crypto
+        backends can be compared. Progress goes to stderr.
+
+        Usage : python cryptoBench.py [-repeat N] [-batch N]
+        Note  : Server/private_key.pem and Client/public_key.pem must exist (see README)
+'''
+
+import os,sys,time,json,zlib,socket,random,hashlib,binascii,platform
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "Server"))
+import wire,DH
+from symetric import symetric,CLIENT_TO_SERVER,SERVER_TO_CLIENT
+from quizCookie import quizCookie
+import cryptography
+from benchOptions import readOptions
+from cryptography.hazmat.primitives import serialization,hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.backends import default_backend
+
+OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+PSS = padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH)
+SYMETRIC_SIZES = (64, 512, 4096, 65000)
+PUZZLE_BITS = (8, 12, 16)
+
+
+def timeBatches(function, repeat, batch):
+    '''
+        Input   : function, Number, Number (The operation, number of batches and
+                    milliseconds a batch should last)
+        Output  : Dictionary (Per operation micro seconds of the best, median and worst
+                    batch, operations per second of the median and operations per batch)
+    '''
+    function()
+    number = 1
+    while True:
+        start = time.time()
+        for i in xrange(number):
+            function()
+        elapsed = time.time() - start
+        if elapsed * 1000 >= batch or number >= 1 << 20:
+            break
+        number *= 2 if elapsed * 1000 < batch / 4 else 1.5
+        number = int(number)
+    samples = [elapsed / number]
+    for r in range(repeat - 1):
+        start = time.time()
+        for i in xrange(number):
+            function()
+        samples.append((time.time() - start) / number)
+    samples.sort()
+    median = samples[len(samples) // 2]
+    return {
+        "number"    : number,
+        "repeat"    : len(samples),
+        "best"      : round(samples[0] * 1000000, 3),
+        "median"    : round(median * 1000000, 3),
+        "worst"     : round(samples[-1] * 1000000, 3),
+        "opsPerSec" : round(1 / median, 1),
+    }
+
+
+def cycle(values):
+    '''
+        Input   : List
+        Output  : function returning the next value of the list, wrapping around
+    '''
+    state = [0]
+    def next():
+        state[0] = (state[0] + 1) % len(values)
+        return values[state[0]]
+    return next
+
+
+def dhPrimitives():
+    '''
+        Output  : List of [name, function] (Client and server side Diffie Hellman)
+    '''
+    g, p = DH.primes["generator"], DH.primes["prime"]
+    DH.fixedBasePow(g, 1, p)                    # Build or load the table outside the timing
+    sha = hashlib.sha256()
+    sha.update("password" + str(random.getrandbits(64)))
+    passSecret = pow(g, int(binascii.hexlify(sha.digest()), base=16), p)
+    client = DH.DiffieHellman()
+    serverPubKey = DH.DiffieHellman().gen_public_key()
+    def keygen():
+        DH.DiffieHellman().gen_public_key()
+    return [
+        ["dh.keygen", keygen],
+        ["dh.shared", lambda: client.gen_shared_key(serverPubKey)],
+        ["dh.gpowxw", lambda: client.gen_gpowxw(serverPubKey, passSecret)],
+    ]
+
+
+def rsaPrimitives():
+    '''
+        Output  : List of [name, function] (OAEP of the handshake messages, PSS of the
+                    password hash)
+    '''
+    with open(os.path.join(ROOT, "Server", "private_key.pem"), "rb") as key_file:
+        privateKey = serialization.load_pem_private_key(key_file.read(), password=None,
+                                                        backend=default_backend())
+    with open(os.path.join(ROOT, "Client", "public_key.pem"), "rb") as key_file:
+        publicKey = serialization.load_pem_public_key(key_file.read(), backend=default_backend())
+    message = zlib.compress(wire.encode("quiz-response", {
+        "user"          : "alice",
+        "answer"        : 1234,
+        "pubKey"        : DH.DiffieHellman().gen_public_key(),
+        "challange"     : os.urandom(32),
+        "space"         : 1 << 16,
+        "timestamp"     : int(time.time()),
+    }))
+    cipherText = publicKey.encrypt(message, OAEP)
+    hash = str(int(binascii.hexlify(os.urandom(32)), base=16))
+    signature = privateKey.sign(hash, PSS, hashes.SHA256())
+    return [
+        ["rsa.oaep.encrypt", lambda: publicKey.encrypt(message, OAEP)],
+        ["rsa.oaep.decrypt", lambda: privateKey.decrypt(cipherText, OAEP)],
+        ["rsa.pss.sign", lambda: privateKey.sign(hash, PSS, hashes.SHA256())],
+        ["rsa.pss.verify", lambda: publicKey.verify(signature, hash, PSS, hashes.SHA256())],
+    ]
+
+
+def symetricPrimitives():
+    '''
+        Output  : List of [name, function] (Session encryption for every payload size)
+    '''
+    key = os.urandom(16)
+    sender = symetric(key, CLIENT_TO_SERVER, SERVER_TO_CLIENT)
+    receiver = symetric(key, SERVER_TO_CLIENT, CLIENT_TO_SERVER)
+    primitives = []
+    for size in SYMETRIC_SIZES:
+        message = os.urandom(size)
+        counter = [0]
+        def encrypt(message=message, counter=counter):
+            counter[0] += 1
+            return sender.encrypt(counter[0], message)
+        nonce, cipherText = sender.encrypt(0, message)
+        primitives.append(["symetric.encrypt." + str(size), encrypt])
+        primitives.append(["symetric.decrypt." + str(size),
+                           lambda nonce=nonce, cipherText=cipherText: receiver.decrypt(nonce, cipherText)])
+    return primitives
+
+
+def solve(quiz):
+    '''
+        Input   : Dictionary (quiz fields)
+        Output  : Number (The hidden number, searched like clientConnection does)
+    '''
+    prefix = hashlib.sha256(quiz["challange"])
+    for x in xrange(quiz["space"]):
+        sha = prefix.copy()
+        sha.update(str(x))
+        if sha.digest() == quiz["answer"]:
+            return x
+
+
+def puzzlePrimitives():
+    '''
+        Output  : List of [name, function] (Client puzzle search, the average solve
+                    looks at half of the space)
+    '''
+    cookies = quizCookie()
+    primitives = []
+    for bits in PUZZLE_BITS:
+        quizzes = [cookies.issue("user" + str(i), ("127.0.0.1", 1024 + i), 1 << bits) for i in range(64)]
+        primitives.append(["puzzle.solve." + str(1 << bits), lambda nextQuiz=cycle(quizzes): solve(nextQuiz())])
+    return primitives
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "repeat"    : 5,
+        "batch"     : 200,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    backend = default_backend()
+    results = {}
+    for primitives in (dhPrimitives, rsaPrimitives, symetricPrimitives, puzzlePrimitives):
+        for name, function in primitives():
+            sys.stderr.write("%-24s" % name)
+            results[name] = timeBatches(function, max(options["repeat"], 1), options["batch"])
+            sys.stderr.write("%12.1f us\n" % results[name]["median"])
+    print json.dumps({
+        "timestamp"     : int(time.time()),
+        "host"          : socket.gethostname(),
+        "machine"       : platform.machine(),
+        "processor"     : platform.processor(),
+        "python"        : platform.python_version(),
+        "cryptography"  : cryptography.__version__,
+        "openssl"       : backend.openssl_version_text(),
+        "rsaBits"       : serialization.load_pem_public_key(
+                            open(os.path.join(ROOT, "Client", "public_key.pem"), "rb").read(),
+                            backend=backend).key_size,
+        "dhBits"        : DH.primes["prime"].bit_length(),
+        "options"       : options,
+        "results"       : results,
+    }, indent=1, sort_keys=True)
@@ -0,0 +1,57 @@
+'''
+        Fixed base exponentiation benchmark
+
+        Computes g^x mod p for random 256 bit exponents (Diffie Hellman key
+        generation and password verifiers) with the built in pow and with the
+        fixedBase table of DH.py. Also reports the cost of building the table and
+        of loading it from the cache file.
+
+        Usage : python dhBench.py [-keys N] [-window N]
+'''
+
+import os,sys,time,binascii,tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+import DH
+from benchOptions import readOptions
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "keys"      : 2000,
+        "window"    : 8,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    g, p = DH.primes["generator"], DH.primes["prime"]
+    exponents = [int(binascii.hexlify(os.urandom(32)), base=16) for i in range(options["keys"])]
+
+    start = time.time()
+    table = DH.fixedBase(g, p, window=options["window"])
+    build = time.time() - start
+    path = os.path.join(tempfile.mkdtemp(), "DH.table")
+    table.save(path)
+    start = time.time()
+    DH.fixedBase.load(path, g, p, window=options["window"])
+    load = time.time() - start
+    os.remove(path)
+
+    start = time.time()
+    expected = [pow(g, x, p) for x in exponents]
+    builtin = time.time() - start
+    start = time.time()
+    computed = [table.pow(x) for x in exponents]
+    fixed = time.time() - start
+    assert computed == expected
+
+    print "table build %.1f ms, load from cache %.1f ms" % (build * 1000, load * 1000)
+    print "%10s %12s %12s" % ("", "us per key", "keys/s")
+    print "%10s %12.1f %12.0f" % ("pow", builtin / len(exponents) * 1000000, len(exponents) / builtin)
+    print "%10s %12.1f %12.0f" % ("fixedBase", fixed / len(exponents) * 1000000, len(exponents) / fixed)
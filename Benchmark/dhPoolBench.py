@@ -0,0 +1,70 @@
+'''
+        Diffie Hellman key pair pool benchmark
+
+        Times the key pair part of a handshake: computing g^a mod p inline (no pool)
+        and taking a precomputed pair from keyPairPool. Handshakes arrive every
+        -gap micro seconds, the pool statistics show how often it ran empty.
+
+        Usage : python dhPoolBench.py [-handshakes N] [-pool N] [-low N] [-gap N]
+'''
+
+import os,sys,time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+import DH
+from dhPool import keyPairPool
+from benchOptions import readOptions
+
+
+def percentile(samples, fraction):
+    '''
+        Input   : List, float (Sorted samples, 0.5 for the median)
+        Output  : Number
+    '''
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def run(takePair, handshakes, gap):
+    '''
+        Input   : function, Number, Number (Returns a key pair, handshakes, micro seconds between them)
+        Output  : List (Sorted micro seconds spent getting each pair)
+    '''
+    samples = []
+    for i in range(handshakes):
+        start = time.time()
+        takePair()
+        samples.append((time.time() - start) * 1000000)
+        time.sleep(gap / 1000000.0)
+    samples.sort()
+    return samples
+
+
+def inline():
+    diffi = DH.DiffieHellman()
+    return [diffi, diffi.gen_public_key()]
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "handshakes"    : 500,
+        "pool"          : 64,
+        "low"           : 16,
+        "gap"           : 2000,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    pool = keyPairPool(options["pool"], options["low"])
+    time.sleep(1)
+    print "%8s %10s %10s %10s" % ("", "p50 us", "p99 us", "max us")
+    for name, takePair in (("inline", inline), ("pool", pool.take)):
+        samples = run(takePair, options["handshakes"], options["gap"])
+        print "%8s %10.1f %10.1f %10.1f" % (name, percentile(samples, 0.5),
+                                            percentile(samples, 0.99), samples[-1])
+    print "pool", pool.getStats()
@@ -0,0 +1,132 @@
+'''
+        Fragmentation benchmark
+
+        Throughput of large packets (64KB to 10MB) sent as fragments of at most
+        1200 bytes (fragment.py). "split" and "reassemble" time the two halves in
+        this process, fragments given to the reassembler in random order.
+        "loopback" sends the fragments over a local UDP socket to a receiving
+        process that reassembles them and reports when the packet is complete;
+        there is no retransmission, a packet with a lost fragment counts as lost.
+
+        Usage : python fragmentBench.py [-rounds N] [-maxmb N]
+'''
+
+import os,sys,time,socket,select,random,struct
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+import wire
+from fragment import fragmenter,reassembler
+from benchOptions import readOptions
+
+SIZES = (64 << 10, 256 << 10, 1 << 20, 4 << 20, 10 << 20)
+
+
+def receiver(sock, pipe):
+    '''
+        Input   : socket, file descriptor (Where fragments arrive and where to report)
+        Purpose : Child process, writes the size and completion time of every packet
+    '''
+    buffer = reassembler(maxBytes=64 << 20)
+    while True:
+        data, address = sock.recvfrom(4096)
+        packet = wire.decode(data)
+        if packet is None:
+            continue
+        if packet["type"] != "fragment":
+            os.write(pipe, struct.pack("!Id", len(data), time.time()))
+            continue
+        data = buffer.add(packet, address)
+        if data is not None:
+            os.write(pipe, struct.pack("!Id", len(data), time.time()))
+
+
+def loopback(sizes, rounds):
+    '''
+        Input   : List, Number (Packet sizes, packets per size)
+        Output  : Dictionary (size : [MB/s of the packets received, packets lost])
+    '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 << 20)
+    sock.bind(("127.0.0.1", 0))
+    readPipe, writePipe = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(readPipe)
+        try:
+            receiver(sock, writePipe)
+        finally:
+            os._exit(0)
+    os.close(writePipe)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 64 << 20)
+    split = fragmenter()
+    results = {}
+    for size in sizes:
+        packet = wire.encode("client", {"IV": "", "data": os.urandom(size)})
+        elapsed = 0.0
+        received = 0
+        for i in range(rounds):
+            start = time.time()
+            for datagram in split.split(packet):
+                sender.sendto(datagram, sock.getsockname())
+            ready = select.select([readPipe], [], [], 5)[0]
+            if not ready:
+                continue
+            length, finished = struct.unpack("!Id", os.read(readPipe, 12))
+            elapsed += finished - start
+            received += 1
+        results[size] = [received * len(packet) / elapsed / 1048576 if elapsed else 0.0, rounds - received]
+        time.sleep(0.2)                         # Let the receiver drop what is left of lost packets
+    os.kill(pid, 9)
+    os.waitpid(pid, 0)
+    return results
+
+
+def inProcess(size, rounds):
+    '''
+        Input   : Number, Number (Packet size, repetitions)
+        Output  : [float, float] (MB/s of split and of reassemble)
+    '''
+    packet = wire.encode("client", {"IV": "", "data": os.urandom(size)})
+    split = fragmenter()
+    start = time.time()
+    for i in range(rounds):
+        datagrams = split.split(packet)
+    splitTime = time.time() - start
+    fragments = [wire.decode(datagram) for datagram in datagrams]
+    buffer = reassembler(maxBytes=64 << 20)
+    reassembleTime = 0.0
+    for i in range(rounds):
+        random.shuffle(fragments)
+        start = time.time()
+        for fragment in fragments:
+            data = buffer.add(fragment, ("127.0.0.1", 1))
+        reassembleTime += time.time() - start
+        assert data == packet
+    megabytes = rounds * len(packet) / 1048576.0
+    return [megabytes / splitTime, megabytes / reassembleTime]
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "rounds"    : 5,
+        "maxmb"     : 10,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    sizes = [size for size in SIZES if size <= options["maxmb"] << 20]
+    network = loopback(sizes, options["rounds"])
+    print "%10s %10s %12s %12s %12s %6s" % ("size", "fragments", "split MB/s", "join MB/s",
+                                            "loopback MB/s", "lost")
+    for size in sizes:
+        split, join = inProcess(size, options["rounds"])
+        count = len(fragmenter().split(wire.encode("client", {"IV": "", "data": "x" * size})))
+        print "%10s %10d %12.1f %12.1f %12.1f %6d" % (str(size >> 10) + "KB", count, split, join,
+                                                     network[size][0], network[size][1])
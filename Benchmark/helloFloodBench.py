@@ -0,0 +1,78 @@
+'''
+        Hello flood memory benchmark
+
+        Feeds now-online messages from spoofed users / addresses straight into the
+        handshake code (after the RSA step, so a million packets take seconds) and
+        prints the resident memory of the process as the flood goes on. "cookie" is
+        the server as it is, "stateful" stores an Auth object per hello the way the
+        quiz used to be kept until the client answered.
+
+        Usage : python helloFloodBench.py [-packets N] [-step N]
+        Note  : Server/private_key.pem must exist (see README)
+'''
+
+import os,sys,resource
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server")
+sys.path.insert(0, SERVER_DIR)
+import wire
+from Auth import Auth
+from sessionStore import sessionStore
+from serverConnection import Connection
+from benchOptions import readOptions
+
+
+def residentMB():
+    '''
+        Output  : float (Resident memory of this process in MB)
+    '''
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 1048576.0
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def flood(packets, step, stateful):
+    '''
+        Input   : Number, Number, Boolean (Hellos to send, hellos between two samples,
+                    True to also keep an Auth object per hello)
+        Output  : List (Resident MB after every step)
+    '''
+    store = sessionStore()
+    connection = Connection(store)
+    handle = connection._Connection__parseStreamData
+    samples = []
+    responses = []
+    for i in range(packets):
+        user = "flood" + str(i)
+        address = ("10.%d.%d.%d" % ((i >> 16) & 255, (i >> 8) & 255, i & 255), 1024 + i % 60000)
+        handle(wire.encode("now-online", {"user": user}), address, responses.append, False)
+        del responses[:]
+        if stateful:
+            store.setAuth(user, Auth(str(i)))
+        if (i + 1) % step == 0:
+            samples.append(residentMB())
+    return samples
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "packets"   : 1000000,
+        "step"      : 100000,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    os.chdir(SERVER_DIR)
+    cookie = flood(options["packets"], options["step"], False)
+    stateful = flood(options["packets"], options["step"], True)
+    print "%10s %14s %14s" % ("hellos", "cookie MB", "stateful MB")
+    for i in range(len(cookie)):
+        print "%10d %14.1f %14.1f" % ((i + 1) * options["step"], cookie[i], stateful[i])
@@ -0,0 +1,112 @@
+'''
+        Chat history benchmark
+
+        Adds -messages messages of -words words (drawn from a vocabulary of -vocabulary
+        words, the first ones much more often) with -peers peers to a chatHistory
+        (see Client/chatHistory.py) in a scratch directory. "add" is the time the
+        client loop spends per message, "write" the time the background writer
+        needed on top of it to put every batch on disk. "reopen" builds the indexes
+        again from history.idx, as a client does at login. Then times -lookups
+        scroll backs (last 20 messages with a peer, and the 20 before) and searches
+        for one common word, one rare word and two words together.
+
+        Usage : python historyBench.py [-messages N] [-peers N] [-words N] [-vocabulary N] [-lookups N]
+'''
+
+import os,sys,time,random,shutil,tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client"))
+from chatHistory import chatHistory,historyKey
+from benchOptions import readOptions
+
+LINES = 20
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "messages"      : 1000000,
+        "peers"         : 100,
+        "words"         : 8,
+        "vocabulary"    : 20000,
+        "lookups"       : 1000,
+    }
+    options = readOptions(options, __doc__)
+    options["vocabulary"] = max(options["vocabulary"], 10)
+    return options
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def timeLookups(name, lookups, function):
+    '''
+        Input   : String, Number, function (Name, repetitions, lookup returning a list)
+        Purpose : Print p50, p99 and the messages returned by one lookup
+    '''
+    latencies = []
+    found = 0
+    for i in range(lookups):
+        start = time.time()
+        found = len(function(i))
+        latencies.append(time.time() - start)
+    print "%-22s %10.3f %10.3f %8d" % (name, percentile(latencies, 0.5) * 1000,
+                                       percentile(latencies, 0.99) * 1000, found)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    directory = tempfile.mkdtemp(prefix="historyBench")
+    random.seed(1)
+    vocabulary = ["word%d" % i for i in range(options["vocabulary"])]
+    peers = ["user%d" % i for i in range(options["peers"])]
+    texts = [" ".join(vocabulary[min(int(random.paretovariate(1.0)) - 1, len(vocabulary) - 1)]
+                      for j in range(options["words"])) for i in range(1000)]
+    counts = {}
+    for text in texts:
+        for word in set(text.split()):
+            counts[word] = counts.get(word, 0) + 1
+    common = sorted(counts, key=counts.get)[-1]
+    second = sorted(counts, key=counts.get)[-2]
+    rare = sorted(counts, key=counts.get)[0]
+    key = historyKey("alice", "password")
+    try:
+        history = chatHistory(directory, key)
+        now = time.time()
+        start = time.time()
+        for i in range(options["messages"]):
+            history.add(peers[i % len(peers)], "alice", texts[i % len(texts)], now)
+        added = time.time() - start
+        history.flush()
+        written = time.time() - start - added
+        batches = history.getStats()["batches"]
+        history.close()
+        size = os.path.getsize(os.path.join(directory, "history.log"))
+
+        start = time.time()
+        history = chatHistory(directory, key)
+        reopened = time.time() - start
+        stats = history.getStats()
+
+        print "%d messages, %d peers, %d distinct words, log %.1f MB" % (
+            stats["records"], stats["peers"], stats["words"], size / float(1 << 20))
+        print "add %.1f us per message, writer %.2f s more for %d batches, reopen %.2f s" % (
+            added * 1e6 / max(options["messages"], 1), written, batches, reopened)
+        print
+        print "%-22s %10s %10s %8s" % ("lookup", "p50 ms", "p99 ms", "found")
+        lookups = options["lookups"]
+        timeLookups("scroll back", lookups, lambda i: history.recent(peers[i % len(peers)], LINES))
+        timeLookups("scroll back further", lookups,
+                    lambda i: history.recent(peers[i % len(peers)], LINES, LINES))
+        timeLookups("search common word", lookups, lambda i: history.search(common, LINES))
+        timeLookups("search rare word", lookups, lambda i: history.search(rare, LINES))
+        timeLookups("search two words", lookups,
+                    lambda i: history.search(second + " " + rare, LINES))
+        history.close()
+    finally:
+        shutil.rmtree(directory, True)
@@ -0,0 +1,512 @@
+'''
+        Load generator for the full client protocol
+
+        Starts server.py from a scratch copy of the Server folder (with a SERVER.conf
+        holding one account per simulated client) and drives simulated clients against
+        it. Clients arrive at -rate per second, each one does the whole handshake
+        (hello, puzzle, complete), then -requests requests (-list percent list, the rest
+        talk to another simulated client, whose ticket is forwarded to that client like
+        the real client does) -think ms apart, and logs out. The clients speak the same
+        protocol as clientConnection.connection, using the modules of the Client folder.
+
+        Every second prints handshakes/s, requests/s, active clients, lost packets and
+        the resident memory of the server (with its worker / key pool processes). At the
+        end prints handshake and request latency percentiles and the loss rate.
+
+        Usage : python loadGenerator.py [-rate N] [-clients N] [-seconds N] [-requests N]
+                                        [-list N] [-think N] [-timeout N] [-generators N]
+                                        [-port N] [-async N] [-keyprocs N] [-procs N]
+        Note  : Server/private_key.pem and Client/public_key.pem must exist (see README).
+                -clients is the number of simulated clients that may be active at once,
+                arrivals finding all of them busy are reported as "saturated".
+                -generators forks that many load processes, the client side crypto
+                (RSA, Diffie Hellman) costs about as much as the server side
+'''
+
+import os,sys,time,json,errno,socket,select,signal,random,shutil,hashlib,binascii
+import zlib,tempfile,resource,subprocess,multiprocessing,Queue
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVER_DIR = os.path.join(ROOT, "Server")
+CLIENT_DIR = os.path.join(ROOT, "Client")
+sys.path.insert(0, CLIENT_DIR)
+import wire,DH
+from fragment import reassembler
+from symetric import symetric,CLIENT_TO_SERVER,SERVER_TO_CLIENT
+from benchOptions import readOptions
+from cryptography.hazmat.primitives import serialization,hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.backends import default_backend
+
+USER_PREFIX = "load"                            # Simulated users are load0, load1 ... password = user name
+
+
+def readClientConfig():
+    '''
+        Output  : Dictionary (salt, prime and generator from CLIENT.conf)
+    '''
+    with open(os.path.join(CLIENT_DIR, "CLIENT.conf"), "rb") as conf_file:
+        return json.load(conf_file)
+
+
+def passwordSecret(password, config):
+    '''
+        Input   : String, Dictionary (Password and CLIENT.conf)
+        Output  : Number (g^w mod p, as computed by the client and stored in SERVER.conf)
+    '''
+    sha = hashlib.sha256()
+    sha.update(password + str(config["salt"]))
+    hash = int(binascii.hexlify(sha.digest()), base=16)
+    return DH.fixedBasePow(config["generator"], hash, config["prime"])
+
+
+def prepareServer(users, config):
+    '''
+        Input   : Number, Dictionary (Number of accounts, CLIENT.conf)
+        Output  : String (Scratch directory with the server code, key and a SERVER.conf
+                    for the simulated users)
+    '''
+    directory = tempfile.mkdtemp(prefix="loadGenerator")
+    for name in os.listdir(SERVER_DIR):
+        if name.endswith(".py") or name == "private_key.pem":
+            shutil.copy(os.path.join(SERVER_DIR, name), directory)
+    accounts = {"salt": config["salt"]}
+    for i in range(users):
+        accounts[USER_PREFIX + str(i)] = passwordSecret(USER_PREFIX + str(i), config)
+    with open(os.path.join(directory, "SERVER.conf"), "w") as outfile:
+        json.dump(accounts, outfile)
+    return directory
+
+
+def startServer(directory, port, extraArgs):
+    '''
+        Input   : String, Number, List (Server directory, port, extra flags for server.py)
+        Output  : Object (The server process)
+    '''
+    devnull = open(os.devnull, "w")
+    process = subprocess.Popen(
+        [sys.executable, "server.py", "-sp", str(port)] + extraArgs,
+        cwd=directory, stdout=devnull, stderr=devnull)
+    time.sleep(2)
+    return process
+
+
+def stopServer(process):
+    '''
+        Input   : Object (The server process)
+    '''
+    process.send_signal(signal.SIGINT)
+    process.wait()
+
+
+def processTreeRSS(pid):
+    '''
+        Input   : Number (Process id)
+        Output  : float (Resident MB of the process and all its descendants, Linux only)
+    '''
+    children = {}
+    rss = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/" + name + "/status") as status:
+                fields = dict(line.split(":", 1) for line in status if ":" in line)
+        except IOError:
+            continue
+        children.setdefault(int(fields["PPid"]), []).append(int(name))
+        rss[int(name)] = int(fields.get("VmRSS", "0 kB").split()[0])
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total / 1024.0
+
+
+def percentile(values, fraction):
+    '''
+        Input   : List, Number (Sorted samples and the fraction ie. 0.99)
+        Output  : Number
+    '''
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class simulatedClient:
+    '''
+        simulatedClient : Type -> class
+        purpose : One simulated user, a non blocking version of clientConnection.connection
+                    driven by loadGenerator
+        States  : idle, hello (waiting for the quiz), secret (waiting for initiateSecret),
+                  confirm (complete sent, list resent until the session answers),
+                  session (between requests), request (waiting for a response)
+    '''
+    def __init__(self, user, passSecret):
+        self.user = user
+        self.passSecret = passSecret
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.setblocking(0)
+        self.address = self.sock.getsockname()
+        self.state = "idle"
+        self.diffi = None
+        self.cipher = None
+        self.seq = 0
+        self.sentAt = 0                         # Time the packet we wait for was sent
+        self.started = 0                        # Time of the hello
+        self.request = None                     # list / talk while waiting for a response
+        self.requestsLeft = 0
+        self.nextRequestAt = 0
+
+
+class loadGenerator:
+    '''
+        loadGenerator : Type -> class
+        purpose : Runs the simulated clients of one process and reports to the parent
+    '''
+    def __init__(self, index, options, users, config, reports, start):
+        '''
+            __init__(Number,Dictionary,List,Dictionary,Object,float):
+                Input   : Index of the generator, command line options, [user,passSecret] of
+                            its clients, CLIENT.conf, multiprocessing.Queue for the reports
+                            and the common start time
+        '''
+        self.__options = options
+        self.__index = index
+        self.__reports = reports
+        self.__start = start
+        self.__server = ("127.0.0.1", options["port"])
+        self.__prime = config["prime"]
+        with open(os.path.join(CLIENT_DIR, "public_key.pem"), "rb") as key_file:
+            self.__publicKey = serialization.load_pem_public_key(key_file.read(),
+                                                                 backend=default_backend())
+        self.__clients = {}                     # fileno : simulatedClient
+        self.__poller = select.poll()
+        for user, passSecret in users:
+            client = simulatedClient(user, passSecret)
+            self.__clients[client.sock.fileno()] = client
+            self.__poller.register(client.sock.fileno(), select.POLLIN)
+        self.__idle = list(self.__clients.values())
+        self.__inSession = {}                   # user : simulatedClient
+        self.__reassembler = reassembler()      # Responses longer than one datagram
+        self.__second = {"handshakes": 0, "requests": 0, "lost": 0, "saturated": 0, "talkto": 0}
+        self.__totals = dict(self.__second)
+        self.__latency = {"handshake": [], "list": [], "talk": []}
+
+    def __count(self, name):
+        self.__second[name] += 1
+        self.__totals[name] += 1
+
+    def __encryptRSA(self, message):
+        return self.__publicKey.encrypt(
+            zlib.compress(message),
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None))
+
+    def __send(self, client, packet, address=None):
+        client.sentAt = time.time()
+        try:
+            client.sock.sendto(packet, address or self.__server)
+        except socket.error:
+            pass
+
+    def __sendAsym(self, client, packetType, fields):
+        self.__send(client, wire.encode("asym", {
+            "user"      : client.user,
+            "message"   : self.__encryptRSA(wire.encode(packetType, fields)),
+        }))
+
+    def __sendSym(self, client, packetType, fields):
+        client.seq += 1
+        fields["Seq"] = client.seq
+        fields["user"] = client.user
+        iv, message = client.cipher.encrypt(client.seq, wire.encode(packetType, fields))
+        self.__send(client, wire.encode("sym", {"IV": iv, "message": message}))
+
+    def __arrive(self, now):
+        if not self.__idle:
+            self.__count("saturated")
+            return
+        client = self.__idle.pop()
+        client.state = "hello"
+        client.started = now
+        client.seq = 0
+        client.requestsLeft = self.__options["requests"]
+        self.__sendAsym(client, "now-online", {"user": client.user})
+
+    def __finish(self, client):
+        self.__inSession.pop(client.user, None)
+        client.state = "idle"
+        client.cipher = None
+        client.diffi = None
+        self.__idle.append(client)
+
+    def __onQuiz(self, client, data):
+        prefix = hashlib.sha256(data["challange"])
+        for x in xrange(data["space"]):
+            sha = prefix.copy()
+            sha.update(str(x))
+            if sha.digest() == data["answer"]:
+                break
+        client.diffi = DH.DiffieHellman()
+        client.state = "secret"
+        self.__sendAsym(client, "quiz-response", {
+            "user"      : client.user,
+            "answer"    : x,
+            "pubKey"    : client.diffi.gen_public_key(),
+            "challange" : data["challange"],
+            "space"     : data["space"],
+            "timestamp" : data["timestamp"],
+        })
+
+    def __onSecret(self, client, data):
+        serverPubKey = long(data["pubKey"])
+        sharedSecret = client.diffi.gen_shared_key(serverPubKey)
+        gpowbw = client.diffi.gen_gpowxw(serverPubKey, client.passSecret)
+        sha = hashlib.sha256()
+        sha.update(str(gpowbw) + str(sharedSecret))
+        if int(binascii.hexlify(sha.digest()), base=16) != data["hash"]:
+            self.__count("lost")
+            self.__finish(client)
+            return
+        sha = hashlib.sha384()
+        sha.update(str(gpowbw) + str(sharedSecret))
+        self.__sendAsym(client, "complete", {
+            "user"      : client.user,
+            "hash"      : int(binascii.hexlify(sha.digest()), base=16),
+        })
+        client.cipher = symetric(str(sharedSecret)[0:16], CLIENT_TO_SERVER, SERVER_TO_CLIENT)
+        client.state = "confirm"
+        client.request = "list"
+        self.__sendSym(client, "list", {})
+
+    def __nextRequest(self, client, now):
+        if client.requestsLeft <= 0:
+            self.__sendSym(client, "logout", {})
+            self.__finish(client)
+            return
+        client.requestsLeft -= 1
+        client.state = "request"
+        peers = [user for user in self.__inSession if user != client.user]
+        if random.randint(1, 100) > self.__options["list"] and peers:
+            client.request = "talk"
+            self.__sendSym(client, "talk", {"userDestination": random.choice(peers)})
+        else:
+            client.request = "list"
+            self.__sendSym(client, "list", {})
+
+    def __onSym(self, client, data, now):
+        plainText = client.cipher.decrypt(data["IV"], data["message"]) if client.cipher else None
+        message = wire.decode(plainText) if plainText is not None else None
+        if message is None:
+            return
+        if message["type"] == "talkto":
+            self.__count("talkto")
+            return
+        if message["type"] == "disconnect":
+            self.__finish(client)
+            return
+        if client.state == "confirm" and message["type"] == "users":
+            self.__latency["handshake"].append(now - client.started)
+            self.__count("handshakes")
+            self.__inSession[client.user] = client
+        elif client.state == "request" and message["type"] in ("users", "ticket"):
+            self.__latency[client.request].append(now - client.sentAt)
+            self.__count("requests")
+            if message["type"] == "ticket":
+                self.__send(client, wire.encode("sym", {"IV": message["IV"], "message": message["ticket"]}),
+                            message["address"])
+        else:
+            return
+        client.state = "session"
+        client.nextRequestAt = now + self.__options["think"] / 1000.0
+
+    def __receive(self, client, now):
+        try:
+            data, address = client.sock.recvfrom(65535)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        data = wire.decode(data)
+        if data is not None and data["type"] == "fragment":
+            data = self.__reassembler.add(data, (client.user, address))
+            data = wire.decode(data) if data is not None else None
+        if data is None:
+            return
+        if data["type"] == "quiz" and client.state == "hello":
+            self.__onQuiz(client, data)
+        elif data["type"] == "initiateSecret" and client.state == "secret":
+            self.__onSecret(client, data)
+        elif data["type"] == "sym":
+            self.__onSym(client, data, now)
+
+    def __checkTimers(self, now):
+        timeout = self.__options["timeout"]
+        self.__reassembler.expire(now)
+        for client in self.__clients.values():
+            if client.state in ("hello", "secret") and now - client.sentAt > timeout:
+                self.__count("lost")
+                self.__finish(client)
+            elif client.state == "confirm" and now - client.sentAt > 0.2:
+                if now - client.started > timeout + 0.2:
+                    self.__count("lost")
+                    self.__finish(client)
+                else:
+                    self.__sendSym(client, "list", {})
+            elif client.state == "request" and now - client.sentAt > timeout:
+                self.__count("lost")
+                client.state = "session"
+                client.nextRequestAt = now
+            elif client.state == "session" and now >= client.nextRequestAt:
+                self.__nextRequest(client, now)
+
+    def run(self):
+        '''
+            run(None):
+                Purpose : Generate arrivals for -seconds, then report the latencies
+        '''
+        while time.time() < self.__start:
+            time.sleep(0.01)
+        interval = float(self.__options["generators"]) / max(self.__options["rate"], 1)
+        nextArrival = self.__start + random.random() * interval
+        end = self.__start + self.__options["seconds"]
+        second = 1
+        lastCheck = 0
+        while True:
+            now = time.time()
+            while nextArrival <= now and now < end:
+                self.__arrive(now)
+                nextArrival += interval
+            for fd, event in self.__poller.poll(5):
+                self.__receive(self.__clients[fd], time.time())
+            now = time.time()
+            if now - lastCheck > 0.02:
+                lastCheck = now
+                self.__checkTimers(now)
+            if now >= self.__start + second:
+                self.__second["active"] = len(self.__clients) - len(self.__idle)
+                self.__reports.put(("second", self.__index, second, self.__second))
+                self.__second = {"handshakes": 0, "requests": 0, "lost": 0, "saturated": 0, "talkto": 0}
+                second += 1
+            if now >= end:
+                break
+        self.__reports.put(("done", self.__index, self.__totals, self.__latency))
+
+
+def runGenerator(index, options, users, config, reports, start):
+    '''
+        Input   : see loadGenerator.__init__
+        Purpose : Entry point of a generator process
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    random.seed(os.urandom(8))
+    loadGenerator(index, options, users, config, reports, start).run()
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "rate"          : 20,
+        "clients"       : 1000,
+        "seconds"       : 30,
+        "requests"      : 10,
+        "list"          : 80,
+        "think"         : 100,
+        "timeout"       : 3,
+        "generators"    : 2,
+        "port"          : 24250,
+        "async"         : 0,
+        "keyprocs"      : 0,
+        "procs"         : 0,
+    }
+    options = readOptions(options, __doc__)
+    options["generators"] = max(options["generators"], 1)
+    return options
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < options["clients"] + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, options["clients"] + 64), hard))
+    config = readClientConfig()
+    print "Preparing " + str(options["clients"]) + " accounts"
+    directory = prepareServer(options["clients"], config)
+    extraArgs = []
+    for flag in ("async", "keyprocs", "procs"):
+        if options[flag] > 0:
+            extraArgs += ["-" + flag, str(options[flag])]
+    process = startServer(directory, options["port"], extraArgs)
+
+    reports = multiprocessing.Queue()
+    start = time.time() + 1
+    generators = []
+    for index in range(options["generators"]):
+        users = [[USER_PREFIX + str(i), passwordSecret(USER_PREFIX + str(i), config)]
+                 for i in range(index, options["clients"], options["generators"])]
+        generator = multiprocessing.Process(target=runGenerator,
+                                            args=(index, options, users, config, reports, start))
+        generator.start()
+        generators.append(generator)
+
+    seconds = {}                                # second : summed report
+    totals = {"handshakes": 0, "requests": 0, "lost": 0, "saturated": 0, "talkto": 0}
+    latency = {"handshake": [], "list": [], "talk": []}
+    peakRSS = 0.0
+    done = 0
+    printed = 0
+    print "%6s %12s %10s %8s %6s %10s %10s" % ("second", "handshake/s", "request/s", "active",
+                                                "lost", "saturated", "server MB")
+    try:
+        while done < len(generators):
+            try:
+                report = reports.get(timeout=0.2)
+            except Queue.Empty:
+                continue
+            if report[0] == "second":
+                summed = seconds.setdefault(report[2], {"reports": 0})
+                for name, value in report[3].items():
+                    summed[name] = summed.get(name, 0) + value
+                summed["reports"] += 1
+                if summed["reports"] == len(generators):
+                    rss = processTreeRSS(process.pid)
+                    peakRSS = max(peakRSS, rss)
+                    print "%6d %12d %10d %8d %6d %10d %10.1f" % (
+                        report[2], summed["handshakes"], summed["requests"], summed["active"],
+                        summed["lost"], summed["saturated"], rss)
+            else:
+                done += 1
+                for name, value in report[2].items():
+                    totals[name] += value
+                for name, values in report[3].items():
+                    latency[name].extend(values)
+    finally:
+        for generator in generators:
+            generator.join()
+        stopServer(process)
+        shutil.rmtree(directory, True)
+
+    elapsed = float(options["seconds"])
+    sent = totals["handshakes"] + totals["requests"] + totals["lost"]
+    print
+    print "handshakes    %d (%.1f/s)" % (totals["handshakes"], totals["handshakes"] / elapsed)
+    print "requests      %d (%.1f/s), %d tickets delivered to peers" % (
+        totals["requests"], totals["requests"] / elapsed, totals["talkto"])
+    print "lost          %d (%.2f%%), %d arrivals found every client busy" % (
+        totals["lost"], totals["lost"] * 100.0 / max(sent, 1), totals["saturated"])
+    print "server peak   %.1f MB" % peakRSS
+    print "%-10s %8s %10s %10s %10s" % ("latency", "count", "p50 ms", "p99 ms", "max ms")
+    for name in ("handshake", "list", "talk"):
+        values = sorted(latency[name])
+        print "%-10s %8d %10.2f %10.2f %10.2f" % (name, len(values), percentile(values, 0.5) * 1000,
+                                                  percentile(values, 0.99) * 1000,
+                                                  (values[-1] if values else 0) * 1000)
@@ -0,0 +1,187 @@
+'''
+        Loopback benchmark for the server loop
+
+        Starts server.py on a local port and drives thousands of simulated clients
+        against it. Every client sends the first message of the handshake (now-online)
+        and waits for the quiz, then immediately says hello again (closed loop).
+        The run is repeated for the blocking loop, the async loop and the async loop
+        with a private key process pool so the throughput can be compared.
+
+        Usage : python loopbackBench.py [-clients N] [-seconds N] [-workers N] [-timeout N]
+        Note  : Server/private_key.pem and Client/public_key.pem must exist (see README)
+'''
+
+import os,sys,time,socket,select,errno
+import zlib,subprocess,resource,signal
+from cryptography.hazmat.primitives import serialization,hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.backends import default_backend
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVER_DIR = os.path.join(ROOT, "Server")
+CLIENT_DIR = os.path.join(ROOT, "Client")
+sys.path.insert(0, CLIENT_DIR)
+import wire
+from benchOptions import readOptions
+
+
+def loadServerPublicKey():
+    '''
+        Output  : Object (The servers public key)
+        Purpose : Read the public key used by the client program
+    '''
+    with open(os.path.join(CLIENT_DIR, "public_key.pem"), "rb") as key_file:
+        return serialization.load_pem_public_key(key_file.read(), backend=default_backend())
+
+
+def genHelloPackets(publicKey, clients):
+    '''
+        Input   : Object, Number (Server public key, number of simulated clients)
+        Output  : List (One encrypted now-online packet per client)
+        Purpose : Encrypt the hellos before the clock starts so the benchmark only
+                    measures the server
+    '''
+    packets = []
+    for i in range(clients):
+        message = publicKey.encrypt(
+            zlib.compress(wire.encode("now-online", {
+                "user"          : "bench" + str(i),
+            })),
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None))
+        packets.append(wire.encode("asym", {
+            "user"      : "bench" + str(i),
+            "message"   : message,
+        }))
+    return packets
+
+
+def startServer(port, extraArgs):
+    '''
+        Input   : Number, List (Port and extra command line flags for server.py)
+        Output  : Object (The server process)
+    '''
+    devnull = open(os.devnull, "w")
+    process = subprocess.Popen(
+        [sys.executable, "server.py", "-sp", str(port)] + extraArgs,
+        cwd=SERVER_DIR, stdout=devnull, stderr=devnull)
+    time.sleep(1)
+    return process
+
+
+def stopServer(process):
+    '''
+        Input   : Object (The server process)
+        Purpose : Stop the server started by startServer
+    '''
+    process.send_signal(signal.SIGINT)
+    process.wait()
+
+
+def percentile(values, fraction):
+    '''
+        Input   : List, Number (Sorted samples and the fraction ie. 0.99)
+        Output  : Number
+    '''
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def runClients(port, packets, seconds, timeout):
+    '''
+        Input   : Number, List, Number, Number (Server port, hello packets, test duration and
+                    how long a client waits before the hello is counted as lost)
+        Output  : Dictionary (Results of the run)
+        Purpose : Keep every simulated client busy saying hello for the given duration
+    '''
+    poller = select.poll()
+    clients = {}                                # fileno : [socket, packet, sentAt]
+    for packet in packets:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.setblocking(0)
+        clients[sock.fileno()] = [sock, packet, 0]
+        poller.register(sock.fileno(), select.POLLIN)
+
+    server = ("127.0.0.1", port)
+    latencies = []
+    lost = 0
+    start = time.time()
+    for client in clients.values():
+        client[2] = time.time()
+        client[0].sendto(client[1], server)
+
+    lastScan = start
+    while time.time() - start < seconds:
+        for fd, event in poller.poll(100):
+            client = clients[fd]
+            try:
+                client[0].recvfrom(4096)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    continue
+                raise
+            now = time.time()
+            latencies.append(now - client[2])
+            client[2] = now
+            client[0].sendto(client[1], server)
+        now = time.time()
+        if now - lastScan > 0.1:
+            lastScan = now
+            for client in clients.values():
+                if now - client[2] > timeout:
+                    lost += 1
+                    client[2] = now
+                    client[0].sendto(client[1], server)
+    elapsed = time.time() - start
+
+    for client in clients.values():
+        client[0].close()
+    latencies.sort()
+    return {
+        "handshakes"    : len(latencies),
+        "rate"          : len(latencies) / elapsed,
+        "p50"           : percentile(latencies, 0.50) * 1000,
+        "p99"           : percentile(latencies, 0.99) * 1000,
+        "lost"          : lost,
+    }
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "clients"   : 2000,
+        "seconds"   : 10,
+        "workers"   : 4,
+        "timeout"   : 2,
+        "port"      : 24240,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < options["clients"] + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, options["clients"] + 64), hard))
+    packets = genHelloPackets(loadServerPublicKey(), options["clients"])
+    modes = [
+        ("blocking", []),
+        ("async", ["-async", str(options["workers"])]),
+        ("keypool", ["-async", str(options["workers"]), "-keyprocs", str(options["workers"])]),
+    ]
+    print "%-10s %8s %12s %10s %10s %8s" % ("mode", "clients", "handshake/s", "p50 ms", "p99 ms", "lost")
+    for name, extraArgs in modes:
+        process = startServer(options["port"], extraArgs)
+        try:
+            result = runClients(options["port"], packets, options["seconds"], options["timeout"])
+        finally:
+            stopServer(process)
+        print "%-10s %8d %12.1f %10.2f %10.2f %8d" % (
+            name, options["clients"], result["rate"], result["p50"], result["p99"], result["lost"])
@@ -0,0 +1,84 @@
+'''
+        Offline mail log benchmark
+
+        Works on a mailLog (see Server/mailLog.py) in a scratch directory:
+        "append" stores -mails mails of -size bytes for -recipients users that are
+        offline, "restart" opens the log again and rebuilds the index from the
+        segments (what a server does at start), "drain" delivers every mailbox a
+        mailbag at a time (pending, then acknowledge) as users log in, deleting
+        the segments whose mail was delivered.
+
+        Usage : python mailLogBench.py [-mails N] [-size N] [-recipients N] [-segmentkb N]
+'''
+
+import os,sys,time,shutil,tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+from mailLog import mailLog
+from serverConnection import MAILBAG_BUDGET
+from benchOptions import readOptions
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "mails"         : 100000,
+        "size"          : 200,
+        "recipients"    : 1000,
+        "segmentkb"     : 4096,
+    }
+    options = readOptions(options, __doc__)
+    options["recipients"] = max(options["recipients"], 1)
+    return options
+
+
+def report(name, count, seconds, size):
+    print "%-8s %10d %12.0f %10.1f %10.3f" % (name, count, count / max(seconds, 1e-9),
+                                              size * count / max(seconds, 1e-9) / (1 << 20), seconds)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    directory = tempfile.mkdtemp(prefix="mailLogBench")
+    recipients = ["user" + str(i) for i in range(options["recipients"])]
+    data = os.urandom(options["size"])
+    iv = os.urandom(12)
+    perBox = (options["mails"] + len(recipients) - 1) // len(recipients)
+    try:
+        log = mailLog(directory, options["segmentkb"] << 10, max(perBox, 1))
+        start = time.time()
+        for i in range(options["mails"]):
+            log.append(recipients[i % len(recipients)], "alice", i, iv, data)
+        appended = time.time() - start
+        stats = log.getStats()
+
+        start = time.time()
+        log = mailLog(directory, options["segmentkb"] << 10, max(perBox, 1))
+        restarted = time.time() - start
+
+        bags = 0
+        delivered = 0
+        start = time.time()
+        for recipient in recipients:
+            mail = log.pending(recipient, MAILBAG_BUDGET)
+            while mail:
+                bags += 1
+                delivered += len(mail)
+                log.acknowledge(recipient, mail[-1][0])
+                mail = log.pending(recipient, MAILBAG_BUDGET)
+        drained = time.time() - start
+        after = log.getStats()
+    finally:
+        shutil.rmtree(directory, True)
+
+    print "%d mails of %d bytes for %d recipients, segments of %d KB" % (
+        options["mails"], options["size"], len(recipients), options["segmentkb"])
+    print "%-8s %10s %12s %10s %10s" % ("step", "mails", "mails/s", "MB/s", "seconds")
+    report("append", options["mails"], appended, options["size"])
+    report("restart", stats["pending"], restarted, options["size"])
+    report("drain", delivered, drained, options["size"])
+    print "%d mailbags, segments %d after append, %d after drain (%d compacted), %d mails pending" % (
+        bags, stats["segments"], after["segments"], after["compacted"], after["pending"])
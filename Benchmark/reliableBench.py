@@ -0,0 +1,115 @@
+'''
+        Reliable delivery benchmark
+
+        Sends -messages chat messages of -size bytes from one local UDP socket to
+        another through reliableSender / reliableReceiver (Client/reliable.py),
+        dropping every datagram (chat and ack) with the given probability. Reports
+        for each loss rate the messages delivered per second, the delivery latency
+        from the first transmission of a message to its in order delivery (p50,
+        p99, max), the retransmissions and the final RTO. Packets are not
+        encrypted, only the reliability layer is measured.
+
+        Usage : python reliableBench.py [-messages N] [-size N] [-seed N]
+'''
+
+import os,sys,time,socket,select,random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client"))
+import wire
+from reliable import reliableSender,reliableReceiver
+from benchOptions import readOptions
+
+LOSS_RATES = (0.0, 0.01, 0.05, 0.1, 0.3)
+
+
+def newSocket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(loss, options):
+    '''
+        Input   : float, Dictionary (Probability a datagram is dropped, options)
+        Output  : Dictionary (Rate, latencies in ms, retransmissions and final RTO)
+    '''
+    rng = random.Random(options["seed"])
+    senderSock, receiverSock = newSocket(), newSocket()
+    sender, receiver = reliableSender(), reliableReceiver()
+    firstSent = {}
+    latencies = []
+    payload = "x" * options["size"]
+
+    def send(sock, packet, address):
+        if rng.random() >= loss:
+            sock.sendto(packet, address)
+
+    def build(msgNo, message):
+        firstSent[msgNo] = time.time()
+        return wire.encode("chat", {"user": "alice", "Seq": msgNo, "msgNo": msgNo, "chat": message})
+
+    for i in range(options["messages"]):
+        sender.push(payload)
+    start = time.time()
+    for packet in sender.poll(build):
+        send(senderSock, packet, receiverSock.getsockname())
+    while len(latencies) < options["messages"] and not sender.hasFailed():
+        timeout = sender.nextTimeout()
+        ready = select.select([senderSock, receiverSock], [], [], timeout)[0]
+        if receiverSock in ready:
+            chat = wire.decode(receiverSock.recv(65535))
+            now = time.time()
+            for message in receiver.receive(chat["msgNo"], chat):
+                latencies.append(now - firstSent[message["msgNo"]])
+            cumulative, sack = receiver.getAck()
+            send(receiverSock, wire.encode("ack", {"user": "bob", "Seq": 0, "cumulative": cumulative,
+                                                   "sack": sack}), senderSock.getsockname())
+        if senderSock in ready:
+            ack = wire.decode(senderSock.recv(65535))
+            for packet in sender.acknowledge(ack["cumulative"], ack["sack"]):
+                send(senderSock, packet, receiverSock.getsockname())
+        for packet in sender.poll(build):
+            send(senderSock, packet, receiverSock.getsockname())
+    elapsed = time.time() - start
+    senderSock.close()
+    receiverSock.close()
+    stats = sender.getStats()
+    return {
+        "rate"          : len(latencies) / elapsed,
+        "p50"           : percentile(latencies, 0.5) * 1000 if latencies else 0.0,
+        "p99"           : percentile(latencies, 0.99) * 1000 if latencies else 0.0,
+        "max"           : max(latencies) * 1000 if latencies else 0.0,
+        "retransmitted" : stats["retransmitted"],
+        "rto"           : stats["rto"],
+        "lost"          : options["messages"] - len(latencies),
+    }
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "messages"  : 5000,
+        "size"      : 200,
+        "seed"      : 1,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    print "%6s %10s %9s %9s %9s %8s %6s %6s" % ("loss", "msgs/s", "p50 ms", "p99 ms", "max ms",
+                                               "resent", "rto", "lost")
+    for loss in LOSS_RATES:
+        result = run(loss, options)
+        print "%5.0f%% %10.0f %9.1f %9.1f %9.1f %8d %6.2f %6d" % (
+            loss * 100, result["rate"], result["p50"], result["p99"], result["max"],
+            result["retransmitted"], result["rto"], result["lost"])
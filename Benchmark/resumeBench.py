@@ -0,0 +1,147 @@
+'''
+        Session resumption benchmark
+
+        Starts server.py from a scratch copy of the Server folder and logs -clients
+        clients in with the full handshake (RSA hello, puzzle, Diffie Hellman and
+        RSA signature, complete), then logs every one of them in again with the
+        resumption ticket it received (one round trip, symmetric crypto only, see
+        Client/resumption.py), as after a network blip. Reports for both the
+        latency of a login seen by the client (p50, p99) and the CPU time the
+        server spent per login, read from /proc (Linux only).
+
+        Usage : python resumeBench.py [-clients N] [-port N] [-async N] [-keyprocs N] [-procs N]
+        Note  : Server/private_key.pem and Client/public_key.pem must exist (see README).
+'''
+
+import os,sys,time,select,shutil,resource
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadGenerator import CLIENT_DIR,USER_PREFIX,readClientConfig,prepareServer,startServer,stopServer
+from benchOptions import readOptions
+
+
+class quiet:
+    '''
+        quiet : Type -> class
+        purpose : Stands for sys.stdout while the clients log in
+    '''
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def serverCpu(pid):
+    '''
+        Input   : Number (Process id of the server)
+        Output  : float (User + system seconds of the process and all its descendants)
+    '''
+    children = {}
+    cpu = {}
+    hertz = float(os.sysconf("SC_CLK_TCK"))
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/" + name + "/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except IOError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(name))
+        cpu[int(name)] = (int(fields[11]) + int(fields[12])) / hertz
+    total = 0.0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        total += cpu.get(current, 0.0)
+        pending.extend(children.get(current, []))
+    return total
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def pump(clients, seconds):
+    '''
+        Input   : List, float (Connections, seconds to read what the server sends)
+    '''
+    end = time.time() + seconds
+    sockets = dict((client.getSock(), client) for client in clients)
+    while time.time() < end:
+        ready = select.select(sockets.keys(), [], [], max(end - time.time(), 0))[0]
+        for sock in ready:
+            sockets[sock].handleServerMessage()
+
+
+def login(clients, process):
+    '''
+        Input   : List, Object (Connections, the server process)
+        Output  : [List, float, Number] (Latency of every login, server CPU seconds, logins
+                    that failed)
+    '''
+    latencies = []
+    failed = 0
+    cpu = serverCpu(process.pid)
+    for client in clients:
+        start = time.time()
+        if client.establishConnection():
+            latencies.append(time.time() - start)
+        else:
+            failed += 1
+    pump(clients, 0.5)
+    return [latencies, serverCpu(process.pid) - cpu, failed]
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "clients"   : 200,
+        "port"      : 24270,
+        "async"     : 0,
+        "keyprocs"  : 0,
+        "procs"     : 0,
+    }
+    options = readOptions(options, __doc__)
+    options["clients"] = max(options["clients"], 1)
+    return options
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < options["clients"] + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, options["clients"] + 64), hard))
+    config = readClientConfig()
+    directory = prepareServer(options["clients"], config)
+    extraArgs = []
+    for flag in ("async", "keyprocs", "procs"):
+        if options[flag] > 0:
+            extraArgs += ["-" + flag, str(options[flag])]
+    process = startServer(directory, options["port"], extraArgs)
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    try:
+        os.chdir(CLIENT_DIR)
+        import clientConnection
+        sys.stdout = quiet()
+        clients = [clientConnection.connection(USER_PREFIX + str(i), USER_PREFIX + str(i), options["port"])
+                   for i in range(options["clients"])]
+        results = [["full", login(clients, process)], ["resumed", login(clients, process)]]
+    finally:
+        sys.stdout = stdout
+        os.chdir(cwd)
+        stopServer(process)
+        shutil.rmtree(directory, True)
+
+    print "%-8s %8s %8s %10s %10s %16s" % ("login", "count", "failed", "p50 ms", "p99 ms", "server CPU ms")
+    for name, (latencies, cpu, failed) in results:
+        print "%-8s %8d %8d %10.2f %10.2f %16.3f" % (
+            name, len(latencies), failed, percentile(latencies, 0.5) * 1000 if latencies else 0.0,
+            percentile(latencies, 0.99) * 1000 if latencies else 0.0,
+            cpu * 1000 / max(len(latencies), 1))
@@ -0,0 +1,174 @@
+'''
+        Chat room benchmark
+
+        Compares, for rooms of 10, 50 and 200 members (up to -members), one post
+        sent to the room (encrypted once with the room key, sent once to the server
+        which forwards it, see Client/chatRoom.py) with the same message sent to
+        every member over its own session ("pairwise", as the chat command does).
+        "seal us" is the sender crypto per post, "uplink" the bytes the sender
+        puts on the network per post.
+
+        "fan-out" then starts server.py from a scratch copy of the Server folder,
+        logs -members clients in, all of them join one room, and one of them posts
+        -posts messages -gap ms apart. Reports the posts read by the other members
+        per second and the ones that never arrived (posts are not acknowledged).
+
+        Usage : python roomBench.py [-members N] [-posts N] [-gap N] [-size N] [-port N]
+        Note  : Server/private_key.pem and Client/public_key.pem must exist (see README).
+'''
+
+import os,sys,time,select,shutil,resource
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadGenerator import CLIENT_DIR,USER_PREFIX,readClientConfig,prepareServer,startServer,stopServer
+import wire
+from symetric import symetric
+from chatRoom import chatRoom
+from benchOptions import readOptions
+
+SIZES = (10, 50, 200)
+ROOM = "bench"
+
+
+def pairwise(members, payload, rounds):
+    '''
+        Input   : Number, String, Number (Members of the room, message, repetitions)
+        Output  : [float, Number] (Micro seconds and bytes sent per post)
+    '''
+    ciphers = [symetric(os.urandom(16), 1, 1) for i in range(members - 1)]
+    start = time.time()
+    for seq in range(1, rounds + 1):
+        sent = 0
+        for cipher in ciphers:
+            iv, data = cipher.encrypt(seq, wire.encode("chat", {"user": "alice", "Seq": seq,
+                                                                "msgNo": seq, "chat": payload}))
+            sent += len(wire.encode("client", {"IV": iv, "data": data}))
+    return [(time.time() - start) * 1e6 / rounds, sent]
+
+
+def encryptOnce(members, payload, rounds):
+    '''
+        Input   : Number, String, Number (Members of the room, message, repetitions)
+        Output  : [float, Number] (Micro seconds and bytes sent per post)
+    '''
+    room = chatRoom(ROOM)
+    room.setKey(1, os.urandom(16), 1)
+    start = time.time()
+    for postNo in range(1, rounds + 1):
+        epoch, iv, data = room.seal(postNo, wire.encode("room-chat", {"user": "alice", "postNo": postNo,
+                                                                      "chat": payload}), 0)
+        sent = len(wire.encode("room-post", {"user": "alice", "room": ROOM, "epoch": epoch,
+                                             "IV": iv, "data": data}))
+    return [(time.time() - start) * 1e6 / rounds, sent]
+
+
+class lineCounter:
+    '''
+        lineCounter : Type -> class
+        purpose : Stands for sys.stdout while the clients run, counts the posts printed
+    '''
+    def __init__(self):
+        self.count = 0
+
+    def write(self, text):
+        self.count += text.count("[" + ROOM + "]")
+
+    def flush(self):
+        pass
+
+
+def pump(clients, until, limit):
+    '''
+        Input   : List, function, float (Connections, stop condition, seconds at most)
+        Purpose : Read what the server sends and retransmit requests until until() holds
+    '''
+    end = time.time() + limit
+    sockets = dict((client.getSock(), client) for client in clients)
+    while not until() and time.time() < end:
+        timers = [t for t in (client.getTimerInterval() for client in clients) if t is not None]
+        ready = select.select(sockets.keys(), [], [], min(timers + [0.05]))[0]
+        for client in clients:
+            client.retransmit()
+        for sock in ready:
+            sockets[sock].handleServerMessage()
+
+
+def fanOut(options):
+    '''
+        Input   : Dictionary (options)
+        Output  : [float, Number, Number] (Posts read per second by the members, posts
+                    read, posts expected)
+    '''
+    config = readClientConfig()
+    directory = prepareServer(options["members"], config)
+    process = startServer(directory, options["port"], [])
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    counter = lineCounter()
+    try:
+        os.chdir(CLIENT_DIR)
+        import clientConnection
+        clients = []
+        sys.stdout = counter
+        for i in range(options["members"]):
+            client = clientConnection.connection(USER_PREFIX + str(i), USER_PREFIX + str(i), options["port"])
+            if not client.establishConnection():
+                raise Exception("Login of " + USER_PREFIX + str(i) + " failed")
+            clients.append(client)
+        for client in clients:
+            client.handleClientMessage("join " + ROOM)
+            pump(clients, lambda: False, 0.01)
+        pump(clients, lambda: False, 1)
+        counter.count = 0
+        expected = options["posts"] * (len(clients) - 1)
+        payload = ["x" * options["size"]]
+        start = time.time()
+        for i in range(options["posts"]):
+            clients[0].sendMessageToRoom([ROOM] + payload)
+            pump(clients, lambda: False, options["gap"] / 1000.0)
+        pump(clients, lambda: counter.count >= expected, 2)
+        elapsed = time.time() - start
+    finally:
+        sys.stdout = stdout
+        os.chdir(cwd)
+        stopServer(process)
+        shutil.rmtree(directory, True)
+    return [counter.count / elapsed, counter.count, expected]
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "members"   : 200,
+        "posts"     : 200,
+        "gap"       : 5,
+        "size"      : 200,
+        "port"      : 24260,
+    }
+    options = readOptions(options, __doc__)
+    options["members"] = max(options["members"], 2)
+    return options
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < options["members"] + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, options["members"] + 64), hard))
+    payload = "x" * options["size"]
+    sizes = [size for size in SIZES if size < options["members"]] + [options["members"]]
+    print "%8s %16s %16s %16s %16s" % ("members", "pairwise seal us", "room seal us",
+                                       "pairwise uplink", "room uplink")
+    for members in sizes:
+        rounds = max(20000 / members, 10)
+        slow, many = pairwise(members, payload, rounds)
+        fast, once = encryptOnce(members, payload, rounds)
+        print "%8d %16.1f %16.1f %16d %16d" % (members, slow, fast, many, once)
+    print
+    print "fan-out to %d members, %d posts of %d bytes" % (options["members"] - 1, options["posts"],
+                                                          options["size"])
+    rate, read, expected = fanOut(options)
+    print "%.0f posts read/s, %d of %d read, %d lost" % (rate, read, expected, expected - read)
@@ -0,0 +1,147 @@
+'''
+        Session table benchmark
+
+        Logs -sessions simulated users in (a 16 byte key and an address each) in
+        the session table of the server (Server/sessionTable.py, one __slots__
+        record per user indexed by name and address in one dictionary) and in the
+        layout it replaced (six dictionaries per user: key and address list,
+        replayWindow object, send sequence, address to user, last request time).
+        Each layout is built in its own process; "MB" is the growth of its
+        resident memory, "bytes/session" that divided by the sessions (the user
+        names, keys and addresses are made before, only what the layout adds to
+        them is counted; getStats of the table counts them too). Then times
+        -lookups lookups by user name and by address and the anti replay check of
+        a request (checkSequence).
+
+        Usage : python sessionTableBench.py [-sessions N] [-lookups N]
+        Note  : Linux only (memory is read from /proc/self/statm)
+'''
+
+import os,sys,time,json,random,resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+from sessionTable import sessionTable
+from replayWindow import replayWindow
+from benchOptions import readOptions
+
+
+class dictLayout:
+    '''
+        dictLayout : Type -> class
+        purpose : The session state of sessionStore before sessionTable, for comparison
+    '''
+    def __init__(self):
+        self.__sessionKeyDict   = {}
+        self.__replayWindows    = {}
+        self.__sendSequence     = {}
+        self.__connectedClients = {}
+        self.__lastSeen         = {}
+
+    def setSession(self, user, key, address):
+        self.__sessionKeyDict[user] = [key, address]
+        self.__replayWindows[user] = replayWindow()
+        self.__sendSequence[user] = 0
+        self.__connectedClients[address] = user
+        self.__lastSeen[user] = time.time()
+
+    def getSession(self, user):
+        return self.__sessionKeyDict.get(user)
+
+    def findUser(self, address):
+        return self.__connectedClients.get(address, False)
+
+    def checkSequence(self, user, sequence):
+        window = self.__replayWindows.get(user)
+        if window is None or not window.check(sequence):
+            return False
+        self.__lastSeen[user] = time.time()
+        return True
+
+
+def residentBytes():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+def measure(layout, options):
+    '''
+        Input   : String, Dictionary ("table" or "dicts", options)
+        Output  : Dictionary (Memory and lookup times of the layout)
+    '''
+    count = options["sessions"]
+    users = ["user%07d" % i for i in range(count)]
+    addresses = [("10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255), 1024 + i % 60000)
+                 for i in range(count)]
+    keys = [os.urandom(16) for i in range(count)]
+    probes = [random.randrange(count) for i in range(options["lookups"])]
+    before = residentBytes()
+    start = time.time()
+    table = sessionTable() if layout == "table" else dictLayout()
+    for i in range(count):
+        table.setSession(users[i], keys[i], addresses[i])
+    built = time.time() - start
+    grown = residentBytes() - before
+
+    results = {"MB": grown / float(1 << 20), "bytes": grown / count, "build": built * 1e6 / count}
+    for name, lookup in (("byUser", lambda i: table.getSession(users[i])),
+                         ("byAddress", lambda i: table.findUser(addresses[i])),
+                         ("replay", lambda i: table.checkSequence(users[i], 1))):
+        start = time.time()
+        for i in probes:
+            lookup(i)
+        results[name] = (time.time() - start) * 1e9 / len(probes)
+    if layout == "table":
+        results["reported"] = table.sessionBytes()
+    return results
+
+
+def inChild(layout, options):
+    '''
+        Input   : String, Dictionary
+        Output  : Dictionary (Result of measure, run in a child process so every layout
+                    starts from the same memory)
+    '''
+    reader, writer = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(reader)
+        os.write(writer, json.dumps(measure(layout, options)))
+        os._exit(0)
+    os.close(writer)
+    data = ""
+    while True:
+        chunk = os.read(reader, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(reader)
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "sessions"  : 1000000,
+        "lookups"   : 1000000,
+    }
+    options = readOptions(options, __doc__)
+    options["sessions"] = max(options["sessions"], 1)
+    options["lookups"] = max(options["lookups"], 1)
+    return options
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    print "%d sessions, %d lookups" % (options["sessions"], options["lookups"])
+    print "%-8s %8s %14s %10s %12s %14s %12s" % ("layout", "MB", "bytes/session", "login us",
+                                                  "by user ns", "by address ns", "replay ns")
+    for layout in ("dicts", "table"):
+        result = inChild(layout, options)
+        print "%-8s %8.1f %14d %10.2f %12.0f %14.0f %12.0f" % (
+            layout, result["MB"], result["bytes"], result["build"], result["byUser"],
+            result["byAddress"], result["replay"])
+    print "table reports %d bytes/session (getStats)" % result["reported"]
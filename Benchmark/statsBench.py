@@ -0,0 +1,81 @@
+'''
+        Instrumentation overhead benchmark
+
+        Sends list requests of an authenticated session straight through
+        Connection.parseObject (no socket) with the stats enabled and disabled and
+        prints the cost per request, then the cost of one histogram record.
+
+        Usage : python statsBench.py [-requests N] [-users N]
+        Note  : Server/private_key.pem must exist (see README)
+'''
+
+import os,sys,time
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server")
+sys.path.insert(0, SERVER_DIR)
+import wire
+from sessionStore import sessionStore
+from serverConnection import Connection
+from symetric import symetric,CLIENT_TO_SERVER,SERVER_TO_CLIENT
+from stats import serverStats,latencyHistogram
+from benchOptions import readOptions
+
+
+def listRequests(requests):
+    '''
+        Input   : Number (Requests to generate)
+        Output  : [String,List] -> The session key and the encrypted list packets
+    '''
+    key = os.urandom(16)
+    cipher = symetric(key, CLIENT_TO_SERVER, SERVER_TO_CLIENT)
+    packets = []
+    for seq in range(1, requests + 1):
+        iv, message = cipher.encrypt(seq, wire.encode("list", {"user": "alice", "Seq": seq}))
+        packets.append(wire.encode("sym", {"IV": iv, "message": message}))
+    return key, packets
+
+
+def run(enabled, requests, users):
+    '''
+        Input   : Boolean, Number, Number (Stats enabled, requests, users in the list)
+        Output  : Number (Micro seconds per request)
+    '''
+    store = sessionStore()
+    connection = Connection(store, stats=serverStats(enabled=enabled))
+    key, packets = listRequests(requests)
+    address = ("127.0.0.1", 40000)
+    store.setSession("alice", key, address)
+    for i in range(users):
+        store.setSession("user" + str(i), os.urandom(16), ("127.0.0.2", 1024 + i))
+    start = time.time()
+    for packet in packets:
+        response, to = connection.parseData(packet, address)
+        assert response
+    return (time.time() - start) / requests * 1000000
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "requests"  : 50000,
+        "users"     : 10,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    os.chdir(SERVER_DIR)
+    disabled = min(run(False, options["requests"], options["users"]) for i in range(3))
+    enabled = min(run(True, options["requests"], options["users"]) for i in range(3))
+    print "list request, stats disabled  %.2f us" % disabled
+    print "list request, stats enabled   %.2f us (%.1f%% overhead)" % (
+        enabled, (enabled - disabled) / disabled * 100)
+    histogram = latencyHistogram()
+    start = time.time()
+    for i in xrange(options["requests"]):
+        histogram.record(i & 4095)
+    print "histogram record              %.2f us" % ((time.time() - start) / options["requests"] * 1000000)
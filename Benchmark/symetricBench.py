@@ -0,0 +1,69 @@
+'''
+        Symetric encryption benchmark
+
+        Measures messages/sec for the session encryption. "per message" is the way
+        it used to be done: a fresh Cipher(AES, CFB) context and a random IV from
+        os.urandom for every message. "cached" is the symetric class, one AES-GCM
+        context per session key and a nonce derived from the sequence number.
+        Every round trip encrypts and decrypts one message.
+
+        Usage : python symetricBench.py [-messages N]
+'''
+
+import os,sys,time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+from symetric import symetric,CLIENT_TO_SERVER,SERVER_TO_CLIENT
+from benchOptions import readOptions
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+
+
+def perMessage(key, message, messages):
+    '''
+        Input   : String, String, Number (Key, plain text, messages to send)
+        Output  : Number (Messages per second)
+    '''
+    start = time.time()
+    for i in range(messages):
+        iv = os.urandom(16)
+        encryptor = Cipher(algorithms.AES(key), modes.CFB(iv), backend=default_backend()).encryptor()
+        cipherText = encryptor.update(message) + encryptor.finalize()
+        decryptor = Cipher(algorithms.AES(key), modes.CFB(iv), backend=default_backend()).decryptor()
+        decryptor.update(cipherText) + decryptor.finalize()
+    return messages / (time.time() - start)
+
+
+def cached(key, message, messages):
+    '''
+        Input   : String, String, Number (Key, plain text, messages to send)
+        Output  : Number (Messages per second)
+    '''
+    sender = symetric(key, CLIENT_TO_SERVER, SERVER_TO_CLIENT)
+    receiver = symetric(key, SERVER_TO_CLIENT, CLIENT_TO_SERVER)
+    start = time.time()
+    for i in range(1, messages + 1):
+        nonce, cipherText = sender.encrypt(i, message)
+        receiver.decrypt(nonce, cipherText)
+    return messages / (time.time() - start)
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "messages"  : 50000,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    key = os.urandom(16)
+    print "%8s %18s %18s" % ("bytes", "per message msg/s", "cached msg/s")
+    for size in (64, 512, 4096, 65000):
+        message = os.urandom(size)
+        print "%8d %18.0f %18.0f" % (size, perMessage(key, message, options["messages"]),
+                                     cached(key, message, options["messages"]))
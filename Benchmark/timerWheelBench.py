@@ -0,0 +1,66 @@
+'''
+        Timer wheel benchmark
+
+        Schedules N timers (sessions with random idle deadlines), moves a part of
+        them again, then advances the wheel tick by tick until every timer fired.
+        The cost of one tick is compared with scanning a dictionary of deadlines,
+        which is what expiring without a wheel would take on every tick.
+
+        Usage : python timerWheelBench.py [-timers N] [-seconds N]
+'''
+
+import os,sys,time,random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+from timerWheel import timerWheel
+from benchOptions import readOptions
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "timers"    : 1000000,
+        "seconds"   : 900,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    timers, seconds = options["timers"], options["seconds"]
+    delays = [random.uniform(1, seconds) for i in range(timers)]
+    wheel = timerWheel(tick=0.1, now=0)
+
+    start = time.time()
+    for i in range(timers):
+        wheel.schedule(i, delays[i])
+    schedule = time.time() - start
+
+    moved = timers // 10
+    start = time.time()
+    for i in range(moved):
+        wheel.schedule(i, delays[i] / 2)
+    reschedule = time.time() - start
+
+    ticks = int(seconds / 0.1) + 1
+    fired = 0
+    start = time.time()
+    for tick in range(1, ticks + 1):
+        fired += len(wheel.advance(tick * 0.1))
+    advance = time.time() - start
+    assert fired == timers and len(wheel) == 0
+
+    deadlines = dict(enumerate(delays))
+    start = time.time()
+    [key for key, deadline in deadlines.iteritems() if deadline <= 1.0]
+    scan = time.time() - start
+
+    print "timers              %d" % timers
+    print "schedule            %.2f us / timer" % (schedule / timers * 1000000)
+    print "reschedule          %.2f us / timer" % (reschedule / moved * 1000000)
+    print "advance + expire    %.1f us / tick (%d ticks, %.2f us / timer)" % (
+        advance / ticks * 1000000, ticks, advance / timers * 1000000)
+    print "full scan           %.1f us / tick" % (scan * 1000000)
@@ -0,0 +1,80 @@
+'''
+        Wire format benchmark
+
+        Encodes and decodes the messages exchanged during a session (handshake,
+        list, talk and chat) with pickle, which was used on the network before, and
+        with the fixed layout of wire.py. Prints the size of every message and the
+        encode / decode cost per message.
+
+        Usage : python wireBench.py [-rounds N] [-users N]
+'''
+
+import os,sys,time,random,pickle
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server"))
+import wire
+from benchOptions import readOptions
+
+
+def sampleMessages(users):
+    '''
+        Input   : Number (Users in the list response)
+        Output  : List of (packet type, fields)
+    '''
+    return [
+        ("now-online",    {"user": "alice"}),
+        ("quiz-response", {"user": "alice", "answer": 123456, "pubKey": random.getrandbits(2048),
+                           "challange": os.urandom(16), "space": 1 << 16, "timestamp": 1700000000}),
+        ("complete",      {"user": "alice", "hash": random.getrandbits(2048)}),
+        ("sym",           {"IV": os.urandom(16), "message": os.urandom(64)}),
+        ("list",          {"user": "alice", "Seq": 42}),
+        ("users",         {"Seq": 42, "request": 41, "users": ["user" + str(i) for i in range(users)]}),
+        ("ticket",        {"Seq": 43, "request": 42, "Key": os.urandom(16), "ticket": os.urandom(96),
+                           "IV": os.urandom(16), "address": ("127.0.0.1", 50123)}),
+        ("chat",          {"user": "alice", "Seq": 7, "msgNo": 3, "chat": "hello bob, how are you doing"}),
+        ("resume",        {"user": "alice", "ticket": os.urandom(64), "nonce": os.urandom(16),
+                           "proof": os.urandom(32)}),
+        ("resumed",       {"user": "alice", "nonce": os.urandom(16), "IV": os.urandom(12),
+                           "message": os.urandom(100)}),
+    ]
+
+
+def timeIt(function, rounds):
+    '''
+        Input   : function, Number
+        Output  : Number (Average micro seconds per call)
+    '''
+    start = time.time()
+    for i in range(rounds):
+        function()
+    return (time.time() - start) / rounds * 1000000
+
+
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs
+    '''
+    options = {
+        "rounds"    : 100000,
+        "users"     : 50,
+    }
+    return readOptions(options, __doc__)
+
+
+if __name__ == "__main__":
+    options = checkOptions()
+    rounds = options["rounds"]
+    print "%-14s %12s %10s %12s %12s %12s %12s" % (
+        "message", "pickle bytes", "wire bytes", "pickle enc", "wire enc", "pickle dec", "wire dec")
+    for packetType, fields in sampleMessages(options["users"]):
+        pickleObj = dict(fields, type=packetType)
+        pickled = pickle.dumps(pickleObj)
+        encoded = wire.encode(packetType, fields)
+        assert wire.decode(encoded) == dict(fields, type=packetType)
+        print "%-14s %12d %10d %10.2fus %10.2fus %10.2fus %10.2fus" % (
+            packetType, len(pickled), len(encoded),
+            timeIt(lambda: pickle.dumps(pickleObj), rounds),
+            timeIt(lambda: wire.encode(packetType, fields), rounds),
+            timeIt(lambda: pickle.loads(pickled), rounds),
+            timeIt(lambda: wire.decode(encoded), rounds))
@@ -1,12 +1,97 @@
 import os
 import binascii
 import hashlib
+import threading
+import marshal
 
 primes = {
     "prime": 0xFFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7EDEE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB9ED529077096966D670C354E4ABC9804F1746C08CA237327FFFFFFFFFFFFFFFF,
     "generator": 2
 }
 
+class fixedBase:
+    """ Fixed base exponentiation : g^x mod p for a g and p known in advance
+
+        The table holds g^(d * 2^(window*i)) mod p for every window i of the exponent
+        and every digit d, so g^x mod p is one multiplication per window of x instead
+        of a square and multiply for every bit. Exponents wider than bits use pow
+    """
+    def __init__(self, g, p, bits=256, window=8, table=None):
+        self.g = g
+        self.p = p
+        self.bits = bits
+        self.window = window
+        self.__mask = (1 << window) - 1
+        if table is not None:
+            self.__table = table
+            return
+        self.__table = []
+        base = g % p
+        for i in range((bits + window - 1) // window):
+            row = [1] * (1 << window)
+            acc = 1
+            for digit in range(1, 1 << window):
+                acc = acc * base % p
+                row[digit] = acc
+            self.__table.append(row)
+            base = acc * base % p               # g^(2^(window*(i+1)))
+
+    def pow(self, x):
+        # calculate g^x mod p using the table
+        if x < 0 or x >> self.bits:
+            return pow(self.g, x, self.p)
+        result = 1
+        for row in self.__table:
+            if not x:
+                break
+            digit = x & self.__mask
+            if digit:
+                result = result * row[digit] % self.p
+            x >>= self.window
+        return result
+
+    def save(self, path):
+        # write the table to path so the next process does not have to build it
+        tmpPath = path + "." + str(os.getpid())
+        with open(tmpPath, "wb") as table_file:
+            marshal.dump((self.g, self.p, self.bits, self.window, self.__table), table_file)
+        os.rename(tmpPath, path)
+
+    @staticmethod
+    def load(path, g, p, bits=256, window=8):
+        # read a table written by save, None if it is missing or for other parameters
+        try:
+            with open(path, "rb") as table_file:
+                saved = marshal.load(table_file)
+            if saved[:4] != (g, p, bits, window) or len(saved[4]) != (bits + window - 1) // window \
+                    or saved[4][0][1] != g % p:
+                return None
+            return fixedBase(g, p, bits, window, saved[4])
+        except Exception:
+            return None
+
+TABLE_FILE = "DH.table"                         # Cached table of the generator, in the working directory
+_generatorTable = None
+_tableLock = threading.Lock()
+
+def fixedBasePow(g, x, p):
+    # calculate g^x mod p, with the shared table when g and p are the Diffie-Hellman group
+    global _generatorTable
+    if g != primes["generator"] or p != primes["prime"]:
+        return pow(g, x, p)
+    if _generatorTable is None:
+        with _tableLock:
+            if _generatorTable is None:
+                table = fixedBase.load(TABLE_FILE, g, p)
+                if table is None:
+                    table = fixedBase(g, p)
+                    try:
+                        table.save(TABLE_FILE)
+                    except (IOError, OSError):
+                        pass
+                _generatorTable = table
+    return _generatorTable.pow(x)
+
 class DiffieHellman:
     """ Class to represent the Diffie-Hellman key exchange protocol """
     def __init__(self):
@@ -20,7 +105,7 @@ class DiffieHellman:
 
     def gen_public_key(self):
         # calculate G^a mod p and returns the same
-        return pow(self.g, self.__a, self.p)
+        return fixedBasePow(self.g, self.__a, self.p)
 
     def gen_shared_key(self, other_contribution):
         # calculate the shared key G^ab mod p
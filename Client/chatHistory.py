@@ -0,0 +1,475 @@
+'''
+        Encrypted chat history of the client
+
+        Every message printed or sent is appended to history.log in the history
+        directory of the user as
+            | length (4 bytes) | nonce (12 bytes) | AES-GCM cipher text |
+        the plain text being
+            | time (8 bytes) | peer (2 byte length + bytes) | author (idem) | text (4 byte length + bytes) |
+        A peer is the user talked to, or #room. The key is derived from the password
+        of the user (PBKDF2), records are numbered in the order they are appended.
+
+        The indexes live in memory:
+            offsets     position of every record in the log
+            peers       peer token : record numbers of the peer
+            words       word token : record numbers holding the word (inverted index)
+        so scrolling back through a peer or searching reads and decrypts only the
+        records shown. A token is 8 bytes of HMAC(key, peer or word): history.idx
+        keeps, next to the log,
+            | offset | peer token | number of words | word tokens ... |    (8 bytes each)
+        so the indexes are built again at start without decrypting the log, and
+        shows which records share a word but not the words. close saves the indexes
+        (history.snap, the same tokens) and the size of history.idx they cover, a
+        start loads them and reads only the entries written after. Records the index file
+        missed (the client stopped between the two writes) are decrypted and indexed
+        again, a torn record at the end of the log is cut off.
+
+        Records are encrypted when they are added and written by a background
+        thread in batches, the select loop of the client never waits for the disk.
+        Records not written yet are read from memory.
+'''
+
+import os,re,sys,hmac,array,bisect,struct,hashlib,threading
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+
+KEY_ROUNDS = 100000                     # PBKDF2 rounds of the history key
+BATCH_SIZE = 256                        # Records the writer waits for ...
+BATCH_DELAY = 0.05                      # ... at most this many seconds, then writes what it has
+MAX_WORDS = 64                          # Words of one message put in the inverted index
+MAX_CACHED_TOKENS = 65536               # Tokens of the words and peers seen last
+LOG_FILE = "history.log"
+INDEX_FILE = "history.idx"
+SNAPSHOT_FILE = "history.snap"
+CHECK_FILE = "check"
+
+_length = struct.Struct("!H")
+_longLength = struct.Struct("!I")
+_time = struct.Struct("!d")
+_token = struct.Struct("!Q")
+_snapshot = struct.Struct("<QQQQ")      # history.idx bytes covered, records, peers, words
+_postings = struct.Struct("<QQ")        # token, number of records
+_words = re.compile(r"\w+", re.UNICODE)
+_U64 = "L"                              # array of 8 byte integers (unsigned long of 64 bit builds)
+
+
+def historyKey(username, password):
+    '''
+        historyKey(String,String):
+            Input   : User name and password
+            Output  : String (32 byte key of the history of the user)
+    '''
+    return hashlib.pbkdf2_hmac("sha256", password, "chat history " + username, KEY_ROUNDS)
+
+
+def splitWords(text):
+    '''
+        splitWords(String):
+            Input   : A message or a search
+            Output  : List (The distinct words, lower case, at most MAX_WORDS)
+    '''
+    words = []
+    for word in _words.findall(text.lower()):
+        if word not in words:
+            words.append(word)
+            if len(words) == MAX_WORDS:
+                break
+    return words
+
+
+def _pack(when, peer, author, text):
+    return "".join([_time.pack(when), _length.pack(len(peer)), peer, _length.pack(len(author)), author,
+                    _longLength.pack(len(text)), text])
+
+
+def _unpack(plainText):
+    '''
+        _unpack(String):
+            Input   : Decrypted record
+            Output  : [float, String, String, String] -> Time, peer, author and text
+    '''
+    fields = [_time.unpack_from(plainText)[0]]
+    offset = _time.size
+    for length in (_length, _length, _longLength):
+        size = length.unpack_from(plainText, offset)[0]
+        offset += length.size
+        fields.append(plainText[offset:offset + size])
+        offset += size
+    return fields
+
+
+def _contains(records, recordNo):
+    position = bisect.bisect_left(records, recordNo)
+    return position < len(records) and records[position] == recordNo
+
+
+class chatHistory:
+    '''
+        chatHistory : Type -> class
+        purpose : Keeps the chat messages of a user, encrypted on disk, and finds them
+                    again by peer or by word
+        Features : a) add returns at once, a background thread writes the records in
+                        batches (see BATCH_SIZE and BATCH_DELAY)
+                   b) recent and search read only the records they return
+                   c) The indexes are saved by close (history.snap) and loaded at start,
+                        with the entries of history.idx written since
+        Note : Words are matched whole and lower case. Call close before the client
+                exits, records not written yet are lost otherwise
+    '''
+    def __init__(self, directory, key):
+        '''
+            __init__(String,String):
+                Input   : Directory of the history (created if missing) and the key given
+                            by historyKey
+                Output  : None
+                Raises  : ValueError if the history was written with another key
+        '''
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        check = hmac.new(key, "check", hashlib.sha256).digest()
+        checkPath = os.path.join(directory, CHECK_FILE)
+        if os.path.exists(checkPath):
+            with open(checkPath, "rb") as check_file:
+                if not hmac.compare_digest(check_file.read(), check):
+                    raise ValueError("history written with another key")
+        else:
+            with open(checkPath, "wb") as check_file:
+                check_file.write(check)
+        self.__aead = AESGCM(hmac.new(key, "log", hashlib.sha256).digest())
+        self.__tokenMac = hmac.new(hmac.new(key, "index", hashlib.sha256).digest(), "", hashlib.sha256)
+        self.__tokens = {}                      # "p" + peer or "w" + word : token
+        self.__offsets = array.array(_U64)      # record number : position in the log
+        self.__peers = {}                       # peer token : array of record numbers
+        self.__words = {}                       # word token : array of record numbers
+        self.__directory = directory
+        logPath = os.path.join(directory, LOG_FILE)
+        self.__log = os.open(logPath, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0600)
+        self.__index = os.open(os.path.join(directory, INDEX_FILE), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0600)
+        self.__reader = open(logPath, "rb")
+        self.__end = self.__load(directory)     # Position of the next record
+        self.__condition = threading.Condition()
+        self.__queue = []                       # [record number, record, index entry] waiting for the writer
+        self.__unwritten = {}                   # record number : record, until written
+        self.__closing = False
+        self.__batches = 0
+        self.__writer = threading.Thread(target=self.__write)
+        self.__writer.daemon = True
+        self.__writer.start()
+
+    def __tokenOf(self, kind, value):
+        '''
+            __tokenOf(String,String):
+                Input   : "p" for a peer, "w" for a word, and the peer or word
+                Output  : Number (Its 8 byte token, the same for the same key)
+        '''
+        token = self.__tokens.get(kind + value)
+        if token is None:
+            if len(self.__tokens) >= MAX_CACHED_TOKENS:
+                self.__tokens.clear()
+            mac = self.__tokenMac.copy()
+            mac.update(kind + value)
+            token = _token.unpack_from(mac.digest())[0]
+            self.__tokens[kind + value] = token
+        return token
+
+    def __entry(self, offset, peer, words):
+        '''
+            __entry(Number,String,List):
+                Input   : Position of a record, its peer and the words of its text
+                Output  : array (The entry of the record in history.idx)
+        '''
+        entry = array.array(_U64, [offset, self.__tokenOf("p", peer), len(words)])
+        entry.extend(self.__tokenOf("w", word) for word in words)
+        return entry
+
+    def __addToIndex(self, entry, start):
+        '''
+            __addToIndex(array,Number):
+                Input   : Entries of history.idx and where the entry of one record starts
+                Output  : Number (Where the next entry starts)
+        '''
+        recordNo = len(self.__offsets)
+        self.__offsets.append(entry[start])
+        records = self.__peers.get(entry[start + 1])
+        if records is None:
+            records = self.__peers[entry[start + 1]] = array.array("I")
+        records.append(recordNo)
+        end = start + 3 + entry[start + 2]
+        for position in xrange(start + 3, end):
+            records = self.__words.get(entry[position])
+            if records is None:
+                records = self.__words[entry[position]] = array.array("I")
+            records.append(recordNo)
+        return end
+
+    @staticmethod
+    def __toDisk(entries):
+        '''
+            __toDisk(array):
+                Input   : Entries of history.idx (or an index saved in history.snap)
+                Output  : String (The entries, little endian whatever the machine)
+        '''
+        if sys.byteorder != "little":
+            entries = array.array(entries.typecode, entries)
+            entries.byteswap()
+        return entries.tostring()
+
+    @staticmethod
+    def __fromDisk(typecode, data):
+        entries = array.array(typecode)
+        entries.fromstring(data[:len(data) - len(data) % entries.itemsize])
+        if sys.byteorder != "little":
+            entries.byteswap()
+        return entries
+
+    def __saveSnapshot(self, path):
+        '''
+            __saveSnapshot(String):
+                Input   : Path of history.snap
+                Output  : None
+                Purpose : Save the indexes and the size of history.idx they cover, written
+                            to a new file renamed over the old one
+        '''
+        parts = [_snapshot.pack(os.fstat(self.__index).st_size, len(self.__offsets), len(self.__peers),
+                                len(self.__words)), self.__toDisk(self.__offsets)]
+        for table in (self.__peers, self.__words):
+            for token, records in table.iteritems():
+                parts.append(_postings.pack(token, len(records)))
+                parts.append(self.__toDisk(records))
+        with open(path + ".new", "wb") as snapshot_file:
+            snapshot_file.write("".join(parts))
+        os.rename(path + ".new", path)
+
+    def __loadSnapshot(self, path, indexSize, logSize):
+        '''
+            __loadSnapshot(String,Number,Number):
+                Input   : Path of history.snap and the sizes of history.idx and of the log
+                Output  : Number (Bytes of history.idx the indexes loaded cover, 0 if there
+                            is no snapshot or it does not match the files)
+        '''
+        try:
+            with open(path, "rb") as snapshot_file:
+                data = snapshot_file.read()
+            covered, records, peers, words = _snapshot.unpack_from(data)
+            position = _snapshot.size + records * 8
+            offsets = self.__fromDisk(_U64, data[_snapshot.size:position])
+            if covered > indexSize or len(offsets) != records or (records and offsets[-1] >= logSize):
+                return 0
+            tables = [{}, {}]
+            for table, count in zip(tables, (peers, words)):
+                for i in xrange(count):
+                    token, length = _postings.unpack_from(data, position)
+                    position += _postings.size
+                    table[token] = self.__fromDisk("I", data[position:position + length * 4])
+                    position += length * 4
+        except (IOError, struct.error):
+            return 0
+        self.__offsets = offsets
+        self.__peers, self.__words = tables
+        return covered
+
+    def __load(self, directory):
+        '''
+            __load(String):
+                Input   : Directory of the history
+                Output  : Number (Size of the log, after cutting a torn record)
+                Purpose : Load the indexes saved in history.snap, add the entries written
+                            to history.idx since, then index the records of the log it missed
+        '''
+        size = os.fstat(self.__log).st_size
+        covered = self.__loadSnapshot(os.path.join(directory, SNAPSHOT_FILE),
+                                      os.fstat(self.__index).st_size, size)
+        with open(os.path.join(directory, INDEX_FILE), "rb") as index_file:
+            index_file.seek(covered)
+            entries = self.__fromDisk(_U64, index_file.read())
+        start = 0
+        while start + 3 <= len(entries) and start + 3 + entries[start + 2] <= len(entries) and \
+                entries[start] < size:
+            start = self.__addToIndex(entries, start)
+        os.ftruncate(self.__index, covered + start * entries.itemsize)
+        position = 0
+        if self.__offsets:
+            position = self.__offsets[-1] + len(self.__readRecord(self.__offsets[-1]))
+        while position < size:
+            record = self.__readRecord(position)
+            fields = self.__open(record) if record is not None else None
+            if fields is None:
+                break
+            entry = self.__entry(position, fields[1], splitWords(fields[3]))
+            self.__addToIndex(entry, 0)
+            os.write(self.__index, self.__toDisk(entry))
+            position += len(record)
+        if position < size:
+            os.ftruncate(self.__log, position)
+        return position
+
+    def __readRecord(self, offset):
+        '''
+            __readRecord(Number):
+                Input   : Position of a record in the log
+                Output  : String -> The record, with its length
+                          None   -> If the log ends before the record does
+        '''
+        self.__reader.seek(offset)
+        header = self.__reader.read(_longLength.size)
+        if len(header) < _longLength.size:
+            return None
+        record = header + self.__reader.read(_longLength.unpack(header)[0])
+        if len(record) < _longLength.size + _longLength.unpack(header)[0]:
+            return None
+        return record
+
+    def __open(self, record):
+        '''
+            __open(String):
+                Input   : A record of the log
+                Output  : [float, String, String, String] -> Time, peer, author and text
+                          None -> If the record cannot be decrypted
+        '''
+        start = _longLength.size
+        try:
+            return _unpack(self.__aead.decrypt(record[start:start + 12], record[start + 12:], None))
+        except (InvalidTag, ValueError, struct.error):
+            return None
+
+    def add(self, peer, author, text, when):
+        '''
+            add(String,String,String,float):
+                Input   : The user talked to (or #room), the author of the message, the
+                            message and the time it was sent or received
+                Output  : Number (Number of the record)
+        '''
+        nonce = os.urandom(12)
+        sealed = nonce + self.__aead.encrypt(nonce, _pack(when, peer, author, text), None)
+        record = _longLength.pack(len(sealed)) + sealed
+        entry = self.__entry(self.__end, peer, splitWords(text))
+        self.__end += len(record)
+        with self.__condition:
+            recordNo = len(self.__offsets)
+            self.__addToIndex(entry, 0)
+            self.__unwritten[recordNo] = record
+            self.__queue.append([recordNo, record, entry])
+            if len(self.__queue) == 1 or len(self.__queue) >= BATCH_SIZE:
+                self.__condition.notify_all()
+        return recordNo
+
+    def __write(self):
+        '''
+            __write(None):
+                Purpose : Background thread, writes the records added (and their index
+                            entries) with one system call per file and batch
+        '''
+        while True:
+            with self.__condition:
+                while not self.__queue and not self.__closing:
+                    self.__condition.wait()
+                if len(self.__queue) < BATCH_SIZE and not self.__closing:
+                    self.__condition.wait(BATCH_DELAY)
+                batch, self.__queue = self.__queue, []
+                closing = self.__closing
+            if batch:
+                self.__writeAll(self.__log, "".join(record for recordNo, record, entry in batch))
+                self.__writeAll(self.__index, "".join(self.__toDisk(entry) for recordNo, record, entry in batch))
+                with self.__condition:
+                    for recordNo, record, entry in batch:
+                        del self.__unwritten[recordNo]
+                    self.__batches += 1
+                    self.__condition.notify_all()
+            elif closing:
+                return
+
+    @staticmethod
+    def __writeAll(descriptor, data):
+        while data:
+            data = data[os.write(descriptor, data):]
+
+    def __read(self, recordNo):
+        '''
+            __read(Number):
+                Input   : Number of a record
+                Output  : [float, String, String, String] -> Time, peer, author and text
+        '''
+        with self.__condition:
+            record = self.__unwritten.get(recordNo)
+        if record is None:
+            record = self.__readRecord(self.__offsets[recordNo])
+        return self.__open(record)
+
+    def recent(self, peer, count, skip=0):
+        '''
+            recent(String,Number,Number):
+                Input   : A peer, the number of messages wanted and the number of the
+                            latest ones to skip (to scroll back further)
+                Output  : List of [time, peer, author, text], oldest first
+        '''
+        with self.__condition:
+            records = self.__peers.get(self.__tokenOf("p", peer), [])
+            end = max(len(records) - skip, 0)
+            records = records[max(end - count, 0):end]
+        return [self.__read(recordNo) for recordNo in records]
+
+    def search(self, text, count, peer=None):
+        '''
+            search(String,Number,String):
+                Input   : Words to look for, the number of messages wanted and the peer
+                            to search (None for every peer)
+                Output  : List of [time, peer, author, text] (The latest messages holding
+                            all the words, oldest first)
+        '''
+        words = splitWords(text)
+        if not words:
+            return []
+        found = []
+        with self.__condition:
+            lists = [self.__words.get(self.__tokenOf("w", word)) for word in words]
+            if peer is not None:
+                lists.append(self.__peers.get(self.__tokenOf("p", peer)))
+            if None in lists:
+                return []
+            lists.sort(key=len)
+            for recordNo in reversed(lists[0]):
+                if all(_contains(records, recordNo) for records in lists[1:]):
+                    found.append(recordNo)
+                    if len(found) == count:
+                        break
+        return [self.__read(recordNo) for recordNo in reversed(found)]
+
+    def flush(self):
+        '''
+            flush(None):
+                Purpose : Wait until every record added was written
+        '''
+        with self.__condition:
+            self.__condition.notify_all()
+            while self.__unwritten:
+                self.__condition.wait()
+
+    def close(self):
+        '''
+            close(None):
+                Purpose : Write the records waiting, stop the writer and save the indexes
+                            so the next start does not read all of history.idx
+        '''
+        with self.__condition:
+            self.__closing = True
+            self.__condition.notify_all()
+        self.__writer.join()
+        self.__saveSnapshot(os.path.join(self.__directory, SNAPSHOT_FILE))
+        os.close(self.__log)
+        os.close(self.__index)
+        self.__reader.close()
+
+    def getStats(self):
+        '''
+            getStats(None):
+                Output  : Dictionary (Records, peers, distinct words, records not written
+                            yet and batches written)
+        '''
+        with self.__condition:
+            return {
+                "records"   : len(self.__offsets),
+                "peers"     : len(self.__peers),
+                "words"     : len(self.__words),
+                "unwritten" : len(self.__unwritten),
+                "batches"   : self.__batches,
+            }
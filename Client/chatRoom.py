@@ -0,0 +1,135 @@
+'''
+        Client side state of a chat room
+
+        The server gives every member the key of the room, its epoch (it grows each
+        time the key changes, when a member leaves) and a sender number. A post is
+        encrypted once with the room key, the nonce is the sender number and a
+        counter (see symetric.py), and sent once to the server which forwards the
+        same bytes to the other members. Posts are numbered with postNo, taken from
+        the clock so it keeps growing when a client logs in again, members drop the
+        posts of a user they already printed.
+'''
+
+import time,collections
+from symetric import symetric
+from replayWindow import replayWindow
+
+RESEND_TIME = 2                     # Seconds a post is kept to be sent again under a new key
+MAX_HELD = 16                       # Posts kept while waiting for the key of a newer epoch
+
+
+class chatRoom:
+    '''
+        chatRoom : Type -> class
+        purpose : Key, epoch and received posts of one room the user joined
+        Features : a) The key of the previous epoch is kept for posts sent before a
+                        change of key
+                   b) Posts of an epoch newer than the key are held until the key arrives
+                   c) Posts sent shortly before a change of key can be sent again, the
+                        server drops posts encrypted with an old key
+    '''
+    def __init__(self, name):
+        '''
+            __init__(String):
+                Input   : Name of the room
+                Output  : None
+        '''
+        self.__name = name
+        self.__epoch = 0                        # 0 until the first key
+        self.__cipher = None
+        self.__previous = [0, None]             # [epoch, symetric] before the last change
+        self.__counter = 0                      # Nonce counter, starts again with every key
+        self.__requested = 0                    # Newest epoch whose key was asked for
+        self.__recent = collections.deque()     # [time, epoch, postNo, plain text] sent
+        self.__held = []                        # [user, epoch, IV, data] waiting for a key
+        self.__windows = {}                     # user : replayWindow of its postNo
+
+    def getName(self):
+        return self.__name
+
+    def getEpoch(self):
+        return self.__epoch
+
+    def setKey(self, epoch, key, sender):
+        '''
+            setKey(Number,String,Number):
+                Input   : Epoch, key and sender number given by the server
+                Output  : Boolean (True if the key is newer than the one held)
+        '''
+        if epoch <= self.__epoch:
+            return False
+        self.__previous = [self.__epoch, self.__cipher]
+        self.__epoch = epoch
+        self.__cipher = symetric(key, sender, None)
+        self.__counter = 0
+        return True
+
+    def seal(self, postNo, plainText, now=None):
+        '''
+            seal(Number,String,float):
+                Input   : Number of the post, the encoded room-chat and the time
+                Output  : [Number,String,String] -> Epoch, nonce and cipher text of the post
+        '''
+        if now is None:
+            now = time.time()
+        self.__counter += 1
+        iv, data = self.__cipher.encrypt(self.__counter, plainText)
+        self.__recent.append([now, self.__epoch, postNo, plainText])
+        return [self.__epoch, iv, data]
+
+    def takeStale(self, now=None):
+        '''
+            takeStale(float):
+                Input   : Current time
+                Output  : List of [postNo, plain text] (Posts of the last RESEND_TIME seconds
+                            encrypted with an older key, to seal and send again)
+        '''
+        if now is None:
+            now = time.time()
+        while self.__recent and now - self.__recent[0][0] > RESEND_TIME:
+            self.__recent.popleft()
+        stale = [[postNo, plainText] for sent, epoch, postNo, plainText in self.__recent
+                 if epoch < self.__epoch]
+        self.__recent = collections.deque(post for post in self.__recent if post[1] >= self.__epoch)
+        return stale
+
+    def open(self, user, epoch, iv, data):
+        '''
+            open(String,Number,String,String):
+                Input   : Fields of a room-post
+                Output  : [String,Boolean] -> The plain text (None if it cannot be read) and
+                                              True if the key of a newer epoch must be asked for
+        '''
+        if epoch == self.__epoch:
+            return [self.__cipher.decrypt(iv, data), False]
+        if epoch == self.__previous[0] and self.__previous[1] is not None:
+            return [self.__previous[1].decrypt(iv, data), False]
+        if epoch < self.__epoch:
+            return [None, False]
+        if len(self.__held) < MAX_HELD:
+            self.__held.append([user, epoch, iv, data])
+        if epoch <= self.__requested:
+            return [None, False]
+        self.__requested = epoch
+        return [None, True]
+
+    def takeHeld(self):
+        '''
+            takeHeld(None):
+                Output  : List of [user, epoch, IV, data] (The posts held, to open again
+                            once a key arrived)
+        '''
+        held, self.__held = self.__held, []
+        return held
+
+    def accept(self, user, postNo):
+        '''
+            accept(String,Number):
+                Input   : Author and number of a post that was decrypted
+                Output  : Boolean (False if the post of this user was already printed)
+        '''
+        window = self.__windows.get(user)
+        if window is None:
+            window = replayWindow()
+            self.__windows[user] = window
+        return window.check(postNo)
@@ -1,6 +1,8 @@
 import sys,select,signal
 import clientConnection
 
+HISTORY_DIR = "HISTORY"                 # Encrypted chat history of every user (see chatHistory.py)
+
 class client:
     def __init__(self, port):
         print "********************************"
@@ -18,7 +20,7 @@ class client:
         '''
         userName = self.__readFromConsole("Enter Username: ").rstrip()
         password = self.__readFromConsole("Enter Password: ").rstrip()
-        serverObj = clientConnection.connection(userName, password, self.__ServerPort)
+        serverObj = clientConnection.connection(userName, password, self.__ServerPort, HISTORY_DIR)
         if serverObj.establishConnection():
             return serverObj
         else :
@@ -52,8 +54,13 @@ class client:
                "\n2. To connect to user :connect" \
                "\n3. To Send message : send <username> message" \
                "\n4. To see all clients currently connected : connected" \
-               "\n5. Logout : logout" \
-               "\n6. See usage : man" \
+               "\n5. Join or create a chat room : join <room>" \
+               "\n6. Send message to a room : room <room> message" \
+               "\n7. Leave a chat room : leave <room>" \
+               "\n8. Last messages with a user or room : history <username or #room> [count]" \
+               "\n9. Search the messages : search <words>" \
+               "\n10. Logout : logout" \
+               "\n11. See usage : man" \
                "\n**********\n\n"
 
 
@@ -88,6 +95,14 @@ class client:
             return [True, "logout"]
         elif message[0] == "connected":
             return [True, "connected"]
+        elif message[0] in ("join", "leave") and len(message) == 2:
+            return [True, " ".join(message)]
+        elif message[0] == "room" and len(message) > 2:
+            return [True, " ".join(message)]
+        elif message[0] == "history" and len(message) in (2, 3):
+            return [True, " ".join(message)]
+        elif message[0] == "search" and len(message) > 1:
+            return [True, " ".join(message)]
         elif message[0] == "send":
             if len(message) > 1 and message is not "":
                 return [False, message[1:]]
@@ -114,11 +129,13 @@ class client:
         '''
         self.__serverObj = self.__authenticateUser()
         self.__writeMessage(self.__flushManDocs())
+        self.__writeMessage("=>")
         while True:
             inputStreams = [self.__serverObj.getSock(), sys.stdin]
-            self.__writeMessage("=>")
+            # Wake up when a chat message has to be sent again
             ready_to_read, ready_to_write, in_error = \
-                select.select(inputStreams, [], [])
+                select.select(inputStreams, [], [], self.__serverObj.getTimerInterval())
+            self.__serverObj.retransmit()
             for iStream in ready_to_read:
                 if iStream == self.__serverObj.getSock():
                     # incoming message from remote server, s
@@ -131,6 +148,8 @@ class client:
                         self.__serverObj.handleClientMessage(msg[1])
                     elif msg and not msg[0]:
                         self.__serverObj.sendMessageToClient(msg[1])
+            if ready_to_read:
+                self.__writeMessage("=>")
 
 def terminalError():
     '''
@@ -1,15 +1,23 @@
 import socket
-import pickle
+import wire
 import hashlib
 import DH,binascii
-import sys,json,select
-import zlib,os
-from symetric import symetric
+import sys,os,json,select
+import zlib,time
+from fragment import fragmenter,reassembler
+from reliable import rttEstimator,reliableSender,reliableReceiver
+from pendingRequests import pendingRequests,REQUEST_TIMEOUT
+from chatRoom import chatRoom
+from chatHistory import chatHistory,historyKey
+from resumption import resumptionSecret,resumedKey,resumeProof,NONCE_SIZE
+from symetric import symetric,CLIENT_TO_SERVER,SERVER_TO_CLIENT,INITIATOR,RESPONDER
+from replayWindow import replayWindow
 from cryptography.hazmat.primitives import serialization,hashes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import padding
 
 serverPort = 0
+HISTORY_LINES = 20                      # Messages printed by history and search
 class connection:
     '''
         Connection Object is a Singleton.
@@ -18,10 +26,11 @@ class connection:
                   3) Request Server for user Keys
 
     '''
-    def __init__(self, username, password, port):
+    def __init__(self, username, password, port, historyDir=None):
         '''
-            __init__(None) :
-                Input   : None
+            __init__(String,String,Number,String) :
+                Input   : User name, password, port of the server and the directory where
+                            the chat history of every user is kept (None keeps no history)
                 Output  : None
                 Purpose : Constructor which initializes the Connection object
                           1) Reads The CLIENT.conf file and sets up essential variables
@@ -30,16 +39,40 @@ class connection:
         '''
         self.__readConfigFile()
         self.__username = username
-        self.__destHostKey = {}                     # {Address,Key}
+        self.__history = None                       # chatHistory, opened at the first login
+        self.__historyKey = None
+        if historyDir is not None:
+            self.__historyDir = os.path.join(historyDir, username)
+            self.__historyKey = historyKey(username, password)
+        self.__destHostKey = {}                     # {Username,[Address,symetric]}
+        self.__serverCipher = None                  # symetric for the session key with the server
         self.__convertPasswordToSecret(password)
-        self.__diffi = DH.DiffieHellman()
-        self.__serverNonceHistory = []
+        self.__diffi = None                         # Diffie Hellman key pair of the current handshake
+        self.__pubKey = None
+        self.__resumption = None                    # [ticket, secret, expires] to log in again in one round trip
+        self.__session = 0                          # Number of the session with the server, grows on reconnect
+        self.__sendSequence = 0                     # Last sequence number sent to server
+        self.__serverWindow = replayWindow()        # Sequence numbers received from server
+        self.__peerSequence = {}                    # {Username,Last sequence number sent}
+        self.__peerWindow = {}                      # {Username,replayWindow}
+        self.__peerLinks = {}                       # {Username,[reliableSender,reliableReceiver]}
+        self.__serverRtt = rttEstimator()           # Retransmission timeout of requests to the server
+        self.__requests = pendingRequests(self.__serverRtt)     # Requests waiting for their answer
+        self.__rooms = {}                           # {Room,chatRoom}
+        self.__mailboxes = {}                       # {Username,[keyId,symetric,counter]} of users offline
+        self.__mailSeen = 0                         # Last mailNo received, mail is numbered per recipient
+        self.__serverAddress = None                 # Address the server answered the login from
+        self.__postNo = int(time.time() * 1000)     # Last room post number, grows across logins
         self.__addressUserNameMap = {}
-        self.__pubKey = self.__diffi.gen_public_key()
+        self.__fragmenter = fragmenter()            # Splits packets longer than one datagram
+        self.__reassembler = reassembler()          # Fragments of packets not complete yet
+        self.__presence = set()                     # Mirror of the users connected to the server
+        self.__presenceVersion = None               # Version of the mirror, None until the first list
         global serverPort
         serverPort = int(port)
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)   # Room for fragment bursts
         except Exception as e:
             print "Error while creating socket",e
             sys.exit(0)
@@ -87,26 +120,68 @@ class connection:
         if address[1] == 0:
             address = ('', serverPort)
         try:
-            self.sock.sendto(message, address)
+            for datagram in self.__fragmenter.split(message):
+                self.sock.sendto(datagram, address)
         except Exception as e:
             print "Error while sending data",e
 
-    def __recvData(self):
-        ''' __recvData(None) :
+    def __recvDatagram(self):
+        ''' __recvDatagram(None) :
                         Input   : None
-                        Output  : None
-                        Purpose : Receives data from the server once data becomes
-                                    available on socket
+                        Output  : [Object,tuple] -> The packet and the address it came from
+                                  [None,tuple]   -> If the datagram was a fragment of a packet
+                                                    that is not complete yet
+                                  [False,tuple]  -> If the packet is malformed
+                        Purpose : Read one datagram from the socket and reassemble fragments
         '''
-        data = None
+        data, address = self.sock.recvfrom(4096)
+        data = wire.decode(data)
+        if data is not None and data["type"] == "fragment":
+            self.__reassembler.expire()
+            data = self.__reassembler.add(data, address)
+            if data is None:
+                return [None, address]
+            data = wire.decode(data)
+        if data is None:
+            return [False, address]
+        return data, address
+
+    def __handshakeRequest(self, packet, responseType, server, deadline, sample):
+        ''' __handshakeRequest(String,String,tuple,float,Boolean) :
+                        Input   : A handshake packet for the server, the type of the answer, the
+                                    address it must come from (None for any address on the server
+                                    port), the time the handshake is given up and True if the
+                                    round trip may be sampled (first transmission of the hello)
+                        Output  : [Object,tuple] -> The answer and the address it came from
+                                  [None,None]    -> If no answer came within the retransmission
+                                                    timeout of the server, the RTO is then backed off
+                                  [False,False]  -> If the socket failed
+                        Purpose : Send the packet once and wait for the answer, timed by __serverRtt
+                                    as the other requests to the server. Packets that arrive
+                                    meanwhile (chat, room posts, pushes of the previous session
+                                    when logging in again) go to their usual handlers
+        '''
+        sent = time.time()
+        self.__sendData(packet)
+        retry = min(sent + self.__serverRtt.getRto(), deadline)
         try:
-            self.sock.settimeout(5)
-            while data is None:
-                data, address = self.sock.recvfrom(4096)
+            while True:
+                self.sock.settimeout(max(retry - time.time(), 0.001))
+                data, address = self.__recvDatagram()
+                if not data:
+                    continue
+                if data["type"] == responseType and (address == server or
+                                                     server is None and address[1] == serverPort):
+                    break
+                self.__dispatch(data, address)
+        except socket.timeout:
+            self.__serverRtt.backoff()
+            return [None, None]
         except Exception as e:
-            self.__serverOffline()
             return [False, False]
-        data = pickle.loads(data)
+        if sample:
+            self.__serverRtt.sample(time.time() - sent)
+        self.__serverRtt.clearBackoff()
         return data, address
 
     def __encryptMessageWithServerPubKey(self, message):
@@ -152,25 +227,21 @@ class connection:
     def __sayHello(self):
         '''__sayHello(None) :
                     Input          : None
-                    Output         : None
+                    Output         : String (The now-online packet)
                     Purpose        : First step of Augmented string password protocol to inform server
                                      the client is now online and it requests to establish a shared
                                      secret
-                    Message Format : { messageType :now-online,
-                                        username
-                                     }
+                    Message Format : now-online { username }
         '''
         encodedObject = self.__encryptMessageWithServerPubKey(
-                                    pickle.dumps({
+                                    wire.encode("now-online", {
                                         "user"          : self.__username,
-                                        "messageType"   : "now-online",
                                     }))
         encodedObject = {
                 "user"      : self.__username,
                 "message"   : encodedObject,
-                "type"      : "asym"
         }
-        self.__sendData(pickle.dumps(encodedObject))
+        return wire.encode("asym", encodedObject)
 
     def __puzzleSolve(self, data):
         ''' __puzzleSolve(String):
@@ -181,20 +252,24 @@ class connection:
                                       }
                             False -> If the solution to challenge does not exist
         '''
-        response = data["challange"]
-        for x in range (-1,65537):
-            sha = hashlib.sha256()
-            sha.update(response+str(x))
+        if data["type"] != "quiz":
+            return False
+        prefix = hashlib.sha256(data["challange"])
+        for x in xrange(data["space"]):
+            sha = prefix.copy()
+            sha.update(str(x))
             if sha.digest() == data["answer"]:
-               message = pickle.dumps({
+               message = wire.encode("quiz-response", {
                    "answer"      : x,
                    "pubKey"      : self.__pubKey,
-                   "messageType" : "quiz-response",
                    "user"        : self.__username,
+                   "challange"   : data["challange"],
+                   "space"       : data["space"],
+                   "timestamp"   : data["timestamp"],
                })
-               return pickle.dumps({
+               return wire.encode("asym", {
+                   "user"       : self.__username,
                    "message"    : self.__encryptMessageWithServerPubKey(message),
-                   "type"       : "asym"
                })
         return False
 
@@ -210,7 +285,7 @@ class connection:
         hash = sha.digest()
         hash = int(binascii.hexlify(hash), base=16)
         try :
-            self.__passSecret = pow(self.__generator, hash, self.__prime)
+            self.__passSecret = DH.fixedBasePow(self.__generator, hash, self.__prime)
         except Exception as e:
             print "Unable to convert password to secret ",e
         password = None
@@ -226,8 +301,10 @@ class connection:
             Purpose : Verify the users password is correct and complete the password
                         authentication by sending the sha384 of g^bw modp and g
             Message Format :
-                                {messageType: complete , user , hash }
+                                complete { user , hash }
         """
+        if data["type"] != "initiateSecret":
+            return False
         serverPubKey = long(data["pubKey"])
         self.__sharedSecret = self.__diffi.gen_shared_key(serverPubKey)
         gpowbw =  self.__diffi.gen_gpowxw(serverPubKey,self.__passSecret)
@@ -236,18 +313,19 @@ class connection:
         if not self.__verifySignature(str(data["hash"]), data["verifyServer"]):
             return False
         hash = self.__gen384Hash(gpowbw,self.__sharedSecret)
-        objToEnc = pickle.dumps(
+        objToEnc = wire.encode("complete",
             {
-                "messageType" : "complete",
                 "hash"        : hash,
                 "user"         : self.__username
             })
         obj = {
+            "user"      : self.__username,
             "message"   : self.__encryptMessageWithServerPubKey(objToEnc),
-            "type"      : "asym"
         }
         self.__sharedSecret = str(self.__sharedSecret)[0:16]
-        return pickle.dumps(obj)
+        self.__serverCipher = symetric(self.__sharedSecret, CLIENT_TO_SERVER, SERVER_TO_CLIENT)
+        self.__serverWindow = replayWindow()
+        return wire.encode("asym", obj)
 
 
     def __gen384Hash(self,gpowbw,sharedSecret):
@@ -291,87 +369,339 @@ class connection:
         '''
         self.__writeMessage("\nServer not responding check input and try again later\n")
 
+    def __serverRequest(self, packetType, fields, responseTypes, callback):
+        '''
+            __serverRequest(String,Dictionary,tuple,function) :
+                    Input   : Type and fields (without user and Seq) of the request, the types
+                                of answer expected and the function called with the decrypted
+                                answer (None if the server did not answer)
+                    Output  : Object -> requestFuture of the answer
+                              None   -> If too many requests are already in flight
+                    Purpose : Send one request to the server over the session without waiting,
+                                the answer is matched to the request by its Seq (see
+                                pendingRequests.py) when handleServerMessage reads it
+        '''
+        if self.__requests.isFull():
+            self.__writeMessage("Too many requests waiting for the server, try again\n")
+            return None
+        seq = self.__nextSequence()
+        fields["Seq"] = seq
+        fields["user"] = self.__username
+        iv, message = self.__encryptSymetric(self.__serverCipher, seq, wire.encode(packetType, fields))
+        packet = wire.encode("sym", {
+            "message"   : message,
+            "IV"        : iv,
+        })
+        future = self.__requests.add(seq, packet, responseTypes)
+        session = self.__session
+        future.addCallback(lambda answer: answer is None and self.__reconnect(session))
+        future.addCallback(callback)
+        self.__sendData(packet)
+        return future
+
+    def __pagePresence(self, done, users=None, after="", version=None):
+        '''
+            __pagePresence(function,set,String,Number) :
+                    Input   : Function called with False if the server did not answer, True
+                                otherwise, and the users, last user and version of the pages
+                                already read
+                    Output  : None
+                    Purpose : Build the mirror of the connected users from scratch, one
+                                list-page at a time. The version of the first page is kept,
+                                changes made while paging come with the next list-changes
+        '''
+        if users is None:
+            users = set()
+        def onPage(message):
+            if message is None:
+                return done(False)
+            users.update(message["users"])
+            pageVersion = message["version"] if version is None else version
+            if message["next"] != "":
+                return self.__pagePresence(done, users, message["next"], pageVersion)
+            self.__presence = users
+            self.__presenceVersion = pageVersion
+            self.__syncPresence(done)
+        self.__serverRequest("list-page", {"after": after}, ("users-page",), onPage)
+
+    def __syncPresence(self, done):
+        '''
+            __syncPresence(function) :
+                    Input   : Function called with False if the server did not answer, True
+                                once the mirror is up to date
+                    Output  : None
+                    Purpose : Bring the mirror of the connected users up to date, asking
+                                only for the logins / logouts since its version
+        '''
+        if self.__presenceVersion is None:
+            return self.__pagePresence(done)
+        since = self.__presenceVersion
+        def onChanges(message):
+            if message is None:
+                return done(False)
+            if message["reset"]:
+                return self.__pagePresence(done)
+            if self.__presenceVersion != since:
+                # Another list moved the mirror meanwhile, ask from its version
+                return self.__syncPresence(done)
+            self.__presence.difference_update(message["left"])
+            self.__presence.update(message["joined"])
+            self.__presenceVersion = message["version"]
+            if message["more"]:
+                return self.__syncPresence(done)
+            done(True)
+        self.__serverRequest("list-changes", {"since": since}, ("presence",), onChanges)
+
     def __listUsers(self):
         '''
             listUsers(None) :
                     Input   : None
-                    Output  : List (List of all users connected to the server)
-                    Purpose : Gives the list of all users currently connected to server
-        '''
-
-        iv = os.urandom(16)
-        message  = self.__encryptSymetric(
-            self.__sharedSecret,iv,
-            pickle.dumps(
-                {
-                    "request"   : "list",
-                    "Nonce"     : str(int(binascii.hexlify(os.urandom(8)), base=16)),
-                    "user"      : self.__username,
-                }))
-        obj = {
-            "message"   : message,
-            "IV"        : iv,
-            "type"      : "sym"
-        }
-        self.__sendData(pickle.dumps(obj))
-        data, address = self.__recvData()
-        if data is False:
-            self.__serverOffline()
-            return
-        message = self.__decryptSymetric(self.__sharedSecret,data["IV"],data["message"])
-        message = pickle.loads(message)
-        print "Users connected are ", message["users"]
+                    Output  : None
+                    Purpose : Print the list of all users currently connected to server, from
+                                the local mirror once list-changes brought it up to date. Returns
+                                at once, the list is printed when the answers arrive
+        '''
+        def done(synced):
+            if synced:
+                self.__writeMessage("\nUsers connected are " + str(sorted(self.__presence)) + "\n")
+        self.__syncPresence(done)
 
+    def __nextSequence(self):
+        '''
+            __nextSequence(None):
+                Output  : Number (Sequence number for the next request to the server)
+        '''
+        self.__sendSequence += 1
+        return self.__sendSequence
 
-    def __decryptSymetric(self, key, iv, message):
+    def __nextPeerSequence(self, user):
         '''
-            __decryptSymetric(String,String):
-                    Input  : String, String (The  Encryped message and the IV
-                    Output : Decrypted message
-                    Purpose : Decrypt message sent by server
+            __nextPeerSequence(String):
+                Input   : Username of the remote host
+                Output  : Number (Sequence number for the next message to the remote host)
         '''
+        self.__peerSequence[user] = self.__peerSequence.get(user, 0) + 1
+        return self.__peerSequence[user]
 
-        s = symetric(key)
-        decryptor = s.getDecryptor(iv)
-        return s.decrypt(message, decryptor)
+    def __addPeer(self, user, address, cipher):
+        '''
+            __addPeer(String,tuple,Object):
+                Input   : Username, address and session cipher (symetric) of the remote host
+                Output  : None
+                Purpose : Start a chat session, sequence numbers start again for a new key
+        '''
+        self.__destHostKey[user] = [address, cipher]                # Address, symetric
+        self.__addressUserNameMap[address] = user
+        self.__peerSequence[user] = 0
+        self.__peerWindow[user] = replayWindow()
+        self.__peerLinks[user] = [reliableSender(), reliableReceiver()]
+
+    def __removePeer(self, user, address):
+        '''
+            __removePeer(String,tuple):
+                Input   : Username and address of the remote host
+                Output  : None
+                Purpose : Forget the chat session with the remote host
+        '''
+        self.__destHostKey.pop(user, None)
+        self.__addressUserNameMap.pop(address, None)
+        self.__peerSequence.pop(user, None)
+        self.__peerWindow.pop(user, None)
+        self.__peerLinks.pop(user, None)
+
+
+    def __decryptSymetric(self, cipher, iv, message):
+        '''
+            __decryptSymetric(Object,String,String):
+                    Input  : Object, String, String (Session cipher, the nonce and the Encryped message)
+                    Output : Decrypted message, None if the message was tampered with
+                    Purpose : Decrypt message sent by server or remote host
+        '''
+        if cipher is None:
+            return None
+        return cipher.decrypt(iv, message)
 
-    def __encryptSymetric(self, key, iv, message):
+    def __encryptSymetric(self, cipher, seq, message):
         '''
-            __encryptSymetric(String,String):
-                    Input  : String, String (Key, message to be encrypted and the IV)
-                    Output : Encrypted message with session key
+            __encryptSymetric(Object,Number,String):
+                    Input  : Object, Number, String (Session cipher, sequence number of the message
+                                and message to be encrypted)
+                    Output : [String,String] -> The nonce and the message encrypted with session key
                     Purpose : Encrypt message with session keys of client and server(Ksx)
         '''
+        return cipher.encrypt(seq, message)
+
 
-        s = symetric(key)
-        encryptor = s.getEncryptor(iv)
-        return s.encryptMessage(message, encryptor)
+    def __keepTicket(self, message):
+        '''
+            __keepTicket(Object):
+                Input   : resume-ticket from the server, sent after every login
+                Output  : None
+                Purpose : Keep the ticket and its secret (derived from the key of the
+                            session it came with) to log in again without the handshake
+        '''
+        self.__resumption = [message["ticket"], resumptionSecret(self.__serverCipher.getKey()),
+                             time.time() + message["lifetime"]]
 
+    def __resumeSession(self):
+        '''
+            __resumeSession(None):
+                Output  : Boolean (True if the server accepted the ticket, the session then
+                            has a new key)
+                Purpose : Log in again in one round trip with the ticket of the last session
+                            (see resumption.py). The ticket works once, it is sent once;
+                            datagrams other than the answer that arrive meanwhile are dropped
+        '''
+        ticket, secret, expires = self.__resumption
+        self.__resumption = None
+        if time.time() >= expires:
+            return False
+        nonce = os.urandom(NONCE_SIZE)
+        self.__sendData(wire.encode("resume", {
+            "user"      : self.__username,
+            "ticket"    : ticket,
+            "nonce"     : nonce,
+            "proof"     : resumeProof(secret, self.__username, ticket, nonce),
+        }))
+        deadline = time.time() + max(2 * self.__serverRtt.getRto(), 1)
+        try:
+            while True:
+                self.sock.settimeout(max(deadline - time.time(), 0.001))
+                data, address = self.__recvDatagram()
+                if data and data["type"] == "resumed" and data["user"] == self.__username:
+                    break
+        except Exception as e:
+            return False
+        if data["nonce"] == "":
+            return False
+        cipher = symetric(resumedKey(secret, nonce, data["nonce"]), CLIENT_TO_SERVER, SERVER_TO_CLIENT)
+        message = self.__decryptSymetric(cipher, data["IV"], data["message"])
+        message = wire.decode(message) if message is not None else None
+        if message is None or message["type"] != "resume-ticket":
+            return False
+        self.__serverCipher = cipher
+        self.__serverWindow = replayWindow()
+        self.__serverWindow.check(message["Seq"])
+        self.__serverAddress = address
+        self.__keepTicket(message)
+        return True
+
+    def __reconnect(self, session):
+        '''
+            __reconnect(Number):
+                Input   : Number of the session a request was sent on
+                Output  : None
+                Purpose : The server did not answer a request: it may have lost the session,
+                            or the address of the client changed (NAT rebinding). Log in again,
+                            in one round trip if a ticket is held, and join the rooms again.
+                            Requests of an older session that fail afterwards are ignored
+        '''
+        if session != self.__session:
+            return
+        self.__session += 1
+        self.__writeMessage("\nServer not responding, logging in again\n")
+        if not self.establishConnection():
+            self.__serverOffline()
+            return
+        self.__writeMessage("\nLogged in again\n")
+        rooms, self.__rooms = self.__rooms.keys(), {}
+        for room in rooms:
+            self.__joinRoom(room)
 
     def establishConnection(self):
         ''''establishConnection(None) : Public method
                 Input   : None
-                Output  : None
-                Purpose : Control to initial connection with server
+                Output  : Boolean (True once logged in)
+                Purpose : Control to initial connection with server, with the resumption
+                            ticket of the previous session if there is one (it falls back
+                            to the full handshake when the server refuses it). The server
+                            is given up after REQUEST_TIMEOUT seconds without an answer
+
+        '''
+        if self.__resumption is not None and self.__resumeSession():
+            self.__openHistory()
+            return True
+        # Step 1 : Say Hello, again every RTO until a quiz arrives
+        self.__diffi = DH.DiffieHellman()
+        self.__pubKey = self.__diffi.gen_public_key()
+        hello = self.__sayHello()
+        hellos = 0
+        deadline = time.time() + REQUEST_TIMEOUT
+        while time.time() < deadline:
+            hellos += 1
+            data, address = self.__handshakeRequest(hello, "quiz", None, deadline, hellos == 1)
+            if data is None:
+                continue
+            if data is False:
+                break
+            # Step 2 : Send Response to challange. The server answers a quiz once, when the
+            #          answer is lost the handshake goes back to the hello for a new quiz
+            solving = time.time()
+            data = self.__puzzleSolve(data)
+            if not data:
+                return False
+            deadline += time.time() - solving
+            data, address = self.__handshakeRequest(data, "initiateSecret", address, deadline, False)
+            if data is None:
+                continue
+            if data is False:
+                break
+            # Step 3 : Generate Shared Secret and complete connection
+            data = self.__establishSecret(data)
+            if not data:
+                return False
+            self.__serverAddress = address
+            self.__sendData(data)
+            self.__openHistory()
+            return True
+        self.__serverOffline()
+        return False
 
+    def __openHistory(self):
         '''
-        # Step 1 : Say Hello
-        self.__sayHello()
-        data, address = self.__recvData()
-        if data is False:
+            __openHistory(None):
+                Output  : None
+                Purpose : Open the chat history of the user once logged in, it is not kept
+                            if it was written with another password
+        '''
+        if self.__history is not None or self.__historyKey is None:
             return
-        # Step 2 : Send Response to challange
-        data = self.__puzzleSolve(data)
-        self.__sendData(data)
-        data, address = self.__recvData()
-        if data is False:
+        try:
+            self.__history = chatHistory(self.__historyDir, self.__historyKey)
+        except (ValueError, OSError, IOError) as e:
+            self.__writeMessage("\nChat history not kept : " + str(e) + "\n")
+            self.__historyKey = None
+
+    def __keepHistory(self, peer, author, message):
+        '''
+            __keepHistory(String,String,String):
+                Input   : The user talked to (or #room), the author and the message
+                Output  : None
+        '''
+        if self.__history is not None:
+            self.__history.add(peer, author, message, time.time())
+
+    def __showHistory(self, message):
+        '''
+            __showHistory(List):
+                Input   : ["history", peer, count] or ["search", words ...]
+                Output  : None
+                Purpose : Print the last messages with a user or a room (#room), or the
+                            last ones holding every word searched
+        '''
+        if self.__history is None:
+            self.__writeMessage("No chat history\n")
             return
-        # Step 3 : Generate Shared Secret and complete connection
-        data = self.__establishSecret(data)
-        if not data:
-            return False
-        self.__sendData(data)
-        return True
+        if message[0] == "history":
+            count = int(message[2]) if len(message) > 2 and message[2].isdigit() else HISTORY_LINES
+            found = self.__history.recent(message[1], count)
+        else:
+            found = self.__history.search(" ".join(message[1:]), HISTORY_LINES)
+        if not found:
+            self.__writeMessage("Nothing found\n")
+        for when, peer, author, text in found:
+            self.__writeMessage(time.strftime("%Y-%m-%d %H:%M", time.localtime(when)) +
+                                " [" + peer + "] " + author + ": " + text + "\n")
 
     def __writeMessage(self, message):
         ''' __writeMessage(String)
@@ -403,18 +733,17 @@ class connection:
                 Output  : None
                 Purpose : Set the session key to chat with remote host
         '''
-        if message["Nonce"] in self.__serverNonceHistory:
-            return
-        self.__serverNonceHistory.append(message["Nonce"])
         print message["user"]
-        choice = self.__readFromConsole("\nUser "+message["user"][0] +" Wishes to talk to you\n"
+        choice = self.__readFromConsole("\nUser "+message["user"] +" Wishes to talk to you\n"
                                                         "Want to accept Connection? (Y/N) ")
         if choice.lower() == "y":
-            self.__writeMessage("\n User "+message["user"][0]+ " connected \n")
-            self.__destHostKey[message["user"][0]] = [message["user"][1], message["Key"]]           #     Address, Key
-            self.__addressUserNameMap[message["user"][1]] = message["user"][0]
+            self.__writeMessage("\n User "+message["user"]+ " connected \n")
+            self.__addPeer(message["user"], message["address"],
+                           symetric(message["Key"], RESPONDER, INITIATOR))
         if choice.lower() == "n":
-            self.___disconnectClient("refused",message["Key"],message["user"][1])
+            self.___disconnectClient("refused",symetric(message["Key"], RESPONDER, INITIATOR),
+                                     message["address"],message["user"])
+            self.__peerSequence.pop(message["user"], None)
 
     def __connectionTeaerDown(self, clientMessage, address, message):
         '''
@@ -423,12 +752,9 @@ class connection:
                 Output  : None
                 Purpose : Tare down a connection
         '''
-        if clientMessage["Nonce"] not in self.__serverNonceHistory:
-            self.__serverNonceHistory.append(clientMessage["Nonce"])
-            self.__writeMessage(message)
-            if clientMessage["user"] in self.__destHostKey:
-                self.__destHostKey.pop(clientMessage["user"])
-                self.__addressUserNameMap.pop(address)
+        self.__writeMessage(message)
+        if clientMessage["user"] in self.__destHostKey:
+            self.__removePeer(clientMessage["user"], address)
 
     def __printChatMessage(self, clientMessage):
         '''
@@ -437,29 +763,167 @@ class connection:
             Output  :   None
             Purpose : Print the chat message onto terminal
         '''
-        if clientMessage["Nonce"] not in self.__serverNonceHistory:
-            self.__writeMessage("\n" + clientMessage["user"] + ": " + clientMessage["chat"] + "\n")
-            self.__serverNonceHistory.append(clientMessage["Nonce"])
+        self.__writeMessage("\n" + clientMessage["user"] + ": " + clientMessage["chat"] + "\n")
+        self.__keepHistory(clientMessage["user"], clientMessage["user"], clientMessage["chat"])
 
     def __chatSessionMessages(self, serverObj, address):
         '''
         __chatMessage(Object)
             purpose : Handle chat message
         '''
-        if serverObj["message"] == "client":
-            clientMessage = self.__decryptSymetric(self.__destHostKey[self.__addressUserNameMap[address]][1],
+        if serverObj["type"] == "room-post" and address == self.__serverAddress:
+            return self.__receiveRoomPost(serverObj)
+        if serverObj["type"] == "client" and address in self.__addressUserNameMap:
+            user = self.__addressUserNameMap[address]
+            clientMessage = self.__decryptSymetric(self.__destHostKey[user][1],
                                                    serverObj["IV"],serverObj["data"])
-            clientMessage = pickle.loads(clientMessage)
-            if clientMessage["message"] == "chat":
-                self.__printChatMessage(clientMessage)
-            elif clientMessage["message"] == "refused":
+            clientMessage = wire.decode(clientMessage)
+            if clientMessage is None:
+                return
+            if clientMessage["type"] == "chat":
+                # Copies are acknowledged again, the reliableReceiver drops them
+                return self.__receiveChat(user, clientMessage, address)
+            if not self.__peerWindow[user].check(clientMessage["Seq"]):
+                return
+            if clientMessage["type"] == "ack":
+                self.__receiveAck(user, clientMessage, address)
+            elif clientMessage["type"] == "refused":
                 self.__connectionTeaerDown(clientMessage,address,
                                            "Connection was refused by " + clientMessage["user"] + "\n")
-            elif clientMessage["message"] == "logout":
+            elif clientMessage["type"] == "left":
                 self.__connectionTeaerDown(clientMessage, address,
                                            clientMessage["user"]+" Just left\n")
 
 
+    def __receiveChat(self, user, clientMessage, address):
+        '''
+            __receiveChat(String,Object,tuple):
+                Input   : Username of the remote host, the chat message and its address
+                Output  : None
+                Purpose : Print the chat messages that are now in order and acknowledge
+        '''
+        link = self.__peerLinks[user]
+        for message in link[1].receive(clientMessage["msgNo"], clientMessage):
+            self.__printChatMessage(message)
+        cumulative, sack = link[1].getAck()
+        seq = self.__nextPeerSequence(user)
+        iv, obj = self.__encryptSymetric(self.__destHostKey[user][1], seq,
+                                     wire.encode("ack", {
+                                         "user"         : self.__username,
+                                         "Seq"          : seq,
+                                         "cumulative"   : cumulative,
+                                         "sack"         : sack,
+                                     }))
+        self.__sendData(wire.encode("client", {
+            "data"      : obj,
+            "IV"        : iv,
+        }), address)
+
+    def __receiveAck(self, user, clientMessage, address):
+        '''
+            __receiveAck(String,Object,tuple):
+                Input   : Username of the remote host, the ack and its address
+                Output  : None
+                Purpose : Forget the acknowledged messages, send the holes again and
+                            the messages waiting for room in the window
+        '''
+        for packet in self.__peerLinks[user][0].acknowledge(clientMessage["cumulative"], clientMessage["sack"]):
+            self.__sendData(packet, address)
+        self.__flushPeer(user)
+
+    def __flushPeer(self, user, now=None):
+        '''
+            __flushPeer(String,float):
+                Input   : Username of the remote host and the time
+                Output  : None
+                Purpose : Send the new chat messages that fit in the window and the ones
+                            whose retransmission timeout expired, give the peer up when a
+                            message was sent too many times
+        '''
+        address, cipher = self.__destHostKey[user]
+        sender = self.__peerLinks[user][0]
+        def build(msgNo, message):
+            seq = self.__nextPeerSequence(user)
+            iv, obj = self.__encryptSymetric(cipher, seq,
+                                         wire.encode("chat", {
+                                             "chat"   :message,
+                                             "user"   :self.__username,
+                                             "Seq"    :seq,
+                                             "msgNo"  :msgNo,
+                                           }))
+            return wire.encode("client", {
+                    "IV"        :   iv,
+                    "data"      :   obj,
+                    })
+        for packet in sender.poll(build, now):
+            self.__sendData(packet, address)
+        if sender.hasFailed():
+            self.__writeMessage("\n" + user + " is not responding, " + str(sender.pending()) +
+                                " message(s) not delivered\n")
+            self.__removePeer(user, address)
+
+    def getTimerInterval(self):
+        '''
+            getTimerInterval(None):
+                Output  : float -> Seconds until retransmit should be called
+                          None  -> If no chat message or request waits for an answer
+        '''
+        timeouts = [link[0].nextTimeout() for link in self.__peerLinks.values()]
+        timeouts.append(self.__requests.nextTimeout())
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+        return min(timeouts) if timeouts else None
+
+    def retransmit(self, now=None):
+        '''
+            retransmit(float):
+                Input   : Current time (time.time() if not given)
+                Output  : None
+                Purpose : Called by the client loop, sends again the chat messages and the
+                            requests not answered within the retransmission timeout, fails
+                            the requests the server did not answer in time
+        '''
+        if now is None:
+            now = time.time()
+        for packet in self.__requests.poll(now):
+            self.__sendData(packet)
+        for user in self.__peerLinks.keys():
+            self.__flushPeer(user, now)
+
+    def __openServerMessage(self, serverObj):
+        '''
+            __openServerMessage(Object):
+                Input   : A sym packet
+                Output  : Object -> The decrypted message from the server
+                          None   -> If it is invalid or was already received
+        '''
+        try:
+            response = wire.decode(self.__decryptSymetric(self.__serverCipher,
+                                                      serverObj["IV"],serverObj["message"]))
+        except Exception as e:
+            return None
+        if response is None or "Seq" not in response or not self.__serverWindow.check(response["Seq"]):
+            return None
+        return response
+
+    def __serverNotice(self, response):
+        '''
+            __serverNotice(Object):
+                Input   : A message from the server that is not the answer to a request
+                Output  : None
+        '''
+        if response["type"] == "disconnect":
+            self.logout()
+            print "Server just kicked you out"
+            sys.exit(0)
+        if response["type"] == "talkto":
+            self.__setDestHostKey(response)
+        if response["type"] == "room-key":
+            self.__setRoomKey(response)
+        if response["type"] == "resume-ticket":
+            self.__keepTicket(response)
+        if response["type"] == "mailbag":
+            self.__receiveMail(response)
+
     def handleServerMessage(self):
         '''
             handleServerMessage(None)
@@ -467,83 +931,238 @@ class connection:
                 Output  : None
                 Purpose : Handle clients requests to talk to server
         '''
-        serverObj, address = self.__recvData()
-        if serverObj is False:
-            return
         try:
-            response = pickle.loads(self.__decryptSymetric(self.__sharedSecret,
-                                                      serverObj["IV"],serverObj["message"]))
+            self.sock.settimeout(5)
+            serverObj, address = self.__recvDatagram()
         except Exception as e:
+            return
+        if serverObj:
+            self.__dispatch(serverObj, address)
+
+    def __dispatch(self, serverObj, address):
+        '''
+            __dispatch(Object,tuple):
+                Input   : A packet and the address it came from
+                Output  : None
+                Purpose : Give the packet to the handler of its type, answers of the server
+                            complete their request
+        '''
+        if serverObj["type"] != "sym":
             return self.__chatSessionMessages(serverObj, address)
-        if  "Nonce" in response and \
-                        response["Nonce"] not in self.__serverNonceHistory:
-            if response["message"] == "disconnect":
-                self.logout()
-                print "Server just kicked you out"
-                sys.exit(0)
-            if response["message"] == "talkto":
-                self.__setDestHostKey(response)
+        response = self.__openServerMessage(serverObj)
+        if response is not None and not self.__requests.complete(response):
+            self.__serverNotice(response)
 
-    def ___disconnectClient(self, message, key, address):
+    def __receiveMail(self, bag):
         '''
-            ___disconnectClient(String,String,tupple):
-                Input   :  The message to be sent for disconnection, The Key to encrypt message,
-                            Address to whom the message is to be send
+            __receiveMail(Object):
+                Input   : mailbag from the server (pushed at login or when mail arrives, or the
+                            answer to mail-ack)
+                Output  : None
+                Purpose : Print the mail sent while we were offline and acknowledge it, the
+                            answer brings the next mailbag until none is left
+        '''
+        if bag is None or not bag["mails"]:
+            return
+        for item in bag["mails"]:
+            item = wire.decode(item)
+            if item is None or item["type"] != "mail-item" or item["mailNo"] <= self.__mailSeen:
+                continue
+            self.__mailSeen = item["mailNo"]
+            chat = self.__decryptSymetric(symetric(item["Key"], RESPONDER, INITIATOR), item["IV"], item["data"])
+            chat = wire.decode(chat) if chat is not None else None
+            if chat is not None and chat["type"] == "chat" and chat["user"] == item["user"]:
+                self.__writeMessage("\n" + chat["user"] + " (offline): " + chat["chat"] + "\n")
+                self.__keepHistory(chat["user"], chat["user"], chat["chat"])
+        self.__serverRequest("mail-ack", {"mailNo": self.__mailSeen}, ("mailbag",), self.__receiveMail)
+
+    def __sendMail(self, user, message):
+        '''
+            __sendMail(String,String):
+                Input   : A user that is offline and the chat message
+                Output  : Object -> requestFuture of mail-stored (None if nothing was sent)
+                Purpose : Leave the message in the mailbox of the user, encrypted with the mail
+                            key the server gave for it (see Server/mailLog.py)
+        '''
+        mailbox = self.__mailboxes[user]
+        mailbox[2] += 1
+        iv, data = self.__encryptSymetric(mailbox[1], mailbox[2], wire.encode("chat", {
+            "user"      : self.__username,
+            "Seq"       : mailbox[2],
+            "msgNo"     : mailbox[2],
+            "chat"      : message,
+        }))
+        def onStored(answer):
+            if answer is not None and not answer["stored"]:
+                self.__writeMessage("Message to " + user + " not stored (mailbox full or message too long)\n")
+        return self.__serverRequest("mail", {
+            "recipient" : user,
+            "keyId"     : mailbox[0],
+            "IV"        : iv,
+            "data"      : data,
+        }, ("mail-stored",), onStored)
+
+    def __joinRoom(self, room):
+        '''
+            __joinRoom(String) :
+                Input   : Name of the room (created by the server if it does not exist)
+                Output  : Object -> requestFuture of the room key
+                Purpose : Join a room, also used to get the new key of a room joined
+                            before when a post comes with an epoch we have no key for
+        '''
+        def onKey(message):
+            if message is None:
+                return
+            if message["type"] == "room-left":
+                self.__writeMessage("\nCould not join room " + room + "\n")
+                return
+            if room not in self.__rooms:
+                self.__rooms[room] = chatRoom(room)
+                self.__writeMessage("\nJoined room " + room + " (" + str(message["members"]) + " members)\n")
+            self.__setRoomKey(message)
+        return self.__serverRequest("room-join", {"room": room}, ("room-key", "room-left"), onKey)
+
+    def __leaveRoom(self, room):
+        '''
+            __leaveRoom(String) :
+                Input   : Name of the room
+                Output  : Object -> requestFuture of the answer (None if not a member)
+        '''
+        if room not in self.__rooms:
+            self.__writeMessage("Not in room " + room + "\n")
+            return None
+        def onLeft(message):
+            if message is not None and self.__rooms.pop(room, None) is not None:
+                self.__writeMessage("\nLeft room " + room + "\n")
+        return self.__serverRequest("room-leave", {"room": room}, ("room-left",), onLeft)
+
+    def __setRoomKey(self, message):
+        '''
+            __setRoomKey(Object) :
+                Input   : room-key from the server (answer to room-join or pushed when the
+                            key of the room changed)
+                Output  : None
+                Purpose : Use the new key, send again the posts the server dropped because
+                            they used the old one and read the posts that waited for it
+        '''
+        room = self.__rooms.get(message["room"])
+        if room is None or not room.setKey(message["epoch"], message["Key"], message["sender"]):
+            return
+        for postNo, plainText in room.takeStale():
+            self.__sendRoomPost(room, postNo, plainText)
+        for user, epoch, iv, data in room.takeHeld():
+            self.__receiveRoomPost({"room": room.getName(), "user": user, "epoch": epoch,
+                                    "IV": iv, "data": data})
+
+    def __sendRoomPost(self, room, postNo, plainText):
+        '''
+            __sendRoomPost(Object,Number,String) :
+                Input   : chatRoom, number of the post and the encoded room-chat
+                Output  : None
+                Purpose : Encrypt the post once with the room key and send it once to the
+                            server, however many members the room has
+        '''
+        epoch, iv, data = room.seal(postNo, plainText)
+        self.__sendData(wire.encode("room-post", {
+            "user"      : self.__username,
+            "room"      : room.getName(),
+            "epoch"     : epoch,
+            "IV"        : iv,
+            "data"      : data,
+        }))
+
+    def __receiveRoomPost(self, post):
+        '''
+            __receiveRoomPost(Object) :
+                Input   : room-post forwarded by the server
+                Output  : None
+                Purpose : Print the post once, the author named inside must be the one the
+                            server checked
+        '''
+        room = self.__rooms.get(post["room"])
+        if room is None:
+            return
+        plainText, needKey = room.open(post["user"], post["epoch"], post["IV"], post["data"])
+        if needKey:
+            self.__joinRoom(room.getName())
+        message = wire.decode(plainText) if plainText is not None else None
+        if message is None or message["type"] != "room-chat" or message["user"] != post["user"]:
+            return
+        if room.accept(message["user"], message["postNo"]):
+            self.__writeMessage("\n[" + room.getName() + "] " + message["user"] + ": " + message["chat"] + "\n")
+            self.__keepHistory("#" + room.getName(), message["user"], message["chat"])
+
+    def sendMessageToRoom(self, message):
+        '''
+            sendMessageToRoom(List):
+                Input   : List (Name of the room and the words of the message)
+                Output  : None
+                Purpose : Post a chat message to every member of a room
+        '''
+        room = self.__rooms.get(message[0])
+        if room is None:
+            self.__writeMessage("Not in room " + message[0] + "\n")
+            return
+        self.__postNo = max(self.__postNo + 1, int(time.time() * 1000))
+        self.__sendRoomPost(room, self.__postNo, wire.encode("room-chat", {
+            "user"      : self.__username,
+            "postNo"    : self.__postNo,
+            "chat"      : " ".join(message[1:]),
+        }))
+        self.__keepHistory("#" + message[0], self.__username, " ".join(message[1:]))
+
+    def ___disconnectClient(self, message, cipher, address, user):
+        '''
+            ___disconnectClient(String,String,tupple,String):
+                Input   :  The message to be sent for disconnection (refused / left), The cipher to encrypt message,
+                            Address and username of whom the message is to be send
                 Output  : None
                 Purpose : Disconnect connected client
 
         '''
-        iv = os.urandom(16)
-        obj = self.__encryptSymetric(key, iv,
-                                     pickle.dumps({
-                                         "message"  : message,
+        seq = self.__nextPeerSequence(user)
+        iv, obj = self.__encryptSymetric(cipher, seq,
+                                     wire.encode(message, {
                                          "user"     : self.__username,
-                                         "Nonce"    : str(int(binascii.hexlify(os.urandom(8)), base=16))
+                                         "Seq"      : seq
                                      }))
-        self.__sendData(pickle.dumps({
-            "message"   : "client",
+        self.__sendData(wire.encode("client", {
             "data"      : obj,
             "IV"        : iv,
-        },
-        ), address)
+        }), address)
 
 
     def __talkToHost(self):
         '''
             __talkToHost(None) :
                 Input   : (None)
-                Output  : (None)
-                Purpose : Request Session key to server to talk to remote host and send same to remote host
+                Output  : Object -> requestFuture of the ticket (None if nothing was sent)
+                Purpose : Request Session key to server to talk to remote host and send same to remote host,
+                            returns at once, the ticket is forwarded when the server answers
         '''
         destHost = self.__readFromConsole("Whom do you wish to speak to :")
         if destHost in self.__destHostKey:
             self.__writeMessage("User already connected\n")
-            return
-        iv = os.urandom(16)
-        obj = pickle.dumps({
-            "request"              : "talk",
-            "userDestination"      : destHost,
-            "Nonce"                : str(int(binascii.hexlify(os.urandom(8)), base=16)),
-            "user"                 : self.__username
-        })
-        encryptedMessage = self.__encryptSymetric(self.__sharedSecret, iv, obj)
+            return None
+        def onTicket(message):
+            if message is None or destHost in self.__destHostKey:
+                return
+            if message["type"] == "mailbox":
+                if not message["Key"]:
+                    self.__writeMessage("User " + destHost + " does not exist\n")
+                    return
+                self.__mailboxes[destHost] = [message["keyId"],
+                                              symetric(message["Key"], INITIATOR, RESPONDER), 0]
+                self.__writeMessage("User " + destHost + " is offline, messages will be delivered"
+                                    " when " + destHost + " logs in\n")
+                return
+            # Send data to Client : Send token received from client
+            self.__sendData(
+                    wire.encode("sym", {"message": message["ticket"], "IV": message["IV"] }),
+                message["address"])
+            self.__addPeer(destHost, message["address"], symetric(message["Key"], INITIATOR, RESPONDER))
         # Send data to server : Request Ticket from server
-        self.__sendData(
-            pickle.dumps({
-                          "message" : encryptedMessage,
-                          "IV"      : iv,
-                          "type"    : "sym"
-                      }))
-        message, address = self.__recvData()
-        if message is False:
-            return
-        message = pickle.loads(self.__decryptSymetric(self.__sharedSecret,message["IV"],message["message"]))
-        # Send data to Client : Send token received from client
-        self.__sendData(
-                pickle.dumps({"message": message["ticket"], "IV": message["IV"] }),
-            message["address"])
-        self.__addressUserNameMap[message["address"]] = destHost
-        self.__destHostKey[destHost] = [message["address"], message["Key"]]                 # Username , Address, Key
+        return self.__serverRequest("talk", {"userDestination": destHost}, ("ticket", "mailbox"), onTicket)
 
 
     def logout(self):
@@ -555,21 +1174,22 @@ class connection:
 
         '''
         for user in self.__destHostKey :
-            self.___disconnectClient("logout",self.__destHostKey[user][1],self.__destHostKey[user][0])
-        iv = os.urandom(16)
-        message = self.__encryptSymetric(
-            self.__sharedSecret, iv,
-            pickle.dumps({
-                "request"   : "logout",
-                "Nonce"     : str(int(binascii.hexlify(os.urandom(8)), base=16)),
+            self.___disconnectClient("left",self.__destHostKey[user][1],self.__destHostKey[user][0],user)
+        seq = self.__nextSequence()
+        iv, message = self.__encryptSymetric(
+            self.__serverCipher, seq,
+            wire.encode("logout", {
+                "Seq"       : seq,
                 "user"      : self.__username
           }))
         obj = {
             "message"   : message,
             "IV"        : iv,
-            "type"      : "sym"
         }
-        self.__sendData(pickle.dumps(obj))
+        self.__sendData(wire.encode("sym", obj))
+        if self.__history is not None:
+            self.__history.close()
+            self.__history = None
         self.__writeMessage("It was a pleasure having you here\nGet back soon:)\n")
         sys.exit(0)
 
@@ -590,6 +1210,14 @@ class connection:
             self.logout()
         elif message == "connected":
             self.__showConnectedHosts()
+        elif message.startswith("join "):
+            self.__joinRoom(message[5:].strip())
+        elif message.startswith("leave "):
+            self.__leaveRoom(message[6:].strip())
+        elif message.startswith("room "):
+            self.sendMessageToRoom(message[5:].strip().split(" "))
+        elif message.startswith("history ") or message.startswith("search "):
+            self.__showHistory(message.split())
         else:
             print "Unknown Message"
 
@@ -607,24 +1235,19 @@ class connection:
             sendMessageToClient(String):
                 Input   : String
                 Output  : None
-                Purpose : Send chat message to client
+                Purpose : Send chat message to client, it is sent again until the client
+                            acknowledges it (see reliable.py), or leave it in the mailbox of
+                            a user that is offline
         '''
         user = message[0]
         message = " ".join(message[1:])
-        iv = os.urandom(16)
         if not self.__destHostKey or user not in self.__destHostKey:
+            if user in self.__mailboxes:
+                self.__sendMail(user, message)
+                self.__keepHistory(user, self.__username, message)
+                return
             self.__writeMessage("Client not connected\n")
             return
-        obj = self.__encryptSymetric(self.__destHostKey[user][1] ,iv,
-                                     pickle.dumps({
-                                         "message":"chat",
-                                         "chat"   :message,
-                                         "user"   :self.__username,
-                                         "Nonce": str(int(binascii.hexlify(os.urandom(8)), base=16))
-                                       }))
-        self.__sendData(pickle.dumps({
-                "message"   :   "client",
-                "IV"        :   iv,
-                "data"      :   obj,
-                }
-            ), self.__destHostKey[user][0])
\ No newline at end of file
+        self.__peerLinks[user][0].push(message)
+        self.__keepHistory(user, self.__username, message)
+        self.__flushPeer(user)
\ No newline at end of file
@@ -0,0 +1,168 @@
+'''
+        Requests to the server waiting for their answer
+
+        Every request is identified by its sequence number, the server copies it in
+        the "request" field of the answer (see wire.py), so several requests can be
+        in flight at once and their answers may arrive in any order, mixed with chat
+        messages and talkto tickets. A request that is not answered within the
+        retransmission timeout of the server (rttEstimator, see reliable.py) is
+        sent again unchanged, it fails once timeout seconds have passed.
+'''
+
+import time
+from reliable import rttEstimator
+
+REQUEST_TIMEOUT = 5                 # Seconds before a request fails and the server is declared offline
+MAX_PENDING = 8                     # Requests in flight (the server keeps as many answers per session)
+
+
+class requestFuture:
+    '''
+        requestFuture : Type -> class
+        purpose : The answer to one request, once it arrives
+    '''
+    def __init__(self, requestId):
+        self.__requestId = requestId
+        self.__done = False
+        self.__result = None
+        self.__callbacks = []
+
+    def getRequestId(self):
+        return self.__requestId
+
+    def done(self):
+        return self.__done
+
+    def result(self):
+        '''
+            result(None):
+                Output  : Object -> The decrypted answer
+                          None   -> If the request is still pending or it failed
+        '''
+        return self.__result
+
+    def addCallback(self, callback):
+        '''
+            addCallback(function):
+                Input   : function called with the answer (None if the request failed),
+                            at once if the future is already done
+        '''
+        if self.__done:
+            callback(self.__result)
+        else:
+            self.__callbacks.append(callback)
+
+    def setResult(self, result):
+        '''
+            setResult(Object):
+                Input   : The answer, None if the request failed
+                Purpose : Complete the future and run its callbacks
+        '''
+        if self.__done:
+            return
+        self.__done = True
+        self.__result = result
+        callbacks, self.__callbacks = self.__callbacks, []
+        for callback in callbacks:
+            callback(result)
+
+
+class pendingRequests:
+    '''
+        pendingRequests : Type -> class
+        purpose : Table of the requests in flight, keyed by request id
+        Features : a) complete matches an answer to its request whatever the order
+                   b) poll gives the requests to send again and fails the ones older
+                        than timeout
+                   c) Round trips of requests answered at the first try are sampled
+                        (Karn), the RTO backs off after a timeout
+    '''
+    def __init__(self, estimator=None, timeout=REQUEST_TIMEOUT, maxPending=MAX_PENDING):
+        '''
+            __init__(Object,float,Number):
+                Input   : rttEstimator of the server (a new one by default), seconds before
+                            a request fails and requests allowed in flight
+                Output  : None
+        '''
+        if estimator is None:
+            estimator = rttEstimator()
+        self.__estimator = estimator
+        self.__timeout = timeout
+        self.__maxPending = maxPending
+        self.__pending = {}                     # requestId : [future, packet, responseTypes,
+                                                #              firstSent, deadline, attempts]
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def isFull(self):
+        return len(self.__pending) >= self.__maxPending
+
+    def add(self, requestId, packet, responseTypes, now=None):
+        '''
+            add(Number,String,tuple,float):
+                Input   : Request id (its Seq), the packet sent, the types of answer expected
+                            and the time it is sent
+                Output  : Object (requestFuture completed with the answer)
+        '''
+        if now is None:
+            now = time.time()
+        future = requestFuture(requestId)
+        self.__pending[requestId] = [future, packet, responseTypes, now,
+                                     now + self.__estimator.getRto(), 1]
+        return future
+
+    def complete(self, message, now=None):
+        '''
+            complete(Object,float):
+                Input   : A decrypted message from the server and the time it arrived
+                Output  : Boolean (True if it answered a pending request, the future of the
+                            request then got the message)
+        '''
+        if now is None:
+            now = time.time()
+        entry = self.__pending.get(message.get("request"))
+        if entry is None or message["type"] not in entry[2]:
+            return False
+        del self.__pending[message["request"]]
+        if entry[5] == 1:
+            self.__estimator.sample(now - entry[3])
+        self.__estimator.clearBackoff()
+        entry[0].setResult(message)
+        return True
+
+    def poll(self, now=None):
+        '''
+            poll(float):
+                Input   : Current time (time.time() if not given)
+                Output  : List (Packets of the requests to send again)
+                Purpose : Fail the requests older than timeout (their futures get None)
+        '''
+        if now is None:
+            now = time.time()
+        failed = [requestId for requestId, entry in self.__pending.items()
+                  if now - entry[3] >= self.__timeout]
+        failed = [self.__pending.pop(requestId)[0] for requestId in failed]
+        expired = [entry for entry in self.__pending.values() if entry[4] <= now]
+        if expired:
+            self.__estimator.backoff()
+        packets = []
+        for entry in expired:
+            entry[4] = min(now + self.__estimator.getRto(), entry[3] + self.__timeout)
+            entry[5] += 1
+            packets.append(entry[1])
+        for future in failed:
+            future.setResult(None)
+        return packets
+
+    def nextTimeout(self, now=None):
+        '''
+            nextTimeout(float):
+                Output  : float -> Seconds until poll should be called
+                          None  -> If no request is pending
+        '''
+        if not self.__pending:
+            return None
+        if now is None:
+            now = time.time()
+        return max(min(min(entry[4], entry[3] + self.__timeout) for entry in self.__pending.values()) - now, 0)
@@ -0,0 +1,273 @@
+'''
+        Reliable, ordered delivery of chat messages over UDP
+
+        Every chat message gets a message number (msgNo, from 1) on top of the
+        sequence number used for the nonce. The receiver answers every chat packet
+        with an "ack" packet (see wire.py)
+            | cumulative (8 bytes) | sack (8 bytes) |
+        cumulative is the last message delivered in order, bit i of sack is set when
+        message cumulative + 2 + i was received out of order. The sender keeps up to
+        SACK_WINDOW messages in flight and sends a message again when it is not
+        acknowledged within the retransmission timeout (RTO), computed from the
+        measured round trip times as in RFC 6298 (Karn: no sample from a message
+        that was sent more than once). Holes below a message acknowledged
+        selectively are sent again at once, at most once per round trip.
+'''
+
+import time
+
+SACK_WINDOW = 64                    # Messages in flight, one bit each in the sack field
+INITIAL_RTO = 1.0                   # Seconds, before the first round trip is measured
+MIN_RTO = 0.2
+MAX_RTO = 4.0
+MAX_RETRIES = 10                    # Transmissions of one message before the peer is given up
+
+
+class rttEstimator:
+    '''
+        rttEstimator : Type -> class
+        purpose : Smoothed round trip time and retransmission timeout of one peer
+    '''
+    def __init__(self, initial=INITIAL_RTO, minimum=MIN_RTO, maximum=MAX_RTO):
+        '''
+            __init__(float,float,float):
+                Input   : First RTO and the bounds of the RTO, in seconds
+                Output  : None
+        '''
+        self.__minimum = minimum
+        self.__maximum = maximum
+        self.__rto = initial
+        self.__backoff = 0                      # Timeouts since the last acknowledgement
+        self.__srtt = None
+        self.__rttvar = None
+
+    def getRto(self):
+        return min(self.__rto * (1 << self.__backoff), self.__maximum)
+
+    def getSrtt(self):
+        return self.__srtt
+
+    def sample(self, rtt):
+        '''
+            sample(float):
+                Input   : Round trip time of a message sent once, in seconds
+                Purpose : Update the smoothed round trip time and the RTO
+        '''
+        if self.__srtt is None:
+            self.__srtt = rtt
+            self.__rttvar = rtt / 2
+        else:
+            self.__rttvar = 0.75 * self.__rttvar + 0.25 * abs(self.__srtt - rtt)
+            self.__srtt = 0.875 * self.__srtt + 0.125 * rtt
+        self.__rto = min(max(self.__srtt + max(0.01, 4 * self.__rttvar), self.__minimum), self.__maximum)
+        self.__backoff = 0
+
+    def backoff(self):
+        '''
+            backoff(None):
+                Purpose : Double the RTO after a timeout
+        '''
+        if self.getRto() < self.__maximum:
+            self.__backoff += 1
+
+    def clearBackoff(self):
+        '''
+            clearBackoff(None):
+                Purpose : Go back to the RTO computed from the samples once the peer
+                            acknowledges something (as Linux does, under heavy loss most
+                            messages are sent twice and Karn leaves few samples)
+        '''
+        self.__backoff = 0
+
+
+class reliableSender:
+    '''
+        reliableSender : Type -> class
+        purpose : Sending half of the reliable link with one peer
+        Features : a) Messages are queued and numbered in order, at most window of them
+                        wait for an acknowledgement
+                   b) The packet of a message is built once (build callback) and sent
+                        again unchanged, the receiver drops the copies
+                   c) A message sent maxRetries times without an acknowledgement
+                        fails the link
+    '''
+    def __init__(self, window=SACK_WINDOW, estimator=None, maxRetries=MAX_RETRIES):
+        '''
+            __init__(Number,Object,Number):
+                Input   : Messages in flight, rttEstimator (a new one by default) and
+                            transmissions of a message before the link fails
+                Output  : None
+        '''
+        if estimator is None:
+            estimator = rttEstimator()
+        self.__window = min(window, SACK_WINDOW)
+        self.__estimator = estimator
+        self.__maxRetries = maxRetries
+        self.__nextNumber = 1
+        self.__backlog = []                     # Messages not sent yet
+        self.__inFlight = {}                    # msgNo : [packet, firstSent, deadline, sent, resent]
+        self.__base = 1                         # Lowest msgNo not acknowledged
+        self.__failed = False
+        self.__sent = 0
+        self.__retransmitted = 0
+
+    def getEstimator(self):
+        return self.__estimator
+
+    def hasFailed(self):
+        return self.__failed
+
+    def pending(self):
+        '''
+            pending(None):
+                Output  : Number (Messages queued or not acknowledged yet)
+        '''
+        return len(self.__backlog) + len(self.__inFlight)
+
+    def getStats(self):
+        return {
+            "sent"          : self.__sent,
+            "retransmitted" : self.__retransmitted,
+            "pending"       : self.pending(),
+            "rto"           : self.__estimator.getRto(),
+            "srtt"          : self.__estimator.getSrtt(),
+        }
+
+    def push(self, message):
+        '''
+            push(Object):
+                Input   : A message to deliver (given back to build when it is sent)
+                Output  : Number (The msgNo of the message)
+        '''
+        self.__backlog.append(message)
+        return self.__nextNumber + len(self.__backlog) - 1
+
+    def poll(self, build, now=None):
+        '''
+            poll(function,float):
+                Input   : build(msgNo, message) -> String, the packet of a message, and the time
+                Output  : List (Packets to send now: new messages that fit in the window and
+                            messages whose RTO expired)
+        '''
+        if now is None:
+            now = time.time()
+        if self.__failed:
+            return []
+        rto = self.__estimator.getRto()
+        expired = [msgNo for msgNo in sorted(self.__inFlight) if self.__inFlight[msgNo][2] <= now]
+        if expired:
+            if any(self.__inFlight[msgNo][3] >= self.__maxRetries for msgNo in expired):
+                self.__failed = True
+                return []
+            self.__estimator.backoff()
+            rto = self.__estimator.getRto()
+        packets = []
+        for msgNo in expired:
+            entry = self.__inFlight[msgNo]
+            entry[2] = now + rto
+            entry[3] += 1
+            entry[4] = now
+            self.__retransmitted += 1
+            packets.append(entry[0])
+        while self.__backlog and self.__nextNumber < self.__base + self.__window:
+            packet = build(self.__nextNumber, self.__backlog.pop(0))
+            self.__inFlight[self.__nextNumber] = [packet, now, now + rto, 1, now]
+            self.__nextNumber += 1
+            self.__sent += 1
+            packets.append(packet)
+        return packets
+
+    def acknowledge(self, cumulative, sack, now=None):
+        '''
+            acknowledge(Number,Number,float):
+                Input   : Fields of an ack packet and the time it arrived
+                Output  : List (Packets of the holes below a selectively acknowledged
+                            message, to send again at once)
+        '''
+        if now is None:
+            now = time.time()
+        if cumulative >= self.__nextNumber:
+            return []
+        acked = [msgNo for msgNo in self.__inFlight if msgNo <= cumulative or
+                 (msgNo >= cumulative + 2 and sack >> (msgNo - cumulative - 2) & 1)]
+        for msgNo in acked:
+            entry = self.__inFlight.pop(msgNo)
+            if entry[3] == 1:
+                self.__estimator.sample(now - entry[1])
+        if acked:
+            self.__estimator.clearBackoff()
+        self.__base = max(self.__base, cumulative + 1)
+        if not sack:
+            return []
+        highest = cumulative + 1 + sack.bit_length()
+        packets = []
+        for msgNo in sorted(self.__inFlight):
+            entry = self.__inFlight[msgNo]
+            if msgNo >= highest:
+                break
+            srtt = self.__estimator.getSrtt() or self.__estimator.getRto()
+            if now - entry[4] < srtt:
+                continue
+            entry[2] = now + self.__estimator.getRto()
+            entry[3] += 1
+            entry[4] = now
+            self.__retransmitted += 1
+            packets.append(entry[0])
+        return packets
+
+    def nextTimeout(self, now=None):
+        '''
+            nextTimeout(float):
+                Output  : float -> Seconds until a message must be sent again
+                          None  -> If nothing waits for an acknowledgement
+        '''
+        if not self.__inFlight or self.__failed:
+            return None
+        if now is None:
+            now = time.time()
+        return max(min(entry[2] for entry in self.__inFlight.values()) - now, 0)
+
+
+class reliableReceiver:
+    '''
+        reliableReceiver : Type -> class
+        purpose : Receiving half of the reliable link with one peer, gives the messages
+                    back in order and exactly once
+    '''
+    def __init__(self, window=SACK_WINDOW):
+        '''
+            __init__(Number):
+                Input   : Messages held out of order (beyond them messages are dropped
+                            and the sender sends them again)
+                Output  : None
+        '''
+        self.__window = min(window, SACK_WINDOW + 1)
+        self.__expected = 1                     # Next msgNo to deliver
+        self.__held = {}                        # msgNo : message received out of order
+
+    def receive(self, msgNo, message):
+        '''
+            receive(Number,Object):
+                Input   : msgNo and the message received
+                Output  : List (Messages that can now be delivered, in order; empty for a
+                            copy or a message that arrived before an earlier one)
+        '''
+        if msgNo < self.__expected or msgNo >= self.__expected + self.__window or msgNo in self.__held:
+            return []
+        self.__held[msgNo] = message
+        delivered = []
+        while self.__expected in self.__held:
+            delivered.append(self.__held.pop(self.__expected))
+            self.__expected += 1
+        return delivered
+
+    def getAck(self):
+        '''
+            getAck(None):
+                Output  : [Number,Number] -> cumulative and sack fields of the ack to send
+        '''
+        cumulative = self.__expected - 1
+        sack = 0
+        for msgNo in self.__held:
+            sack |= 1 << (msgNo - cumulative - 2)
+        return [cumulative, sack]
@@ -0,0 +1,64 @@
+def checkWindow(highest, bitmap, sequence, size=64):
+    '''
+        checkWindow(Number,Number,Number,Number):
+            Input   : Highest sequence number seen, the bitmap, the sequence number of the
+                        received message and the window size
+            Output  : [Boolean,Number,Number] -> True if the message is new, then the highest
+                            sequence number and the bitmap to keep
+            Purpose : The check of replayWindow for a window kept elsewhere (the server
+                        keeps it in its session records, see sessionTable.py)
+    '''
+    try:
+        sequence = int(sequence)
+    except (TypeError, ValueError):
+        return [False, highest, bitmap]
+    if sequence <= 0:
+        return [False, highest, bitmap]
+    if sequence > highest:
+        shift = sequence - highest
+        if shift >= size:
+            return [True, sequence, 1]
+        return [True, sequence, ((bitmap << shift) | 1) & ((1 << size) - 1)]
+    offset = highest - sequence
+    if offset >= size or bitmap & (1 << offset):
+        return [False, highest, bitmap]
+    return [True, highest, bitmap | 1 << offset]
+
+
+class replayWindow:
+    '''
+        replayWindow : Type -> class
+        purpose : Anti replay check for the sequence numbers of one session
+                    (sliding window with a bitmap, as used by IPsec)
+        Features : a) O(1) check, memory does not grow with the number of messages
+                   b) Messages may arrive out of order as long as they are within
+                        size of the highest sequence number seen
+        Note : Sequence numbers start at 1, 0 is never accepted
+    '''
+    def __init__(self, size=64, highest=0, bitmap=0):
+        '''
+            __init__(Number,Number,Number):
+                Input   : Window size, highest sequence number seen and the bitmap
+                            (bit i set -> highest - i was seen), the last two are used
+                            to restore a window saved with getState
+        '''
+        self.__size = size
+        self.__highest = highest
+        self.__bitmap = bitmap
+
+    def check(self, sequence):
+        '''
+            check(Number):
+                Input   : Sequence number of the received message
+                Output  : Boolean (True if the message is new, it is then marked as seen)
+        '''
+        accepted, self.__highest, self.__bitmap = checkWindow(self.__highest, self.__bitmap, sequence,
+                                                              self.__size)
+        return accepted
+
+    def getState(self):
+        '''
+            getState(None):
+                Output  : [Number,Number] -> highest sequence number seen and the bitmap
+        '''
+        return [self.__highest, self.__bitmap]
@@ -0,0 +1,115 @@
+'''
+        Session resumption
+
+        Once a client has logged in, the server sends it a resumption ticket (in a
+        resume-ticket packet, see wire.py) encrypted with the session key. The
+        ticket is the user name, a resumption secret and the time it was issued,
+        sealed with a key only the server knows, so the server keeps nothing per
+        ticket until it is used. Both ends derive the resumption secret from the
+        session key.
+
+        To log in again (after a network change, or when the server stopped
+        answering) the client sends
+            resume  { user, ticket, nonce, proof = HMAC(secret, user + ticket + nonce) }
+        and the server answers, if the ticket is valid and was never used,
+            resumed { user, nonce of the server, IV, resume-ticket encrypted with the new key }
+        The new session key is HMAC(secret, both nonces): one round trip and no
+        public key operation, instead of the three of the full handshake. Every
+        ticket is used once, the answer brings the next one. A ticket that is
+        refused is answered with an empty nonce, the client then does the full
+        handshake.
+'''
+
+import os,time,hmac,struct,hashlib
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+
+SECRET_SIZE = 16
+NONCE_SIZE = 16
+TICKET_LIFETIME = 3600              # Seconds a ticket may be used
+
+_issued = struct.Struct("!I")
+
+
+def resumptionSecret(sessionKey):
+    '''
+        resumptionSecret(String):
+            Input   : Session key the ticket was sent with
+            Output  : String (The secret the ticket holds, known to both ends)
+    '''
+    return hmac.new(sessionKey, "resumption", hashlib.sha256).digest()[:SECRET_SIZE]
+
+
+def resumedKey(secret, clientNonce, serverNonce):
+    '''
+        resumedKey(String,String,String):
+            Input   : Resumption secret and the nonces of the resume and resumed packets
+            Output  : String (The 16 byte key of the resumed session)
+    '''
+    return hmac.new(secret, "session" + clientNonce + serverNonce, hashlib.sha256).digest()[:16]
+
+
+def resumeProof(secret, user, ticket, nonce):
+    '''
+        resumeProof(String,String,String,String):
+            Input   : Resumption secret and the user, ticket and nonce of the resume packet
+            Output  : String (Shows the server the client holds the secret of the ticket)
+    '''
+    return hmac.new(secret, user + "\0" + ticket + nonce, hashlib.sha256).digest()
+
+
+class resumeTicket:
+    '''
+        resumeTicket : Type -> class
+        purpose : Seals and opens resumption tickets (server side)
+        Features : a) The ticket is encrypted and authenticated (AES-GCM), a client
+                        cannot read or change the secret or the user inside
+                   b) Tickets expire after lifetime seconds
+                   c) The nonce of a ticket identifies it, the server records the
+                        tickets used (sessionStore.useTicket) so each works once
+        Note : Every process serving the same clients (-procs) needs the same key,
+                tickets do not survive a restart of the server
+    '''
+    def __init__(self, key=None, lifetime=TICKET_LIFETIME):
+        '''
+            __init__(String,Number):
+                Input   : 32 byte key sealing the tickets (random if not given) and the
+                            seconds a ticket may be used
+                Output  : None
+        '''
+        if key is None:
+            key = os.urandom(32)
+        self.__aead = AESGCM(key)
+        self.__lifetime = lifetime
+
+    def getLifetime(self):
+        return self.__lifetime
+
+    def issue(self, user, sessionKey):
+        '''
+            issue(String,String):
+                Input   : User name and the key of its session
+                Output  : String (The ticket)
+        '''
+        nonce = os.urandom(12)
+        plainText = _issued.pack(int(time.time())) + resumptionSecret(sessionKey) + user
+        return nonce + self.__aead.encrypt(nonce, plainText, None)
+
+    def open(self, ticket):
+        '''
+            open(String):
+                Input   : A ticket sent back by a client
+                Output  : [String,String,String,Number] -> User, resumption secret, id of
+                                the ticket and the time it expires
+                          None -> If the ticket was not issued by this server or expired
+        '''
+        try:
+            plainText = self.__aead.decrypt(ticket[:12], ticket[12:], None)
+        except (InvalidTag, ValueError):
+            return None
+        issued = _issued.unpack_from(plainText)[0]
+        if time.time() > issued + self.__lifetime:
+            return None
+        start = _issued.size
+        return [plainText[start + SECRET_SIZE:], plainText[start:start + SECRET_SIZE], ticket[:12],
+                issued + self.__lifetime]
@@ -1,50 +1,68 @@
-import sys
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
+import struct
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+
+# Direction of a message, the first 4 bytes of every nonce. Both ends of a key
+# send with a different direction so a counter value is never used twice.
+CLIENT_TO_SERVER    = 1
+SERVER_TO_CLIENT    = 2
+INITIATOR           = 3         # Client that requested the ticket (talk)
+RESPONDER           = 4         # Client that accepted the ticket (talkto)
+                                # Room keys: every member sends with the number given by the server
+
+_nonce = struct.Struct("!IQ")
+
 class symetric:
     '''
     	symetric : Type -> class
     	purpose : Export interface to cryptography library to
-    				perform AES (Symetric encryptio)
+    				perform AES-GCM (Symetric authenticated encryption)
+    				for one session key
     	Features : Provides interface for
-    				a) AES Encryption
-    				b) AES Decryption
-    				c) encryptor crypto object
-    				d) decryptor crypto object
+    				a) AES-GCM Encryption with a nonce derived from a counter
+    				b) AES-GCM Decryption, tampered messages are rejected
+    	Note : Create one object per session key and keep it, the cipher
+    			context is built only once. The counter passed to encrypt
+    			must never repeat for the same key and direction, the
+    			sequence number of the message is used
     '''
-    def __init__(self,key):
-        self.key = key
-
-    def loadKey(self, key):
+    def __init__(self, key, sendDirection, receiveDirection):
+        '''
+            __init__(String,Number,Number):
+                Input   : The 16 byte session key, direction of the messages encrypted
+                            and of the messages decrypted with this object (None accepts
+                            every direction, for a key shared by the members of a room)
+        '''
         self.key = key
+        self.__aead = AESGCM(key)
+        self.__sendDirection = sendDirection
+        self.__receiveDirection = receiveDirection
 
     def getKey(self):
         return self.key
 
-    def getEncryptor(self, iv):
-        return Cipher(
-            algorithms.AES(self.key),
-            modes.CFB(iv),
-            backend=default_backend()
-        ).encryptor()
-
-    def getDecryptor(self, iv):
-        return Cipher(
-            algorithms.AES(self.key),
-            modes.CFB(iv),
-            backend=default_backend()
-        ).decryptor()
-
-    def encryptMessage(self, message, encryptor):
-        try:
-            return encryptor.update(message) + encryptor.finalize()
-        except:
-            print "Error while symetric encryption"
-            sys.exit(0)
+    def encrypt(self, counter, message):
+        '''
+            encrypt(Number,String):
+                Input   : Counter (sequence number of the message) and the plain text
+                Output  : [String,String] -> The 12 byte nonce and the cipher text
+        '''
+        nonce = _nonce.pack(self.__sendDirection, counter)
+        return [nonce, self.__aead.encrypt(nonce, message, None)]
 
-    def decrypt(self, cipherText, decryptor):
+    def decrypt(self, nonce, cipherText):
+        '''
+            decrypt(String,String):
+                Input   : The nonce and the cipher text received
+                Output  : String -> The plain text
+                          None   -> If the message was not sent by the other end
+                                    of the session or was modified
+        '''
+        if len(nonce) != _nonce.size:
+            return None
+        if self.__receiveDirection is not None and _nonce.unpack(nonce)[0] != self.__receiveDirection:
+            return None
         try:
-            return decryptor.update(cipherText) + decryptor.finalize()
-        except:
-            print "Error While symetric decryption"
-            sys.exit(0)
\ No newline at end of file
+            return self.__aead.decrypt(nonce, cipherText, None)
+        except InvalidTag:
+            return None
@@ -8,6 +8,7 @@ import os
 import hashlib
 import binascii
 import json
+import DH
 users = ["alice:password", "bob:Her0sRu1e", "tim:mommy"]
 
 primes = {
@@ -35,7 +36,7 @@ def generatePasswordFile(users):
         sha.update(user[1]+str(salt))
         hash = sha.digest()
         hash =int(binascii.hexlify(hash), base=16)
-        secret = pow(primes["generator"],hash,primes["prime"])
+        secret = DH.fixedBasePow(primes["generator"],hash,primes["prime"])
         obj[user[0]] = secret
 
     with open('SERVER.conf', 'w') as outfile:
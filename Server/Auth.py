@@ -1,14 +1,19 @@
-class Auth:
+import time
+
+class Auth(object):
     '''
         Used by handelConnection object instance to
         to store state of Authentication information
     '''
+    __slots__ = ("__challenge", "__response", "__sha384", "__quizz", "__sharedSecret", "__created")
+
     def __init__(self,quiz):
         self.__challenge = True
         self.__response = False
         self.__sha384 = ""
         self.__quizz = quiz
         self.__sharedSecret = ""
+        self.__created = time.time()
 
     def isChallengeComplete(self):
         return self.__challenge
@@ -22,6 +27,9 @@ class Auth:
     def getQuizz(self):
         return self.__quizz
 
+    def getCreated(self):
+        return self.__created
+
     def getSharedSecret(self):
         return self.__sharedSecret
 
@@ -0,0 +1,131 @@
+import os,json,time,threading
+import json.decoder,json.scanner
+
+
+def _yieldingDecoder():
+    '''
+        Output  : Object (json decoder for the watcher thread. The C scanner and the
+                    dictionary built from all the pairs at once would hold the
+                    interpreter lock for the whole file, this one parses in Python and
+                    hands back the list of pairs, so the server loop keeps running)
+    '''
+    decoder = json.decoder.JSONDecoder(object_pairs_hook=lambda pairs: pairs)
+    decoder.parse_string = json.decoder.py_scanstring
+    decoder.scan_once = json.scanner.py_make_scanner(decoder)
+    return decoder
+
+
+class credentialStore:
+    '''
+        credentialStore : Type -> class
+        purpose : Keeps the password verifiers from SERVER.conf in memory
+        Features : a) Hash index on the lower case user name, loaded once
+                   b) Reloaded when the file modification time changes (a background
+                        thread looks at it every checkInterval seconds) or when reload
+                        is called (ie. on SIGHUP). The new index is built on the side
+                        and swapped in with a single assignment so lookups never see a
+                        half loaded file and never wait for one
+                   c) Lookup latency statistics
+    '''
+    def __init__(self, path, checkInterval=1.0):
+        '''
+            __init__(String,float):
+                Input   : Path of the config file, seconds between two checks of the
+                            file modification time (0 to reload only when reload is called)
+                Output  : None
+        '''
+        self.__path = path
+        self.__checkInterval = checkInterval
+        self.__credentials = {}                 # username : password hash
+        self.__mtime = None
+        self.__reloadLock = threading.Lock()    # One reload at a time (watcher and SIGHUP)
+        self.__reloads = 0
+        self.__lookups = 0
+        self.__lookupTime = 0.0
+        self.__maxLookupTime = 0.0
+        self.reload()
+        if checkInterval > 0:
+            watcher = threading.Thread(target=self.__watch, name="credentialWatcher")
+            watcher.daemon = True
+            watcher.start()
+
+    def reload(self):
+        '''
+            reload(None):
+                Input   : None
+                Output  : Boolean (False if the file could not be read, the old index is kept)
+                Purpose : Read the config file and swap in the new index
+        '''
+        return self.__load(json.JSONDecoder(object_pairs_hook=lambda pairs: pairs))
+
+    def __load(self, decoder):
+        '''
+            __load(Object):
+                Input   : json decoder returning the list of (user, password hash) pairs
+                Output  : Boolean (False if the file could not be read, the old index is kept)
+        '''
+        with self.__reloadLock:
+            try:
+                mtime = os.stat(self.__path).st_mtime
+                with open(self.__path) as json_file:
+                    pairs = decoder.decode(json_file.read())
+            except Exception as e:
+                print "Error while reading " + self.__path, e
+                return False
+            credentials = {}
+            for user, secret in pairs:
+                credentials[user.lower()] = secret
+            old, self.__credentials = self.__credentials, credentials
+            self.__mtime = mtime
+            self.__reloads += 1
+        while old:                              # Freed a user at a time, not in one call
+            old.popitem()
+        return True
+
+    def __watch(self):
+        '''
+            __watch(None):
+                Purpose : Runs on the watcher thread, reloads the index when the file
+                            modification time changes
+        '''
+        decoder = _yieldingDecoder()
+        while True:
+            time.sleep(self.__checkInterval)
+            try:
+                mtime = os.stat(self.__path).st_mtime
+            except OSError:
+                continue
+            if mtime != self.__mtime:
+                self.__load(decoder)
+
+    def lookup(self, user):
+        '''
+            lookup(String):
+                Input   : The user name
+                Output  : False  -> If username not found
+                          String -> Password hash
+        '''
+        start = time.time()
+        secret = self.__credentials.get(user.lower(), False)
+        elapsed = time.time() - start
+        self.__lookups += 1
+        self.__lookupTime += elapsed
+        if elapsed > self.__maxLookupTime:
+            self.__maxLookupTime = elapsed
+        return secret
+
+    def getStats(self):
+        '''
+            getStats(None):
+                Output  : Dictionary (Number of users, reloads and lookup latency in microseconds)
+        '''
+        average = 0.0
+        if self.__lookups:
+            average = self.__lookupTime / self.__lookups
+        return {
+            "users"         : len(self.__credentials),
+            "reloads"       : self.__reloads,
+            "lookups"       : self.__lookups,
+            "avgLookupUs"   : average * 1000000,
+            "maxLookupUs"   : self.__maxLookupTime * 1000000,
+        }
@@ -0,0 +1,280 @@
+import socket,errno,struct,ctypes,ctypes.util
+
+MSG_DONTWAIT = 0x40                         # Linux value, every call on the ring is non blocking
+MAX_CACHED_ADDRESSES = 65536
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _sockaddr_in(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16),
+                ("sin_addr", ctypes.c_uint32), ("sin_zero", ctypes.c_ubyte * 8)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_iovec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+
+def _loadMultiMessage():
+    '''
+        _loadMultiMessage(None):
+            Output  : Object (libc if it has recvmmsg and sendmmsg, else None)
+    '''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint,
+                                  ctypes.c_int, ctypes.c_void_p]
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    except (OSError, AttributeError, TypeError):
+        return None
+    return libc
+
+_libc = _loadMultiMessage()
+
+
+class datagramRing:
+    '''
+        datagramRing : Type -> class
+        purpose : Batched datagram I/O for the server loop. receive drains up to size
+                    waiting datagrams in one go into buffers allocated once, the loop
+                    handles all of them and send flushes all responses together
+        Features : a) recvmmsg / sendmmsg (one system call per batch) on Linux when
+                        libc has them and the socket is IPv4
+                   b) Otherwise recvfrom_into on the preallocated buffers and one
+                        sendto per response, still without a select per datagram
+                   c) Datagrams longer than bufferSize are truncated like recvfrom(bufferSize)
+    '''
+    def __init__(self, sock, size=64, bufferSize=4096, multiMessage=True):
+        '''
+            __init__(socket,Number,Number,Boolean):
+                Input   : UDP socket, datagrams per batch, bytes per datagram and False to
+                            use recvfrom_into / sendto even if recvmmsg is available
+                Output  : None
+        '''
+        self.__sock = sock
+        self.__size = max(size, 1)
+        self.__bufferSize = bufferSize
+        self.__buffers = [bytearray(bufferSize) for i in range(self.__size)]
+        self.__views = [memoryview(buffer) for buffer in self.__buffers]
+        self.__multiMessage = (multiMessage and _libc is not None and sock.family == socket.AF_INET)
+        self.__addresses = {}                   # Raw sockaddr : address tuple (and the reverse)
+        self.__syscalls = 0
+        self.__datagrams = 0
+        if self.__multiMessage:
+            self.__initMultiMessage()
+
+    def __initMultiMessage(self):
+        '''
+            __initMultiMessage(None):
+                Purpose : One contiguous data buffer, address array, iovec array and header
+                            array per direction, all of them ctypes views of bytearrays so
+                            Python reads and writes them with slices and struct, without a
+                            ctypes call per datagram. Header i always points at address i
+                            and iovec i, a batch only rewrites the addresses and iovecs
+        '''
+        self.__nameSize = ctypes.sizeof(_sockaddr_in)
+        self.__headerSize = ctypes.sizeof(_mmsghdr)
+        self.__lengths = {}                     # count : struct.Struct reading count msg_len
+        self.__recv = self.__newHeaders()
+        self.__send = self.__newHeaders()
+
+    def __newHeaders(self):
+        '''
+            __newHeaders(None):
+                Output  : Dictionary (data, names, iov, headers : bytearray and the
+                            ctypes arrays on top of them)
+        '''
+        side = {
+            "data"      : bytearray(self.__size * self.__bufferSize),
+            "names"     : bytearray(self.__size * self.__nameSize),
+            "iov"       : bytearray(self.__size * ctypes.sizeof(_iovec)),
+            "headers"   : bytearray(self.__size * self.__headerSize),
+        }
+        data = (ctypes.c_char * len(side["data"])).from_buffer(side["data"])
+        names = (_sockaddr_in * self.__size).from_buffer(side["names"])
+        iov = (_iovec * self.__size).from_buffer(side["iov"])
+        side["headerArray"] = headers = (_mmsghdr * self.__size).from_buffer(side["headers"])
+        side["dataAddress"] = ctypes.addressof(data)
+        side["headersAddress"] = ctypes.addressof(headers)
+        for i in range(self.__size):
+            iov[i].iov_base = side["dataAddress"] + i * self.__bufferSize
+            iov[i].iov_len = self.__bufferSize
+            header = headers[i].msg_hdr
+            header.msg_name = ctypes.addressof(names[i])
+            header.msg_namelen = self.__nameSize
+            header.msg_iov = ctypes.pointer(iov[i])
+            header.msg_iovlen = 1
+        side["views"] = [data, names, iov, headers]  # Keeps the ctypes views alive
+        return side
+
+    def usesMultiMessage(self):
+        return self.__multiMessage
+
+    def getSize(self):
+        return self.__size
+
+    def getStats(self):
+        '''
+            getStats(None):
+                Output  : Dictionary (System calls made, datagrams moved and datagrams per call)
+        '''
+        return {
+            "syscalls"      : self.__syscalls,
+            "datagrams"     : self.__datagrams,
+            "perSyscall"    : round(float(self.__datagrams) / self.__syscalls, 2) if self.__syscalls else 0,
+        }
+
+    def receive(self):
+        '''
+            receive(None):
+                Output  : List of [String, tuple] (The datagrams waiting on the socket and
+                            their senders, at most size of them, empty if none)
+        '''
+        if self.__multiMessage:
+            return self.__receiveMulti()
+        received = []
+        for i in range(self.__size):
+            try:
+                length, address = self.__sock.recvfrom_into(self.__views[i], self.__bufferSize, MSG_DONTWAIT)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    break
+                raise
+            finally:
+                self.__syscalls += 1
+            received.append([self.__views[i][:length].tobytes(), address])
+        self.__datagrams += len(received)
+        return received
+
+    def __address(self, raw):
+        address = self.__addresses.get(raw)
+        if address is None:
+            if len(self.__addresses) > MAX_CACHED_ADDRESSES:
+                self.__addresses.clear()
+            address = (socket.inet_ntoa(raw[2:]), struct.unpack("!H", raw[:2])[0])
+            self.__addresses[raw] = address
+        return address
+
+    def __rawAddress(self, address):
+        raw = self.__addresses.get(address)
+        if raw is None:
+            if not 0 <= address[1] <= 0xffff:
+                raise TypeError("port out of range")
+            if len(self.__addresses) > MAX_CACHED_ADDRESSES:
+                self.__addresses.clear()
+            raw = struct.pack("=H", socket.AF_INET) + struct.pack("!H", address[1]) + \
+                socket.inet_aton(address[0] or "127.0.0.1") + "\0" * 8
+            self.__addresses[address] = raw
+        return raw
+
+    def __lengthStruct(self, count):
+        lengths = self.__lengths.get(count)
+        if lengths is None:
+            offset = _mmsghdr.msg_len.offset
+            lengths = struct.Struct("=" + ("%dxI%dx" % (offset, self.__headerSize - offset - 4)) * count)
+            self.__lengths[count] = lengths
+        return lengths
+
+    def __receiveMulti(self):
+        # The kernel writes back 16 in msg_namelen for IPv4, no reset needed
+        recv = self.__recv
+        count = _libc.recvmmsg(self.__sock.fileno(), recv["headerArray"], self.__size, MSG_DONTWAIT, None)
+        self.__syscalls += 1
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise socket.error(error, "recvmmsg failed")
+        lengths = self.__lengthStruct(count).unpack_from(recv["headers"])
+        data = memoryview(recv["data"])
+        names = recv["names"]
+        addresses = self.__addresses
+        bufferSize = self.__bufferSize
+        nameSize = self.__nameSize
+        received = []
+        offset = 0
+        nameOffset = 2
+        for length in lengths:
+            raw = str(names[nameOffset:nameOffset + 6])
+            received.append([
+                data[offset:offset + min(length, bufferSize)].tobytes(),
+                addresses.get(raw) or self.__address(raw),
+            ])
+            offset += bufferSize
+            nameOffset += nameSize
+        self.__datagrams += count
+        return received
+
+    def send(self, responses):
+        '''
+            send(List):
+                Input   : List of [String, tuple] (Responses and their destinations)
+                Output  : Number (Responses that could not be sent)
+        '''
+        failed = 0
+        for start in range(0, len(responses), self.__size):
+            batch = responses[start:start + self.__size]
+            if self.__multiMessage:
+                failed += self.__sendMulti(batch)
+            else:
+                failed += self.__sendEach(batch)
+        return failed
+
+    def __sendEach(self, responses):
+        failed = 0
+        for data, address in responses:
+            self.__syscalls += 1
+            try:
+                self.__sock.sendto(data, address)
+                self.__datagrams += 1
+            except (socket.error, TypeError, OverflowError) as e:
+                failed += 1
+        return failed
+
+    def __sendMulti(self, responses):
+        send = self.__send
+        failed = 0
+        pending = []
+        names = []
+        iov = []
+        offset = 0
+        buffer = send["data"]
+        dataAddress = send["dataAddress"]
+        addresses = self.__addresses
+        for data, address in responses:
+            try:
+                if len(data) > self.__bufferSize:
+                    raise TypeError("datagram larger than the buffer")
+                names.append(addresses.get(address) or self.__rawAddress(address))
+            except (socket.error, TypeError, IndexError, struct.error):
+                failed += self.__sendEach([[data, address]])
+                continue
+            buffer[offset:offset + len(data)] = data
+            iov.append(dataAddress + offset)
+            iov.append(len(data))
+            pending.append([data, address])
+            offset += self.__bufferSize
+        if not pending:
+            return failed
+        send["names"][0:len(pending) * self.__nameSize] = "".join(names)
+        struct.pack_into("PL" * len(pending), send["iov"], 0, *iov)    # iovec is {void *, size_t}
+        sent = 0
+        while sent < len(pending):
+            count = _libc.sendmmsg(self.__sock.fileno(), send["headersAddress"] + sent * self.__headerSize,
+                                   len(pending) - sent, 0)
+            self.__syscalls += 1
+            if count <= 0:
+                # The datagram at sent failed (ie. unreachable), send the rest one by one
+                return failed + self.__sendEach(pending[sent:])
+            sent += count
+            self.__datagrams += count
+        return failed
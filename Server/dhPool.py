@@ -0,0 +1,91 @@
+import threading,collections
+import DH
+
+class keyPairPool:
+    '''
+        keyPairPool : Type -> class
+        purpose : Keeps ephemeral Diffie Hellman key pairs (a, g^a mod p) computed
+                    ahead of time so a handshake does not wait for the modular
+                    exponentiation of its public key
+        Features : a) Every pair is handed out once and then forgotten, each
+                        handshake uses a fresh exponent
+                   b) A background thread refills the pool up to size whenever it
+                        falls to the low water mark
+                   c) When the pool is empty the pair is computed inline and the
+                        miss is counted (see getStats)
+    '''
+    def __init__(self, size=64, lowWater=16):
+        '''
+            __init__(Number,Number):
+                Input   : Number of pairs kept, refill starts when fewer are left
+                Output  : None
+        '''
+        self.__size = max(size, 1)
+        self.__lowWater = min(max(lowWater, 0), self.__size - 1)
+        self.__pairs = collections.deque()        # [DiffieHellman, g^a mod p]
+        self.__condition = threading.Condition()
+        self.__taken = 0
+        self.__generated = 0
+        self.__empty = 0
+        self.__refills = 0
+        worker = threading.Thread(target=self.__refill)
+        worker.daemon = True
+        worker.start()
+
+    def __newPair(self):
+        diffi = DH.DiffieHellman()
+        return [diffi, diffi.gen_public_key()]
+
+    def __refill(self):
+        '''
+            __refill(None):
+                Purpose : Background thread, sleeps until the pool reaches the low
+                            water mark and then fills it up again
+        '''
+        while True:
+            with self.__condition:
+                while len(self.__pairs) > self.__lowWater:
+                    self.__condition.wait()
+                self.__refills += 1
+                missing = self.__size - len(self.__pairs)
+            for i in range(missing):
+                pair = self.__newPair()
+                with self.__condition:
+                    self.__pairs.append(pair)
+                    self.__generated += 1
+
+    def take(self):
+        '''
+            take(None):
+                Input   : None
+                Output  : [DiffieHellman,Number] -> Object holding a fresh exponent and its
+                            public key g^a mod p, not handed out to anyone else
+        '''
+        with self.__condition:
+            self.__taken += 1
+            if self.__pairs:
+                pair = self.__pairs.popleft()
+            else:
+                pair = None
+                self.__empty += 1
+            if len(self.__pairs) <= self.__lowWater:
+                self.__condition.notify()
+        if pair is None:
+            pair = self.__newPair()
+        return pair
+
+    def getStats(self):
+        '''
+            getStats(None):
+                Output  : Dictionary (size, available pairs, pairs taken, pairs generated in
+                            the background, takes that found the pool empty, refill rounds)
+        '''
+        with self.__condition:
+            return {
+                "size"      : self.__size,
+                "available" : len(self.__pairs),
+                "taken"     : self.__taken,
+                "generated" : self.__generated,
+                "empty"     : self.__empty,
+                "refills"   : self.__refills,
+            }
@@ -0,0 +1,151 @@
+'''
+        Fragmentation of large packets, shared by the client and the server
+
+        A packet longer than maxDatagram is sent as "fragment" packets (see wire.py)
+            | msgId (4 bytes) | index (2 bytes) | count (2 bytes) | data |
+        each of them at most maxDatagram bytes long, so nothing relies on IP
+        fragmentation. Shorter packets are sent unchanged. The receiver keeps the
+        fragments of incomplete packets in a bounded reassembly buffer and gives
+        the packet back once every fragment has arrived.
+'''
+
+import os,time,struct,wire
+
+MAX_DATAGRAM = 1200                         # Fits the minimum IPv6 MTU with room for the headers
+FRAGMENT_OVERHEAD = len(wire.encode("fragment", {"msgId": 0, "index": 0, "count": 0, "data": ""}))
+
+
+class fragmenter:
+    '''
+        fragmenter : Type -> class
+        purpose : Split packets into datagrams of at most maxDatagram bytes
+    '''
+    def __init__(self, maxDatagram=MAX_DATAGRAM):
+        '''
+            __init__(Number):
+                Input   : Largest datagram sent
+                Output  : None
+        '''
+        self.__maxDatagram = maxDatagram
+        self.__payload = maxDatagram - FRAGMENT_OVERHEAD
+        self.__msgId = struct.unpack("!I", os.urandom(4))[0]
+
+    def getMaxMessage(self):
+        return self.__payload * 0xffff
+
+    def split(self, packet):
+        '''
+            split(String):
+                Input   : A framed packet
+                Output  : List (The datagrams to send, the packet itself if it is short enough)
+        '''
+        if len(packet) <= self.__maxDatagram:
+            return [packet]
+        count = (len(packet) + self.__payload - 1) // self.__payload
+        if count > 0xffff:
+            raise ValueError("packet too large to fragment")
+        self.__msgId = (self.__msgId + 1) & 0xffffffff
+        return [wire.encode("fragment", {
+                    "msgId"     : self.__msgId,
+                    "index"     : index,
+                    "count"     : count,
+                    "data"      : packet[index * self.__payload:(index + 1) * self.__payload],
+                }) for index in range(count)]
+
+
+class reassembler:
+    '''
+        reassembler : Type -> class
+        purpose : Bounded buffer rebuilding fragmented packets
+        Features : a) Incomplete packets are keyed by sender address and msgId, fragments
+                        received twice are ignored
+                   b) At most maxBytes of fragments and maxPackets incomplete packets are
+                        held, the oldest incomplete packets are dropped to make room
+                   c) Incomplete packets older than timeout seconds are dropped
+    '''
+    def __init__(self, maxBytes=16 << 20, maxPackets=256, timeout=5):
+        '''
+            __init__(Number,Number,float):
+                Input   : Bytes of fragments held, incomplete packets held and the seconds an
+                            incomplete packet is kept
+                Output  : None
+        '''
+        self.__maxBytes = maxBytes
+        self.__maxPackets = maxPackets
+        self.__timeout = timeout
+        self.__pending = {}                     # (address, msgId) : [started, count, received, bytes, fragments]
+        self.__bytes = 0
+        self.__dropped = 0
+        self.__completed = 0
+
+    def getStats(self):
+        '''
+            getStats(None):
+                Output  : Dictionary (Incomplete packets and bytes held, packets completed and
+                            dropped)
+        '''
+        return {
+            "pending"   : len(self.__pending),
+            "bytes"     : self.__bytes,
+            "completed" : self.__completed,
+            "dropped"   : self.__dropped,
+        }
+
+    def __drop(self, key):
+        entry = self.__pending.pop(key)
+        self.__bytes -= entry[3]
+        self.__dropped += 1
+
+    def expire(self, now=None):
+        '''
+            expire(float):
+                Input   : Current time (time.time() if not given)
+                Purpose : Drop the incomplete packets older than timeout
+        '''
+        if now is None:
+            now = time.time()
+        for key in [key for key, entry in self.__pending.items() if now - entry[0] > self.__timeout]:
+            self.__drop(key)
+
+    def __makeRoom(self, size):
+        while self.__pending and (len(self.__pending) >= self.__maxPackets or
+                                  self.__bytes + size > self.__maxBytes):
+            self.__drop(min(self.__pending, key=lambda key: self.__pending[key][0]))
+
+    def add(self, fragment, address, now=None):
+        '''
+            add(Dictionary,tuple,float):
+                Input   : A decoded fragment packet, the address it came from and the time
+                Output  : String -> The packet if this was its last missing fragment
+                          None   -> Otherwise (or if the fragment is invalid)
+        '''
+        if now is None:
+            now = time.time()
+        count, index, data = fragment["count"], fragment["index"], fragment["data"]
+        if count < 2 or index >= count or len(data) > self.__maxBytes:
+            return None
+        key = (address, fragment["msgId"])
+        entry = self.__pending.get(key)
+        if entry is not None and (entry[1] != count or now - entry[0] > self.__timeout):
+            self.__drop(key)
+            entry = None
+        if entry is None:
+            self.__makeRoom(len(data))
+            entry = [now, count, 0, 0, {}]
+            self.__pending[key] = entry
+        elif self.__bytes + len(data) > self.__maxBytes:
+            self.__makeRoom(len(data))
+            if key not in self.__pending:
+                return None
+        if index in entry[4]:
+            return None
+        entry[4][index] = data
+        entry[2] += 1
+        entry[3] += len(data)
+        self.__bytes += len(data)
+        if entry[2] < count:
+            return None
+        del self.__pending[key]
+        self.__bytes -= entry[3]
+        self.__completed += 1
+        return "".join(entry[4][index] for index in range(count))
@@ -0,0 +1,115 @@
+import zlib,signal,threading
+from multiprocessing import Pool
+from cryptography.hazmat.primitives import serialization,hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.backends import default_backend
+
+_privateKey = None                          # Loaded once in every worker process
+
+
+def _loadKey(keyFile):
+    '''
+        _loadKey(String):
+            Input   : Path of the servers private key
+            Output  : None
+            Purpose : Pool initializer, runs once in each worker process
+    '''
+    global _privateKey
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    with open(keyFile, "rb") as key_file:
+        _privateKey = serialization.load_pem_private_key(
+            key_file.read(),
+            password=None,
+            backend=default_backend())
+
+
+def _decrypt(message):
+    '''
+        _decrypt(String):
+            Input   : The string to be decrypted
+            Output  : String -> The decrypted and decompressed string
+                      None   -> If the message could not be decrypted
+    '''
+    try:
+        plainText = _privateKey.decrypt(
+            message,
+            padding.OAEP(
+                mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None))
+        return zlib.decompress(plainText)
+    except Exception:
+        return None
+
+
+def _sign(message):
+    '''
+        _sign(String):
+            Input   : The string to be signed
+            Output  : String -> The signature
+                      None   -> If the message could not be signed
+    '''
+    try:
+        signer = _privateKey.signer(
+            padding.PSS(
+                mgf=padding.MGF1(hashes.SHA256()),
+                salt_length=padding.PSS.MAX_LENGTH),
+            hashes.SHA256())
+        signer.update(message)
+        return signer.finalize()
+    except Exception:
+        return None
+
+
+class privateKeyPool:
+    '''
+        privateKeyPool : Type -> class
+        purpose : Runs the servers RSA private key operations (OAEP decrypt and
+                    PSS sign) on a bounded pool of worker processes
+        Features : a) Async submission, the result is handed to a callback
+                   b) Queue depth limit, once maxQueue operations are waiting new
+                        handshakes are refused instead of piling up
+    '''
+    __operations = {
+        "decrypt"   : _decrypt,
+        "sign"      : _sign,
+    }
+
+    def __init__(self, keyFile, processes, maxQueue):
+        self.__pool = Pool(processes, _loadKey, (keyFile,))
+        self.__maxQueue = maxQueue
+        self.__pending = 0
+        self.__refused = 0
+        self.__lock = threading.Lock()
+
+    def submit(self, operation, message, callback):
+        '''
+            submit(String,String,function):
+                Input   : "decrypt" or "sign", the message and the function to be called
+                            with the result (None if the operation failed)
+                Output  : Boolean (False if the queue is full and the operation was refused)
+                Purpose : Queue a private key operation on the pool
+        '''
+        with self.__lock:
+            if self.__pending >= self.__maxQueue:
+                self.__refused += 1
+                return False
+            self.__pending += 1
+
+        def done(result):
+            with self.__lock:
+                self.__pending -= 1
+            try:
+                callback(result)
+            except Exception as e:
+                print "Error after private key operation", e
+        self.__pool.apply_async(self.__operations[operation], (message,), callback=done)
+        return True
+
+    def getPending(self):
+        return self.__pending
+
+    def getRefused(self):
+        return self.__refused
@@ -0,0 +1,402 @@
+'''
+        Offline mail of users that are not connected
+
+        Mail is kept in an append-only log split in segments of segmentSize bytes,
+        every segment a file of the log directory mapped in memory (mmap). A
+        record is
+            | length (4 bytes) | crc32 of the body (4 bytes) | body |
+        and the body is
+            | kind (1 byte) | mailNo (8 bytes) | recipient (2 byte length + bytes) | ...
+        MAIL records go on with the sender, the id of the key the mail was
+        encrypted with, the nonce and the cipher text; an ACK record means every
+        mail of the recipient up to mailNo was delivered. Mail is numbered per
+        recipient. A length of 0 ends the records of a segment (the files are
+        created full of zeros), so does a record with a wrong crc32 (torn write).
+
+        The index (pending mail of every recipient and where it is) lives in
+        memory and is built again by reading the log at start. Several server
+        processes (-procs) share the log: every operation takes a lock on the
+        directory (flock) and first reads what the others appended since.
+
+        Compaction works on the oldest segment only, so an ACK is never dropped
+        before the mail it acknowledges: once less than a quarter of it is mail
+        not delivered yet, that mail and the last ACK of the recipients it holds
+        are appended again at the end of the log and the segment file is deleted.
+'''
+
+import os,zlib,fcntl,mmap,hmac,struct,hashlib,threading
+
+SEGMENT_SIZE = 4 << 20                  # Bytes of one segment file
+MAX_MAILBOX = 1024                      # Mail waiting for one recipient
+COMPACT_LIVE = 0.25                     # Oldest segment is compacted below this share of live mail
+MAIL = 1
+ACK = 2
+
+_header = struct.Struct("!II")          # length, crc32
+_head = struct.Struct("!BQ")            # kind, mailNo
+_length = struct.Struct("!H")
+_longLength = struct.Struct("!I")
+_keyId = struct.Struct("!Q")
+
+
+def _blob(value):
+    return _length.pack(len(value)) + value
+
+
+def _packMail(recipient, mailNo, sender, keyId, iv, data):
+    return "".join([_head.pack(MAIL, mailNo), _blob(recipient), _blob(sender), _keyId.pack(keyId),
+                    _blob(iv), _longLength.pack(len(data)), data])
+
+
+def _packAck(recipient, mailNo):
+    return _head.pack(ACK, mailNo) + _blob(recipient)
+
+
+def _readBlob(body, offset, length=_length):
+    size = length.unpack_from(body, offset)[0]
+    offset += length.size
+    return body[offset:offset + size], offset + size
+
+
+def _unpack(body):
+    '''
+        _unpack(String):
+            Input   : Body of a record
+            Output  : [kind, mailNo, recipient, sender, keyId, IV, data] (the last four are
+                        None for an ACK)
+    '''
+    kind, mailNo = _head.unpack_from(body)
+    recipient, offset = _readBlob(body, _head.size)
+    if kind != MAIL:
+        return [kind, mailNo, recipient, None, None, None, None]
+    sender, offset = _readBlob(body, offset)
+    keyId = _keyId.unpack_from(body, offset)[0]
+    iv, offset = _readBlob(body, offset + _keyId.size)
+    data, offset = _readBlob(body, offset, _longLength)
+    return [kind, mailNo, recipient, sender, keyId, iv, data]
+
+
+class mailLog:
+    '''
+        mailLog : Type -> class
+        purpose : Mail waiting for users that are offline, delivered when they log in
+        Features : a) append is a copy into the mapped segment, no write system call
+                   b) pending reads the mail of a recipient in order straight from the
+                        mapped segments, acknowledge drops it from the index
+                   c) Segments whose mail was delivered are deleted (see compaction above)
+                   d) Mail is sealed by the sender with a key only the sender and the
+                        recipient get from the server (mailKey), the log holds cipher text
+        Note : Like the keys of talk, the mail keys are made by the server, which
+                is trusted (see README)
+    '''
+    def __init__(self, directory, segmentSize=SEGMENT_SIZE, maxMailbox=MAX_MAILBOX):
+        '''
+            __init__(String,Number,Number):
+                Input   : Directory of the segments (created if missing), bytes of a segment
+                            and the most mail kept for one recipient
+                Output  : None
+        '''
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass                            # Created by another worker meanwhile
+        self.__directory = directory
+        self.__segmentSize = segmentSize
+        self.__maxMailbox = maxMailbox
+        self.__key = self.__loadKey(os.path.join(directory, "key"))
+        self.__lockFile = open(os.path.join(directory, "lock"), "a")
+        self.__threadLock = threading.Lock()
+        self.__segments = {}                    # number : [file, mmap, live bytes, {recipients acked}]
+        self.__boxes = {}                       # recipient : [next mailNo, acked mailNo, {mailNo : offset}]
+        self.__position = [0, 0]                # [segment, offset] read or written up to
+        self.__appended = 0
+        self.__compacted = 0
+        with self.__threadLock:
+            self.__lock()
+            try:
+                self.__catchUp()
+            finally:
+                self.__unlock()
+
+    @staticmethod
+    def __loadKey(path):
+        '''
+            __loadKey(String):
+                Input   : Path of the key file
+                Output  : String (32 byte key the mail keys are derived from, written once by
+                            whichever process comes first so mail survives a restart)
+        '''
+        if not os.path.exists(path):
+            temporary = path + "." + str(os.getpid())
+            descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+            os.write(descriptor, os.urandom(32))
+            os.close(descriptor)
+            try:
+                os.link(temporary, path)
+            except OSError:
+                pass                            # Another process won the race, use its key
+            os.unlink(temporary)
+        with open(path, "rb") as key_file:
+            return key_file.read()
+
+    def mailKey(self, sender, recipient, keyId):
+        '''
+            mailKey(String,String,Number):
+                Input   : Sender, recipient and the id of the key (random, given to the sender)
+                Output  : String (16 byte key of the mail from sender to recipient)
+        '''
+        return hmac.new(self.__key, _keyId.pack(keyId) + sender + "\0" + recipient,
+                        hashlib.sha256).digest()[:16]
+
+    def __lock(self):
+        fcntl.flock(self.__lockFile, fcntl.LOCK_EX)
+
+    def __unlock(self):
+        fcntl.flock(self.__lockFile, fcntl.LOCK_UN)
+
+    def __path(self, number):
+        return os.path.join(self.__directory, "%08d.seg" % number)
+
+    def __segmentNumbers(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.__directory) if name.endswith(".seg"))
+
+    def __segment(self, number, create=False):
+        '''
+            __segment(Number,Boolean):
+                Input   : Number of the segment, True to create its file
+                Output  : List -> [file, mmap, live bytes, {recipients acked}]
+                          None -> If the file does not exist (deleted by compaction)
+        '''
+        entry = self.__segments.get(number)
+        if entry is not None:
+            return entry
+        path = self.__path(number)
+        if create and not os.path.exists(path):
+            with open(path, "ab") as segment_file:
+                segment_file.truncate(self.__segmentSize)
+        try:
+            segment_file = open(path, "r+b")
+        except IOError:
+            return None
+        entry = [segment_file, mmap.mmap(segment_file.fileno(), self.__segmentSize), 0, set()]
+        self.__segments[number] = entry
+        return entry
+
+    def __close(self, number):
+        entry = self.__segments.pop(number, None)
+        if entry is not None:
+            entry[1].close()
+            entry[0].close()
+
+    def __read(self, offset):
+        '''
+            __read(Number):
+                Input   : Position of a record in the log
+                Output  : String -> Body of the record
+                          None   -> If there is no complete record there
+        '''
+        number, position = divmod(offset, self.__segmentSize)
+        entry = self.__segment(number)
+        if entry is None or position + _header.size > self.__segmentSize:
+            return None
+        length, crc = _header.unpack_from(entry[1], position)
+        end = position + _header.size + length
+        if length == 0 or end > self.__segmentSize:
+            return None
+        body = entry[1][position + _header.size:end]
+        if zlib.crc32(body) & 0xffffffff != crc:
+            return None
+        return body
+
+    def __apply(self, body, offset):
+        '''
+            __apply(String,Number):
+                Input   : Body of a record read or written and its position
+                Purpose : Update the index and the live bytes of the segments
+        '''
+        kind, mailNo, recipient = _unpack(body)[:3]
+        box = self.__boxes.setdefault(recipient, [1, 0, {}])
+        number = offset // self.__segmentSize
+        if kind == MAIL:
+            box[0] = max(box[0], mailNo + 1)
+            if mailNo <= box[1]:
+                return
+            previous = box[2].get(mailNo)
+            if previous is not None:
+                self.__release(previous)
+            box[2][mailNo] = offset
+            self.__segment(number)[2] += _header.size + len(body)
+        else:
+            box[1] = max(box[1], mailNo)
+            box[0] = max(box[0], mailNo + 1)
+            for delivered in [n for n in box[2] if n <= mailNo]:
+                self.__release(box[2].pop(delivered))
+            self.__segment(number)[3].add(recipient)
+
+    def __release(self, offset):
+        '''
+            __release(Number):
+                Input   : Position of a mail that was delivered or copied
+                Purpose : It no longer counts as live in its segment
+        '''
+        entry = self.__segments.get(offset // self.__segmentSize)
+        if entry is not None:
+            entry[2] -= _header.size + _header.unpack_from(entry[1], offset % self.__segmentSize)[0]
+
+    def __catchUp(self):
+        '''
+            __catchUp(None):
+                Purpose : Read the records appended since the last operation (by this or
+                            another process) and forget the segments that were deleted
+        '''
+        numbers = self.__segmentNumbers()
+        for number in [n for n in self.__segments if n not in numbers]:
+            self.__close(number)
+        number, position = self.__position
+        if numbers and number < numbers[0]:
+            number, position = numbers[0], 0
+        while number in numbers:
+            body = self.__read(number * self.__segmentSize + position)
+            if body is None:
+                later = [n for n in numbers if n > number]
+                if not later:
+                    break
+                number, position = later[0], 0
+                continue
+            self.__apply(body, number * self.__segmentSize + position)
+            position += _header.size + len(body)
+        self.__position = [number, position]
+
+    def __write(self, body):
+        '''
+            __write(String):
+                Input   : Body of a record
+                Output  : Number (Position of the record, a new segment is started when it
+                            does not fit in the last one)
+        '''
+        number, position = self.__position
+        size = _header.size + len(body)
+        if size > self.__segmentSize:
+            raise ValueError("record larger than a segment")
+        if position + size > self.__segmentSize or self.__segment(number) is None:
+            number, position = number + 1, 0
+        entry = self.__segment(number, True)
+        entry[1][position + _header.size:position + size] = body
+        entry[1][position:position + _header.size] = _header.pack(len(body), zlib.crc32(body) & 0xffffffff)
+        self.__position = [number, position + size]
+        offset = number * self.__segmentSize + position
+        self.__apply(body, offset)
+        return offset
+
+    def append(self, recipient, sender, keyId, iv, data):
+        '''
+            append(String,String,Number,String,String):
+                Input   : Recipient, sender, id of the mail key, nonce and cipher text
+                Output  : Number -> mailNo of the mail
+                          None   -> If the mailbox of the recipient is full
+        '''
+        with self.__threadLock:
+            self.__lock()
+            try:
+                self.__catchUp()
+                box = self.__boxes.get(recipient)
+                if box is not None and len(box[2]) >= self.__maxMailbox:
+                    return None
+                mailNo = box[0] if box is not None else 1
+                self.__write(_packMail(recipient, mailNo, sender, keyId, iv, data))
+                self.__appended += 1
+                return mailNo
+            finally:
+                self.__unlock()
+
+    def pending(self, recipient, budget):
+        '''
+            pending(String,Number):
+                Input   : Recipient and the bytes of cipher text wanted (at least one mail is
+                            given)
+                Output  : List of [mailNo, sender, keyId, IV, data], oldest first
+                Note    : A mail whose record can no longer be read (torn or overwritten) is
+                            dropped from the index and skipped
+        '''
+        with self.__threadLock:
+            self.__lock()
+            try:
+                self.__catchUp()
+                box = self.__boxes.get(recipient)
+                if box is None:
+                    return []
+                mail = []
+                for mailNo in sorted(box[2]):
+                    body = self.__read(box[2][mailNo])
+                    if body is None:
+                        self.__release(box[2].pop(mailNo))
+                        continue
+                    fields = _unpack(body)
+                    if mail and budget < len(fields[6]):
+                        break
+                    budget -= len(fields[6])
+                    mail.append([mailNo] + fields[3:])
+                return mail
+            finally:
+                self.__unlock()
+
+    def acknowledge(self, recipient, mailNo):
+        '''
+            acknowledge(String,Number):
+                Input   : Recipient and the last mailNo it received
+                Output  : None
+                Purpose : Drop the mail delivered and compact the log
+        '''
+        with self.__threadLock:
+            self.__lock()
+            try:
+                self.__catchUp()
+                box = self.__boxes.get(recipient)
+                if box is None or mailNo <= box[1] or mailNo >= box[0]:
+                    return
+                self.__write(_packAck(recipient, mailNo))
+                self.__compact()
+            finally:
+                self.__unlock()
+
+    def __compact(self):
+        '''
+            __compact(None):
+                Purpose : Delete the oldest segments while they hold little mail not
+                            delivered, copying that mail and their ACKs to the end of the log
+        '''
+        numbers = self.__segmentNumbers()
+        while len(numbers) > 1 and numbers[0] != self.__position[0]:
+            oldest = self.__segment(numbers[0])
+            if oldest is None or oldest[2] > self.__segmentSize * COMPACT_LIVE:
+                return
+            first, last = numbers[0] * self.__segmentSize, (numbers[0] + 1) * self.__segmentSize
+            for recipient, box in self.__boxes.items():
+                for mailNo in sorted(box[2]):
+                    if first <= box[2][mailNo] < last:
+                        body = self.__read(box[2][mailNo])
+                        if body is None:
+                            self.__release(box[2].pop(mailNo))
+                        else:
+                            self.__write(body)
+                if recipient in oldest[3] and box[1] > 0:
+                    self.__write(_packAck(recipient, box[1]))
+            self.__close(numbers.pop(0))
+            os.unlink(self.__path(first // self.__segmentSize))
+            self.__compacted += 1
+
+    def getStats(self):
+        '''
+            getStats(None):
+                Output  : Dictionary (Segments, mail waiting, recipients, mail appended and
+                            segments compacted by this process)
+        '''
+        with self.__threadLock:
+            return {
+                "segments"      : len(self.__segments),
+                "pending"       : sum(len(box[2]) for box in self.__boxes.values()),
+                "recipients"    : len([box for box in self.__boxes.values() if box[2]]),
+                "appended"      : self.__appended,
+                "compacted"     : self.__compacted,
+            }
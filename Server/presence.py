@@ -0,0 +1,79 @@
+import bisect,itertools,collections
+
+class presenceDirectory:
+    '''
+        presenceDirectory : Type -> class
+        purpose : Users currently connected, with a version that grows by one on every
+                    login and logout so clients can keep a mirror of the list up to date
+                    by asking only for what changed
+        Features : a) The users are kept sorted, a page (users after a name) is a bisect
+                   b) The last maxLog changes are kept, changesSince answers with the
+                        changes after a version or None when they are no longer known
+                        (the client then pages through the list again)
+    '''
+    def __init__(self, maxLog=4096):
+        '''
+            __init__(Number):
+                Input   : Number of changes remembered
+                Output  : None
+        '''
+        self.__version = 0
+        self.__log = collections.deque(maxlen=maxLog)   # [version, user, online]
+        self.__users = []                               # Sorted user names
+
+    def getVersion(self):
+        return self.__version
+
+    def __len__(self):
+        return len(self.__users)
+
+    def __record(self, user, online):
+        self.__version += 1
+        self.__log.append([self.__version, user, online])
+
+    def join(self, user):
+        '''
+            join(String):
+                Input   : User that logged in (nothing changes if already listed)
+        '''
+        index = bisect.bisect_left(self.__users, user)
+        if index < len(self.__users) and self.__users[index] == user:
+            return
+        self.__users.insert(index, user)
+        self.__record(user, True)
+
+    def leave(self, user):
+        '''
+            leave(String):
+                Input   : User that logged out or expired (nothing changes if not listed)
+        '''
+        index = bisect.bisect_left(self.__users, user)
+        if index == len(self.__users) or self.__users[index] != user:
+            return
+        del self.__users[index]
+        self.__record(user, False)
+
+    def changesSince(self, since, limit):
+        '''
+            changesSince(Number,Number):
+                Input   : Version the client has and the maximum number of changes
+                Output  : List of [version, user, online] -> The changes after since, oldest first
+                          None -> If the changes after since are not remembered any more
+        '''
+        if since > self.__version:
+            return None
+        if since == self.__version:
+            return []
+        if not self.__log or since < self.__log[0][0] - 1:
+            return None
+        start = since - self.__log[0][0] + 1
+        return [list(change) for change in itertools.islice(self.__log, start, start + limit)]
+
+    def page(self, after, limit):
+        '''
+            page(String,Number):
+                Input   : Last user of the previous page ("" for the first page), page size
+                Output  : List (At most limit users sorted by name)
+        '''
+        index = bisect.bisect_right(self.__users, after)
+        return self.__users[index:index + limit]
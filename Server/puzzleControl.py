@@ -0,0 +1,100 @@
+import math,time,threading
+
+MAX_BITS = 31                           # space is sent as a U32 and the answer as an I32 (see wire.py)
+
+class puzzleDifficulty:
+    '''
+        puzzleDifficulty : Type -> class
+        purpose : Chooses the search space of the now-online puzzle from the load
+                    of the server, so logins are cheap when the server is idle and
+                    a flood of hellos costs the sender more work per attempt
+        Features : a) Load is the larger of the handshake backlog (handshakes queued
+                        on the server loop) and the rate of RSA decryptions, each
+                        relative to the level the server is configured to absorb
+                   b) Re-evaluated at most every interval seconds, the difficulty
+                        grows by 2 bits when overloaded and shrinks by 1 bit per
+                        interval elapsed while the load is under half. The decryption
+                        rate is an average that forgets half of the past per interval,
+                        however long the server stayed idle
+                   c) Current difficulty and inputs are exposed through getStats
+    '''
+    def __init__(self, minBits=4, maxBits=22, maxBacklog=16, maxDecryptRate=100, interval=0.5):
+        '''
+            __init__(Number,Number,Number,Number,float):
+                Input   : Smallest and largest search space (as powers of two), handshake
+                            backlog and RSA decryptions per second considered full load,
+                            seconds between two adjustments (both sizes are capped at
+                            MAX_BITS)
+                Output  : None
+        '''
+        self.__minBits = min(max(minBits, 0), MAX_BITS)
+        self.__maxBits = min(max(maxBits, self.__minBits), MAX_BITS)
+        self.__maxBacklog = max(maxBacklog, 1)
+        self.__maxDecryptRate = max(maxDecryptRate, 1)
+        self.__interval = interval
+        self.__lock = threading.Lock()
+        self.__bits = self.__minBits
+        self.__backlog = 0
+        self.__decrypts = 0                     # Decryptions since the last adjustment
+        self.__decryptRate = 0.0                # Smoothed decryptions per second
+        self.__lastUpdate = time.time()
+        self.__raises = 0
+        self.__lowers = 0
+
+    def recordDecrypt(self):
+        '''
+            recordDecrypt(None):
+                Purpose : Count one RSA decryption (one handshake message)
+        '''
+        with self.__lock:
+            self.__decrypts += 1
+
+    def setBacklog(self, backlog):
+        '''
+            setBacklog(Number):
+                Input   : Handshakes waiting for or running on the workers / key pool
+        '''
+        self.__backlog = backlog
+
+    def __update(self, now):
+        elapsed = now - self.__lastUpdate
+        if elapsed < self.__interval:
+            return
+        kept = math.exp(-elapsed * math.log(2) / self.__interval)
+        self.__decryptRate = kept * self.__decryptRate + (1 - kept) * self.__decrypts / elapsed
+        self.__decrypts = 0
+        self.__lastUpdate = now
+        load = max(float(self.__backlog) / self.__maxBacklog,
+                   self.__decryptRate / self.__maxDecryptRate)
+        if load >= 1 and self.__bits < self.__maxBits:
+            self.__bits = min(self.__bits + 2, self.__maxBits)
+            self.__raises += 1
+        elif load < 0.5 and self.__bits > self.__minBits:
+            self.__bits = max(self.__bits - int(elapsed / self.__interval), self.__minBits)
+            self.__lowers += 1
+
+    def space(self):
+        '''
+            space(None):
+                Output  : Number (Size of the search space for the next puzzle)
+        '''
+        with self.__lock:
+            self.__update(time.time())
+            return 1 << self.__bits
+
+    def getStats(self):
+        '''
+            getStats(None):
+                Output  : Dictionary (Current difficulty in bits and search space, the inputs
+                            of the controller and how often it moved)
+        '''
+        with self.__lock:
+            self.__update(time.time())
+            return {
+                "bits"          : self.__bits,
+                "space"         : 1 << self.__bits,
+                "backlog"       : self.__backlog,
+                "decryptRate"   : round(self.__decryptRate, 1),
+                "raises"        : self.__raises,
+                "lowers"        : self.__lowers,
+            }
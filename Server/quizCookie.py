@@ -0,0 +1,100 @@
+import os,time,hmac,struct,hashlib,binascii,threading,collections
+
+MAX_USED_COOKIES = 65536               # Solved quizzes remembered until they expire
+
+class quizCookie:
+    '''
+        quizCookie : Type -> class
+        purpose : Stateless now-online challenge. The quiz is a time stamped HMAC
+                    over the user, the address and the puzzle size, the client
+                    echoes it in its quiz-response and the server checks it again
+                    with the same key, so nothing is stored for a hello until
+                    the puzzle has been solved
+        Features : a) The hidden number is derived from the cookie with the key,
+                        the client can only find it by searching the space
+                   b) Cookies are bound to the address the quiz was sent to, a
+                        spoofed hello never receives the cookie it would need
+                   c) Cookies expire after lifetime seconds
+                   d) A solved cookie is accepted once: it is remembered until it
+                        expires, a replayed quiz-response gets no new handshake
+        Note : Every process serving the same clients (-procs) needs the same key.
+                Used cookies are remembered per process, the kernel gives every
+                datagram from an address to the same worker (SO_REUSEPORT)
+    '''
+    def __init__(self, key=None, lifetime=30, maxUsed=MAX_USED_COOKIES):
+        '''
+            __init__(String,Number,Number):
+                Input   : Secret key of the HMAC (random if not given), seconds a quiz
+                            may be answered, solved cookies remembered at most (when
+                            that many have not expired yet, new answers are refused)
+                Output  : None
+        '''
+        if key is None:
+            key = os.urandom(32)
+        self.__key = key
+        self.__lifetime = lifetime
+        self.__maxUsed = maxUsed
+        self.__lock = threading.Lock()
+        self.__used = set()                     # Cookies already answered
+        self.__expiries = collections.deque()   # [expiry time, cookie] in the order they were used
+
+    def __mac(self, user, address, space, timestamp):
+        message = struct.pack("!IIH", space, timestamp, address[1]) + str(address[0]) + "\0" + user
+        return hmac.new(self.__key, message, hashlib.sha256).digest()
+
+    def __answer(self, cookie, space):
+        digest = hmac.new(self.__key, "answer" + cookie, hashlib.sha256).digest()
+        return int(binascii.hexlify(digest), base=16) % space
+
+    def issue(self, user, address, space):
+        '''
+            issue(String,tuple,Number):
+                Input   : User name, address of the hello and size of the puzzle
+                Output  : Dictionary -> The fields of the quiz packet
+                            {challange (the cookie), answer (sha256 of cookie + hidden number),
+                             space, timestamp}
+        '''
+        timestamp = int(time.time())
+        cookie = self.__mac(user, address, space, timestamp)
+        sha = hashlib.sha256()
+        sha.update(cookie + str(self.__answer(cookie, space)))
+        return {
+            "challange"     : cookie,
+            "answer"        : sha.digest(),
+            "space"         : space,
+            "timestamp"     : timestamp,
+        }
+
+    def verify(self, user, address, cookie, space, timestamp, answer):
+        '''
+            verify(String,tuple,String,Number,Number,Number):
+                Input   : User name and address of the quiz-response, the echoed cookie,
+                            space and timestamp and the number found by the client
+                Output  : Boolean (True if the cookie was issued by this server for this
+                            user and address, has not expired, was not answered before
+                            and the answer is right)
+        '''
+        now = int(time.time())
+        if space <= 0 or timestamp > now + 1 or now - timestamp > self.__lifetime:
+            return False
+        if not hmac.compare_digest(self.__mac(user, address, space, timestamp), cookie):
+            return False
+        if self.__answer(cookie, space) != answer:
+            return False
+        return self.__markUsed(cookie, timestamp + self.__lifetime, now)
+
+    def __markUsed(self, cookie, expiry, now):
+        '''
+            __markUsed(String,Number,Number):
+                Input   : A solved cookie, the time it expires and the time now
+                Output  : Boolean (False if the cookie was used before or too many are
+                            remembered)
+        '''
+        with self.__lock:
+            while self.__expiries and self.__expiries[0][0] < now:
+                self.__used.discard(self.__expiries.popleft()[1])
+            if cookie in self.__used or len(self.__used) >= self.__maxUsed:
+                return False
+            self.__used.add(cookie)
+            self.__expiries.append([expiry, cookie])
+            return True
@@ -1,5 +1,17 @@
-import sys,socket,signal
+import os,sys,socket,signal,select,errno,Queue
 import serverConnection
+from sessionStore import sqliteSessionStore
+from keyPool import privateKeyPool
+from dhPool import keyPairPool
+from puzzleControl import puzzleDifficulty
+from quizCookie import quizCookie
+from resumption import resumeTicket
+from stats import serverStats
+from datagramBatch import datagramRing
+from fragment import fragmenter
+from multiprocessing.pool import ThreadPool
+
+SESSION_DB = "SESSIONS.db"                  # Shared state of -procs workers
 
 class server():
     '''
@@ -8,10 +20,10 @@ class server():
             * Opens socket on port 2424 and listens for connections from clients
         Note : Uses SERVER.conf to obtain config related information
     '''
-    def __init__(self,port):
+    def __init__(self,port,reusePort=False):
         '''
-            __init__(None):
-                Input   : None
+            __init__(Number,Boolean):
+                Input   : Port to listen on, True if several processes share the port
                 Output  : None
                 Purpose : 1) Initialize the server
                           2) Create server socket and bind to port 2424
@@ -23,6 +35,10 @@ class server():
         except socket.error, msg:
             print "Failed to create socket"
             sys.exit(0)
+        self.__ring = None                      # datagramRing when reading in batches (-batch)
+        self.__fragmenter = fragmenter()        # Responses longer than one datagram are fragmented
+        if reusePort:
+            self.sock.setsockopt(socket.SOL_SOCKET, getattr(socket, "SO_REUSEPORT", 15), 1)
         try:
             self.sock.bind(('', port))
         except socket.error , msg:
@@ -41,34 +57,83 @@ class server():
         '''
         self.sock.close()
 
+    def __datagrams(self, response, address):
+        '''
+            __datagrams(String,tuple):
+                Input   : A response of the connection and whom it is to be sent to: an
+                            address, a list of addresses (room fan-out, the packet is split
+                            once) or None when response is a list of [String,tuple]
+                Output  : List of [String,tuple] (Every datagram to send)
+        '''
+        if isinstance(response, list):
+            return [datagram for part, partAddress in response
+                    for datagram in self.__datagrams(part, partAddress)]
+        datagrams = self.__fragmenter.split(response)
+        if not isinstance(address, list):
+            return [[datagram, address] for datagram in datagrams]
+        return [[datagram, member] for member in address for datagram in datagrams]
+
     def __sendData(self,data,address):
         '''
             __sendData(String,tuple):
-                Input   : String to be sent, Address to whom to be sent
+                Input   : String to be sent, Address to whom to be sent (see __datagrams)
                 Output  : None
                 Purpose : Send message to client
 
         '''
         try:
-            self.sock.sendto(data, address)
+            for datagram, address in self.__datagrams(data, address):
+                self.sock.sendto(datagram, address)
         except Exception as e:
             print data
             print "Error while sending data to",address
             print e
 
-    def run(self,connectionHandel):
+    def __sendBatch(self, responses):
         '''
-            run(connectionHandel) :
-                Input   : Connection (Addapter Object)
+            __sendBatch(List):
+                Input   : List of [String,tuple] (Responses and whom they are to be sent to)
+                Output  : None
+                Purpose : Send all responses of a batch together through the ring
+        '''
+        if not responses:
+            return
+        responses = [datagram for response, address in responses
+                     for datagram in self.__datagrams(response, address)]
+        failed = self.__ring.send(responses)
+        if failed:
+            print "Error while sending " + str(failed) + " of " + str(len(responses)) + " responses"
+
+    def run(self,connectionHandel,batch=0):
+        '''
+            run(connectionHandel, Number) :
+                Input   : Connection (Addapter Object), datagrams per batch (0 for one
+                            recvfrom / sendto per datagram)
                 Output  : None
                 Purpose : Actively listen to the server 2424 port
                           and server clients based on message type
 
         '''
+        if batch > 0:
+            return self.__runBatched(connectionHandel, batch)
         print "Server running"
+        self.sock.settimeout(connectionHandel.getTimerInterval())
         while True:
-            data , address = self.sock.recvfrom(4096)
-            response, address = connectionHandel.parseData(data, address)
+            connectionHandel.expire()
+            try:
+                data , address = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            try:
+                response, address = connectionHandel.parseData(data, address)
+            except Exception as e:
+                print "Error while handling request from", address
+                print e
+                continue
             try:
                 if not isinstance(response, (int)):
                     self.__sendData(response, address)
@@ -76,9 +141,199 @@ class server():
                 print response
                 print e
 
-    def signal_handler(self,signal,frame):
-        self.__closeSocket()
-        sys.exit(0)
+    def __runBatched(self, connectionHandel, batch):
+        '''
+            __runBatched(connectionHandel, Number) :
+                Input   : Connection (Addapter Object), datagrams per batch
+                Output  : None
+                Purpose : Version of run that wakes up once per burst instead of once per
+                            datagram. Every waiting datagram is read into the ring (up to
+                            batch per call), handled, and the responses are sent together
+        '''
+        self.__ring = datagramRing(self.sock, batch)
+        print "Server running (batches of " + str(batch) + \
+            (", recvmmsg)" if self.__ring.usesMultiMessage() else ", recvfrom_into)")
+        while True:
+            connectionHandel.expire()
+            try:
+                ready_to_read, ready_to_write, in_error = \
+                    select.select([self.sock], [], [], connectionHandel.getTimerInterval())
+            except select.error as e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+            received = [None] * batch
+            while len(received) == batch:
+                received = self.__ring.receive()
+                responses = []
+                for data, address in received:
+                    try:
+                        response, address = connectionHandel.parseData(data, address)
+                    except Exception as e:
+                        print "Error while handling request from", address
+                        print e
+                        continue
+                    if not isinstance(response, (int)):
+                        responses.append([response, address])
+                self.__sendBatch(responses)
+
+    def __handshakeWorker(self, connectionHandel, unPickledData, address):
+        '''
+            __handshakeWorker(Connection,Object,tuple) :
+                Input   : Connection (Addapter Object), the objectified packet and
+                            the address it came from
+                Output  : [String,tuple] -> The response and whom it is to be sent to
+                Purpose : Runs on a worker thread. Performs the private key heavy part of
+                            the authentication protocol so the server loop is never blocked
+        '''
+        try:
+            return connectionHandel.parseObject(unPickledData, address)
+        except (Exception, SystemExit) as e:
+            print "Error while handling handshake from", address
+            print e
+            return [False, address]
+
+    def __handshakeDone(self, response):
+        '''
+            __handshakeDone([String,tuple]) :
+                Input   : The response computed by __handshakeWorker
+                Output  : None
+                Purpose : Hand the response back to the server loop and wake it up
+        '''
+        self.__completed.put(response)
+        try:
+            self.__wakeWrite.send("x")
+        except socket.error:
+            pass
+
+    def __flushCompleted(self):
+        '''
+            __flushCompleted(None) :
+                Input   : None
+                Output  : None
+                Purpose : Send every response finished by the worker threads
+        '''
+        try:
+            while True:
+                self.__wakeRead.recv(4096)
+        except socket.error:
+            pass
+        responses = []
+        while True:
+            try:
+                response, address = self.__completed.get_nowait()
+            except Queue.Empty:
+                break
+            self.__pendingHandshakes -= 1
+            if not isinstance(response, (int)):
+                responses.append([response, address])
+        if self.__ring is not None:
+            self.__sendBatch(responses)
+            return
+        for response, address in responses:
+            self.__sendData(response, address)
+
+    def __dispatch(self, connectionHandel, data, address):
+        '''
+            __dispatch(Connection,String,tuple) :
+                Input   : Connection (Addapter Object), a datagram and its sender
+                Output  : [String,tuple] -> Response to send now
+                          None           -> Nothing to send now (handshakes are answered
+                                            later from __flushCompleted)
+                Purpose : Session traffic is answered inline, handshakes are queued on the
+                            worker pool
+        '''
+        unPickledData = connectionHandel.loadData(data, address)
+        if not unPickledData:
+            return None
+        try:
+            if connectionHandel.isHandshake(unPickledData) and connectionHandel.offloadsPrivateKey():
+                self.__pendingHandshakes += 1
+                connectionHandel.parseObjectAsync(unPickledData, address, self.__handshakeDone)
+                return None
+            if connectionHandel.isHandshake(unPickledData):
+                self.__pendingHandshakes += 1
+                self.__pool.apply_async(self.__handshakeWorker,
+                                        (connectionHandel, unPickledData, address),
+                                        callback=self.__handshakeDone)
+                return None
+            response, address = connectionHandel.parseObject(unPickledData, address)
+            if not isinstance(response, (int)):
+                return [response, address]
+        except Exception as e:
+            print "Error while handling request from", address
+            print e
+        return None
+
+    def __drainSocket(self, connectionHandel):
+        '''
+            __drainSocket(Connection) :
+                Input   : Connection (Addapter Object)
+                Output  : None
+                Purpose : Read every datagram waiting on the socket, one recvfrom each or
+                            a batch at a time through the ring (-batch)
+        '''
+        if self.__ring is not None:
+            received = [None] * self.__ring.getSize()
+            while len(received) == self.__ring.getSize():
+                received = self.__ring.receive()
+                responses = []
+                for data, address in received:
+                    response = self.__dispatch(connectionHandel, data, address)
+                    if response is not None:
+                        responses.append(response)
+                self.__sendBatch(responses)
+            return
+        while True:
+            try:
+                data, address = self.sock.recvfrom(4096)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                raise
+            response = self.__dispatch(connectionHandel, data, address)
+            if response is not None:
+                self.__sendData(response[0], response[1])
+
+    def runAsync(self, connectionHandel, workers, batch=0):
+        '''
+            runAsync(connectionHandel, Number, Number) :
+                Input   : Connection (Addapter Object), number of worker threads and
+                            datagrams per batch (0 for one recvfrom / sendto per datagram)
+                Output  : None
+                Purpose : Event driven version of run. The socket is non blocking and
+                            polled with select, packets from authenticated clients are
+                            answered on the loop while RSA / DH work for handshakes runs
+                            on a pool of worker threads (the crypto backend releases the
+                            GIL), so a slow login never stalls established sessions.
+                            If the connection has a key pool (-keyprocs) handshakes are
+                            submitted to it directly instead
+        '''
+        print "Server running (async, " + str(workers) + " workers)"
+        self.sock.setblocking(0)
+        if batch > 0:
+            self.__ring = datagramRing(self.sock, batch)
+        self.__pool = ThreadPool(workers)
+        self.__completed = Queue.Queue()
+        self.__pendingHandshakes = 0            # Handshakes handed to workers, not answered yet
+        self.__wakeRead, self.__wakeWrite = socket.socketpair()
+        self.__wakeRead.setblocking(0)
+        self.__wakeWrite.setblocking(0)
+        inputStreams = [self.sock, self.__wakeRead]
+        while True:
+            try:
+                ready_to_read, ready_to_write, in_error = \
+                    select.select(inputStreams, [], [], connectionHandel.getTimerInterval())
+            except select.error as e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+            if self.sock in ready_to_read:
+                self.__drainSocket(connectionHandel)
+            if self.__wakeRead in ready_to_read:
+                self.__flushCompleted()
+            connectionHandel.setHandshakeBacklog(self.__pendingHandshakes)
+            connectionHandel.expire()
 
     def signal_handler(self, signal, frame):
         '''
@@ -98,7 +353,16 @@ def terminalError():
         Output  : None
         Purpose : Log error in starting program
     '''
-    print "Please provide sufficient arguments\nUsage : python server.py -sp <server port>"
+    print "Please provide sufficient arguments\nUsage : python server.py -sp <server port> " \
+          "[-async <worker threads>] [-procs <worker processes>]\n" \
+          "              [-keyprocs <private key processes> -keyqueue <max queued key operations>]\n" \
+          "              [-dhpool <precomputed DH key pairs, 0 to disable> -dhlow <refill below>]\n" \
+          "              [-puzzlemax <max puzzle bits> -puzzlerate <RSA decryptions/s at full load>]\n" \
+          "              [-authttl <seconds to finish a handshake> -sessionttl <idle seconds of a session>]\n" \
+          "              [-stats <seconds between dumps of STATS.json, 0 to dump on SIGUSR1 only>]\n" \
+          "              [-batch <datagrams read and answered per system call, 0 to disable>]\n" \
+          "              [-resumettl <seconds a resumption ticket may be used, 0 to disable tickets>]\n" \
+          "Note : -keyprocs is only used with -async"
     sys.exit(0)
 
 def checkParameters():
@@ -117,10 +381,135 @@ def checkParameters():
         terminalError()
     return port
 
+def checkOptions():
+    '''
+        Output  : Dictionary
+        Purpose : Read the optional "-flag <number>" pairs given after the server port
+    '''
+    options = {
+        "async" : 0,
+        "procs" : 0,
+        "keyprocs" : 0,
+        "keyqueue" : 64,
+        "dhpool" : 64,
+        "dhlow" : 16,
+        "puzzlemax" : 22,
+        "puzzlerate" : 100,
+        "authttl" : 30,
+        "sessionttl" : 900,
+        "stats" : 10,
+        "batch" : 0,
+        "resumettl" : 3600,
+    }
+    args = sys.argv[3:]
+    if len(args) % 2:
+        terminalError()
+    for flag, value in zip(args[0::2], args[1::2]):
+        if not flag.startswith("-") or flag[1:] not in options:
+            terminalError()
+        try:
+            options[flag[1:]] = int(value)
+        except Exception as e:
+            terminalError()
+    return options
+
+
+def newConnection(options, store=None, cookieKey=None, statsPath="STATS.json", ticketKey=None):
+    '''
+        Input   : Dictionary, Object, String, String, String (Command line options, where session
+                    state is kept, key of the quiz cookies (random if not given), file of the
+                    stats, key of the resumption tickets (random if not given))
+        Output  : Connection (Addapter Object)
+        Purpose : Create the connection handler, with a private key pool and a
+                    Diffie Hellman key pair pool if requested. The puzzle difficulty
+                    counts as full load half of -keyqueue queued handshakes
+    '''
+    keyPool = None
+    if options["async"] > 0 and options["keyprocs"] > 0:
+        keyPool = privateKeyPool("private_key.pem", options["keyprocs"], options["keyqueue"])
+    keyPairs = None
+    if options["dhpool"] > 0:
+        keyPairs = keyPairPool(options["dhpool"], options["dhlow"])
+    puzzle = puzzleDifficulty(maxBits=options["puzzlemax"], maxBacklog=options["keyqueue"] // 2,
+                              maxDecryptRate=options["puzzlerate"])
+    tickets = None
+    if options["resumettl"] > 0:
+        tickets = resumeTicket(ticketKey, options["resumettl"])
+    return serverConnection.Connection(store, keyPool, keyPairs=keyPairs, puzzle=puzzle,
+                                       cookies=quizCookie(cookieKey), authTimeout=options["authttl"],
+                                       sessionTimeout=options["sessionttl"], stats=serverStats(statsPath),
+                                       statsInterval=options["stats"], tickets=tickets)
+
+def startServer(port, options, c, reusePort=False):
+    '''
+        Input   : Number, Dictionary, Connection (Port, command line options, Addapter Object)
+        Output  : None
+        Purpose : Run one server loop in this process
+    '''
+    s = server(port, reusePort)
+    signal.signal(signal.SIGINT, s.signal_handler)
+
+    def reloadCredentials(signum, frame):
+        c.reloadCredentials()
+    signal.signal(signal.SIGHUP, reloadCredentials)
+
+    def dumpStats(signum, frame):
+        c.dumpStats()
+    signal.signal(signal.SIGUSR1, dumpStats)
+    if options["async"] > 0:
+        s.runAsync(c, options["async"], options["batch"])
+    else:
+        s.run(c, options["batch"])
+
+def startWorkers(port, options):
+    '''
+        Input   : Number, Dictionary (Port, command line options)
+        Output  : None
+        Purpose : Fork one worker per -procs, all bound to the same port with SO_REUSEPORT.
+                    The kernel spreads clients across workers, session state is shared
+                    through SESSIONS.db so any worker can serve any authenticated user
+    '''
+    sqliteSessionStore.create(SESSION_DB)
+    cookieKey = os.urandom(32)                  # Quiz cookies are checked by whichever worker gets the answer
+    ticketKey = os.urandom(32)                  # So are resumption tickets
+    children = []
+    for i in range(options["procs"]):
+        pid = os.fork()
+        if pid == 0:
+            c = newConnection(options, sqliteSessionStore(SESSION_DB), cookieKey,
+                              "STATS-" + str(i) + ".json", ticketKey)
+            startServer(port, options, c, True)
+            os._exit(0)
+        children.append(pid)
+
+    def stopWorkers(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        sys.exit(0)
+    def forwardSignal(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+    signal.signal(signal.SIGINT, stopWorkers)
+    signal.signal(signal.SIGTERM, stopWorkers)
+    signal.signal(signal.SIGHUP, forwardSignal)
+    signal.signal(signal.SIGUSR1, forwardSignal)
+    print "Started " + str(len(children)) + " worker processes"
+    while children:
+        try:
+            children.remove(os.wait()[0])
+        except OSError:
+            pass
 
 if __name__ == "__main__":
-    c = serverConnection.Connection()
     port = checkParameters()
-    s = server(port)
-    signal.signal(signal.SIGINT, s.signal_handler)
-    s.run(c)
\ No newline at end of file
+    options = checkOptions()
+    if options["procs"] > 1:
+        startWorkers(port, options)
+    else:
+        startServer(port, options, newConnection(options))
\ No newline at end of file
@@ -1,12 +1,32 @@
-import os,sys,DH,pickle,binascii
-import hashlib,zlib,json
+import os,sys,DH,wire,struct,binascii
+import hashlib,hmac,zlib,threading,time,collections
 from Auth import Auth
-from symetric import symetric
-from random import randint
+from symetric import symetric,SERVER_TO_CLIENT,CLIENT_TO_SERVER
+from sessionStore import sessionStore
+from credentialStore import credentialStore
+from puzzleControl import puzzleDifficulty
+from quizCookie import quizCookie
+from timerWheel import timerWheel
+from stats import serverStats
+from fragment import reassembler
+from resumption import resumedKey,resumeProof,NONCE_SIZE
+from mailLog import mailLog
 from cryptography.hazmat.primitives import serialization,hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.backends import default_backend
 
+MAX_CACHED_CIPHERS = 65536              # Session ciphers kept before the cache is emptied
+PRESENCE_BUDGET = 3000                  # Bytes of user names per presence answer (client reads 4096)
+PRESENCE_PAGE = 512                     # Users read from the store for one page
+PRESENCE_CHANGES = 1024                 # Changes read from the store for one list-changes
+MAX_REASSEMBLY_BYTES = 1 << 20          # Fragments of incomplete requests held (clients send small ones)
+ANSWERS_KEPT = 8                        # Answers per user sent again when a request is retransmitted
+                                        # (as many as a client keeps requests in flight)
+MAX_ROOM_MEMBERS = 1024                 # Members of one chat room
+MAIL_DIR = "MAILBOX"                    # Segments of the offline mail log
+MAX_MAIL_SIZE = 16384                   # Bytes of one offline mail
+MAILBAG_BUDGET = 32768                  # Bytes of mail sent in one mailbag (a sym message holds 64KB)
+
 class Connection:
     '''
         Provides adapter interfaces to Server Object
@@ -14,19 +34,69 @@ class Connection:
          and generates appropriate response to send to client
          Provides augmented strong password authentication
     '''
-    def __init__(self):
+    def __init__(self, store=None, keyPool=None, credentials=None, keyPairs=None, puzzle=None,
+                 cookies=None, authTimeout=30, sessionTimeout=900, stats=None, statsInterval=0,
+                 tickets=None, mail=None):
         '''
-           __init__(None):
-                Input  : None
+           __init__(Object,Object,Object,Object,Object,Object,Number,Number,Object,Number,Object,Object):
+                Input  : Object (Where connection state is kept, see sessionStore.py)
+                            defaults to an in memory sessionStore
+                         Object (privateKeyPool used by parseObjectAsync, see keyPool.py)
+                            defaults to performing private key operations inline
+                         Object (credentialStore with the password verifiers)
+                            defaults to one loaded from SERVER.conf
+                         Object (keyPairPool with precomputed Diffie Hellman key pairs)
+                            defaults to computing a fresh pair for every handshake
+                         Object (puzzleDifficulty choosing the now-online puzzle size)
+                            defaults to puzzleDifficulty()
+                         Object (quizCookie issuing and checking the now-online quiz)
+                            defaults to a quizCookie with a random key
+                         Number (Seconds a half open handshake is kept)
+                         Number (Seconds a session may stay idle)
+                         Object (serverStats collecting latencies and counters)
+                            defaults to serverStats writing STATS.json
+                         Number (Seconds between two dumps of the stats, 0 to dump only
+                            when dumpStats is called)
+                         Object (resumeTicket sealing the resumption tickets, see resumption.py)
+                            defaults to no tickets, every login does the full handshake
+                         Object (mailLog keeping the mail of offline users)
+                            defaults to a mailLog in MAIL_DIR
                 Output : None
                 Purpose : 1) Initialise objects to maintain connection state
                           2) Read server private key for future use
         '''
-        self.__diffiObj = DH.DiffieHellman()
-        self.__authDict         = {}
-        self.__sessionKeyDict   = {}            # username : [key,address]
-        self.__userNonceHistor  = {}            # nonce    : bool
-        self.__connectedClients = {}            # address  : username
+        self.__keyPairs = keyPairs
+        if puzzle is None:
+            puzzle = puzzleDifficulty()
+        self.__puzzle = puzzle
+        if cookies is None:
+            cookies = quizCookie()
+        self.__cookies = cookies
+        self.__tickets = tickets
+        if mail is None:
+            mail = mailLog(MAIL_DIR)
+        self.__mail = mail
+        self.__timers = timerWheel()            # ("auth" | "session", username)
+        self.__authTimeout = authTimeout
+        self.__sessionTimeout = sessionTimeout
+        if store is None:
+            store = sessionStore()
+        self.__store = store                    # auth state, session keys, nonce history
+        self.__stateLock = threading.RLock()    # Guards the store when run from worker threads
+        self.__keyPool = keyPool
+        if credentials is None:
+            credentials = credentialStore("SERVER.conf")
+        self.__credentials = credentials
+        self.__ciphers = {}                     # session key : symetric
+        self.__answers = {}                     # user : deque of [Seq of the request, answer]
+        self.__reassembler = reassembler(MAX_REASSEMBLY_BYTES, 64)
+        if stats is None:
+            stats = serverStats()
+        self.__stats = stats
+        self.__statsInterval = statsInterval
+        self.__addGauges()
+        if statsInterval > 0:
+            self.__timers.schedule(("stats", None), statsInterval)
         with open("private_key.pem", "rb") as key_file:
             try:
                 self.__privateKey = serialization.load_pem_private_key(
@@ -45,7 +115,7 @@ class Connection:
                 Purpose : Returns the session key of all clients authenticated
                             with server
         '''
-        return self.__sessionKeyDict
+        return self.__store.allSessions()
 
     def __nowOnlineResponse(self, senderObj, address):
         '''
@@ -53,25 +123,15 @@ class Connection:
                 Input  : None
                 Output : Obj { }
                 Message format
-                    {"message-type":"quiz", challange, hash{answer}}
+                    quiz {challange, hash{answer}, space, timestamp}
                 Purpose : When Client shows intent to connect Generate a challenge
-                            and send it to server
-        '''
-
-        if senderObj["user"] in self.__authDict:
-            self.__authDict.pop(senderObj["user"])
-        rand = os.urandom(100)
-        t = randint(30000,65536)
-        sha = hashlib.sha256()
-        sha.update(rand+str(t))
-        guess = sha.digest()
-        self.__authDict[senderObj["user"]] = Auth(str(t))
-        response =  [ pickle.dumps({
-                "message-type"  : "quiz",
-                "challange"     : rand,
-                "answer"        : guess
-             }), address]
-        return response
+                            and send it to server. The answer is in [0, space), space
+                            grows with the load of the server (see puzzleControl.py).
+                            The challenge is a cookie (see quizCookie.py), nothing is
+                            stored until the client answers it
+        '''
+        quiz = self.__cookies.issue(senderObj["user"], address, self.__puzzle.space())
+        return [wire.encode("quiz", quiz), address]
 
     def __findPasswordHashForUser(self, user):
         '''
@@ -82,62 +142,208 @@ class Connection:
                 Purpose :   Given a username searches if the user is registered
                             and returns the username and the password hash of user
         '''
-        with open("SERVER.conf") as json_file:
-            json_data = json.load(json_file)
-            if user.lower() in json_data:
-                return json_data[user.lower()]
-            else :
-                return False
-            
-    def __challangeResponse(self, senderObj, address):
+        return self.__credentials.lookup(user)
+
+    def reloadCredentials(self):
+        '''
+            reloadCredentials(None):
+                Input   : None
+                Output  : None
+                Purpose : Re-read SERVER.conf (ie. on SIGHUP) and log the credential statistics
+        '''
+        self.__credentials.reload()
+        print "Credentials reloaded", self.__credentials.getStats()
+
+    def getCredentialStats(self):
+        '''
+            getCredentialStats(None):
+                Output  : Dictionary (See credentialStore.getStats)
         '''
-            __challangeResponse(Object):
+        return self.__credentials.getStats()
+
+    def __challangeResponse(self, senderObj, address, callback, offload):
+        '''
+            __challangeResponse(Object,tuple,function,Boolean):
             Input  : Object {messageType:"quiz-response", encoded } (Response from server to challenge)
                             encoded -> {g^a mod p,response}s
-            Output : String (The response to be sent to client)
+                     The address, function called with the response and True if the
+                            signature may be computed on the key pool
+            Output : None (The response to be sent to client is passed to callback)
             Message format :
                         {messageType:"initiageSecret", sha256(g^ab mod p + g^bw mod p), g^b mod p}
             Purpose : Send server public secret and augmented information
 
         '''
-        response = [False, address]
-        if senderObj["user"] in self.__authDict:
-            authInfo = self.__authDict[senderObj["user"]]
-            if authInfo.getQuizz() == str(senderObj["answer"]):
-                response =  self.__challangeResponseHelper(senderObj, authInfo, address)
-            else :
-                self.__authDict.pop(senderObj["user"])
-        return response
+        if not self.__cookies.verify(senderObj["user"], address, senderObj["challange"],
+                                     senderObj["space"], senderObj["timestamp"], senderObj["answer"]):
+            self.__stats.count("drop.cookie")
+            callback([False, address])
+            return
+        authInfo = Auth(str(senderObj["answer"]))
+        self.__challangeResponseHelper(senderObj, authInfo, address, callback, offload)
 
-    def __challangeResponseHelper(self, senderObj, authInfo, address):
+    def __challangeResponseHelper(self, senderObj, authInfo, address, callback, offload):
         '''
-            __challangeResponseHelper(Object,Object,tuple):
+            __challangeResponseHelper(Object,Object,tuple,function,Boolean):
                     Input   : The  Objectified stream data from user,
-                                 Authentication info on server and address of incoming connection
-                    Output : String (Data to be send on wire)
+                                 Authentication info on server and address of incoming connection,
+                                 function called with the response and True if the signature
+                                 may be computed on the key pool
+                    Output : None (Data to be send on wire is passed to callback)
                      Message format :
                         {messageType:"initiageSecret", sha256(g^ab mod p + g^bw mod p), g^b mod p}
 
         '''
-        response = [False, address]
-        pubKey = self.__diffiObj.gen_public_key()                                 # This is (gb mod p)
-        sharedSecret = self.__diffiObj.gen_shared_key(long(senderObj["pubKey"]))  # This is (gab mop p)
+        start = time.time()
+        diffi, pubKey = self.__takeKeyPair()                                  # This is (gb mod p)
+        self.__stats.record("dh.keypair", start)
+        start = time.time()
+        sharedSecret = diffi.gen_shared_key(long(senderObj["pubKey"]))        # This is (gab mop p)
         authInfo.setResponse()
         authInfo.setSharedSecret(str(sharedSecret)[0:16])
         userPassHash = self.__findPasswordHashForUser(senderObj["user"])
-        if userPassHash:
-            gpowbw = self.__diffiObj.gen_gpowxw(pubKey, userPassHash)
-            hash256 = self.__genShaX(hashlib.sha256(),str(gpowbw) + str(sharedSecret))
-            hash384 = self.__genShaX(hashlib.sha384(),str(gpowbw) + str(sharedSecret))
-            signedHash = self.__signMessage(str(hash256))
-            authInfo.setSha348(hash384)
-            response =  [pickle.dumps({
-                "messageType"   : "initiateSecret",
+        if not userPassHash:
+            callback([False, address])
+            return
+        gpowbw = diffi.gen_gpowxw(pubKey, userPassHash)
+        self.__stats.record("dh.shared", start)
+        hash256 = self.__genShaX(hashlib.sha256(),str(gpowbw) + str(sharedSecret))
+        hash384 = self.__genShaX(hashlib.sha384(),str(gpowbw) + str(sharedSecret))
+        authInfo.setSha348(hash384)
+
+        def onSigned(signedHash):
+            if signedHash is None:
+                callback([False, address])
+                return
+            with self.__stateLock:
+                self.__store.setAuth(senderObj["user"], authInfo)
+            self.__timers.schedule(("auth", senderObj["user"]), self.__authTimeout)
+            callback([wire.encode("initiateSecret", {
                 "hash"          : hash256,
                 "pubKey"        : pubKey,
                 "verifyServer"  : signedHash
-            }), address]
-        return response
+            }), address])
+        if not self.__privateKeyOperation("sign", str(hash256), onSigned, offload):
+            callback([False, address])
+
+    def __takeKeyPair(self):
+        '''
+            __takeKeyPair(None):
+                    Output  : [DiffieHellman,Number] -> Ephemeral key pair used by one handshake
+        '''
+        if self.__keyPairs is not None:
+            return self.__keyPairs.take()
+        diffi = DH.DiffieHellman()
+        return [diffi, diffi.gen_public_key()]
+
+    def getKeyPairStats(self):
+        '''
+            getKeyPairStats(None):
+                Output  : Dictionary (See keyPairPool.getStats), None without a pool
+        '''
+        if self.__keyPairs is None:
+            return None
+        return self.__keyPairs.getStats()
+
+    def getTimerInterval(self):
+        '''
+            getTimerInterval(None):
+                Output  : float (Seconds between two calls of expire by the server loop)
+        '''
+        return self.__timers.getTick()
+
+    def expire(self, now=None):
+        '''
+            expire(float):
+                Input   : Current time (time.time() if not given)
+                Output  : None
+                Purpose : Called by the server loop, drops handshakes that were not completed
+                            within authTimeout and sessions idle for sessionTimeout.
+                            Timers are not moved on every request, when one fires the time
+                            in the store is checked and the timer set again if the state
+                            was used in the meantime (possibly by another -procs worker)
+        '''
+        if now is None:
+            now = time.time()
+        for kind, user in self.__timers.advance(now):
+            if kind == "stats":
+                self.dumpStats()
+                self.__timers.schedule(("stats", None), self.__statsInterval)
+                continue
+            with self.__stateLock:
+                if kind == "auth":
+                    self.__expireAuth(user, now)
+                else:
+                    self.__expireSession(user, now)
+
+    def __expireAuth(self, user, now):
+        authInfo = self.__store.getAuth(user)
+        if authInfo is None:
+            return
+        age = now - authInfo.getCreated()
+        if age < self.__authTimeout:
+            self.__timers.schedule(("auth", user), self.__authTimeout - age)
+            return
+        self.__store.removeAuth(user)
+
+    def __expireSession(self, user, now):
+        lastSeen = self.__store.getLastSeen(user)
+        if lastSeen is None:
+            return
+        idle = now - lastSeen
+        if idle < self.__sessionTimeout:
+            self.__timers.schedule(("session", user), self.__sessionTimeout - idle)
+            return
+        session = self.__store.getSession(user)
+        self.__store.removeSession(user)
+        self.__answers.pop(user, None)
+        if session is not None:
+            self.__ciphers.pop(session[0], None)
+        print "\nSession of user " + user + " expired\n"
+
+    def __addGauges(self):
+        '''
+            __addGauges(None):
+                Purpose : Register the state of the pools and caches with the stats
+        '''
+        self.__stats.addGauge("puzzle", self.getPuzzleStats)
+        self.__stats.addGauge("keyPairs", self.getKeyPairStats)
+        self.__stats.addGauge("credentials", self.getCredentialStats)
+        self.__stats.addGauge("mail", self.__mail.getStats)
+        self.__stats.addGauge("sessions", self.__store.getStats)
+        self.__stats.addGauge("state", lambda: {
+            "timers"    : len(self.__timers),
+            "ciphers"   : len(self.__ciphers),
+            "answers"   : len(self.__answers),
+        })
+        if self.__keyPool is not None:
+            self.__stats.addGauge("keyPool", lambda: {
+                "pending"   : self.__keyPool.getPending(),
+                "refused"   : self.__keyPool.getRefused(),
+            })
+
+    def dumpStats(self):
+        '''
+            dumpStats(None):
+                Output  : Boolean (False if the stats file could not be written)
+                Purpose : Write latency histograms, counters and gauges (see stats.py)
+        '''
+        return self.__stats.dump()
+
+    def setHandshakeBacklog(self, backlog):
+        '''
+            setHandshakeBacklog(Number):
+                Input   : Handshakes queued by the server loop and not answered yet
+                Purpose : Load input of the puzzle difficulty
+        '''
+        self.__puzzle.setBacklog(backlog)
+
+    def getPuzzleStats(self):
+        '''
+            getPuzzleStats(None):
+                Output  : Dictionary (See puzzleDifficulty.getStats)
+        '''
+        return self.__puzzle.getStats()
 
     def __genShaX(self, sha, message):
         '''
@@ -154,8 +360,10 @@ class Connection:
         '''
             __decryptMessageUsingPrivateKey(String):
                     Input   : The string to be decrypted
-                    Output  : String (The decrypted String)
-                    Purpose : Decrypt data encrypted with server public key
+                    Output  : String -> The decrypted String
+                              None   -> If the message could not be decrypted
+                    Purpose : Decrypt data encrypted with server public key (same as
+                                keyPool._decrypt, a bad packet must not stop the server)
 
         '''
         try:
@@ -165,31 +373,56 @@ class Connection:
                     mgf=padding.MGF1(algorithm=hashes.SHA256()),
                     algorithm=hashes.SHA256(),
                     label=None))
-        except Exception as e:
-            print "Unable to perform asymmetric decryption", e
-            sys.exit(0)
-        return zlib.decompress(plainText)
+            return zlib.decompress(plainText)
+        except Exception:
+            return None
 
     def __signMessage(self, message):
         '''
             signMessage(String) :
                 Input   : The String to be signed
-                Output  : String (The signed String)
-                Purpose : To signed message
-        '''
-        signer =  self.__privateKey.signer(
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH),
-            hashes.SHA256())
+                Output  : String -> The signed String
+                          None   -> If the message could not be signed
+                Purpose : To signed message (same as keyPool._sign)
+        '''
         try:
+            signer =  self.__privateKey.signer(
+                padding.PSS(
+                    mgf=padding.MGF1(hashes.SHA256()),
+                    salt_length=padding.PSS.MAX_LENGTH),
+                hashes.SHA256())
             signer.update(message)
-            signature = signer.finalize()
-        except:
-            print "Unable to sign file"
-            sys.exit(0)
-        return signature
+            return signer.finalize()
+        except Exception:
+            return None
+
 
+    def __privateKeyOperation(self, operation, message, callback, offload):
+        '''
+            __privateKeyOperation(String,String,function,Boolean):
+                    Input   : "decrypt" or "sign", the message, function called with the
+                                result and True if the operation may run on the key pool
+                    Output  : Boolean (False if the key pool is full and refused the operation)
+                    Purpose : Run a private key operation inline or hand it to the key pool
+        '''
+        if operation == "decrypt":
+            self.__puzzle.recordDecrypt()
+        start = time.time()
+        def timed(result):
+            self.__stats.record("rsa." + operation, start)
+            if result is None:
+                self.__stats.count("drop.rsa." + operation)
+            callback(result)
+        if offload and self.__keyPool is not None:
+            if self.__keyPool.submit(operation, message, timed):
+                return True
+            self.__stats.count("drop.keyPoolFull")
+            return False
+        if operation == "decrypt":
+            timed(self.__decryptMessageUsingPrivateKey(message))
+        else:
+            timed(self.__signMessage(message))
+        return True
 
     def __logErrors(self, errTime, address):
         '''
@@ -223,18 +456,19 @@ class Connection:
             Output  :   None
             Purpose :   Remove user connection
         '''
-        userDetails = self.__sessionKeyDict[user]
+        userDetails = self.__store.getSession(user)
         print "Kicking out user " + user + " on ",userDetails[1]
-        iv = os.urandom(16)
-        message = self.__encryptSymetric(
-            user,
-             pickle.dumps(
-                 { "message" : "disconnect",
-                   "Nonce": str(int(binascii.hexlify(os.urandom(8)), base=16))
-                }),iv)
-        self.__connectedClients.pop(self.__sessionKeyDict[user][1])
-        self.__sessionKeyDict.pop(user)
-        return [pickle.dumps({
+        self.__timers.cancel(("session", user))
+        seq = self.__store.nextSequence(user)
+        iv, message = self.__encryptSymetric(
+            user, seq,
+             wire.encode("disconnect",
+                 { "Seq": seq
+                }))
+        self.__store.removeSession(user)
+        self.__answers.pop(user, None)
+        self.__ciphers.pop(userDetails[0], None)
+        return [wire.encode("sym", {
             "message": message,
             "IV": iv
         }), userDetails[1]]
@@ -249,12 +483,15 @@ class Connection:
                             use
         '''
         response = [True, address]
-        if senderObj["user"] in self.__sessionKeyDict:
+        if self.__store.getSession(senderObj["user"]) is not None:
             response = self.__disconnectUser(senderObj["user"])
-        self.__sessionKeyDict[senderObj["user"]] = [
-            self.__authDict[senderObj["user"]].getSharedSecret(),
-            address]
-        self.__authDict.pop(senderObj["user"])
+        self.__store.setSession(
+            senderObj["user"],
+            self.__store.getAuth(senderObj["user"]).getSharedSecret(),
+            address)
+        self.__store.removeAuth(senderObj["user"])
+        self.__timers.cancel(("auth", senderObj["user"]))
+        self.__timers.schedule(("session", senderObj["user"]), self.__sessionTimeout)
         return response
 
     def __completeAuth(self, senderObj, address):
@@ -267,136 +504,567 @@ class Connection:
                             use also kick out other users connected with same credentials
         '''
         response = [True, address]
-        if senderObj["user"] in self.__authDict:
-            if senderObj["hash"] == self.__authDict[senderObj["user"]].getSha384():
+        authInfo = self.__store.getAuth(senderObj["user"])
+        if authInfo is not None:
+            if senderObj["hash"] == authInfo.getSha384():
                 print "User " + senderObj["user"] + " Connected on " + str(address)
-                response = self.__addUserToAuthDict(senderObj, address)
-                self.__connectedClients[address] = senderObj["user"]
+                response = self.__withMail(self.__withTicket(self.__addUserToAuthDict(senderObj, address),
+                                                             senderObj["user"], address),
+                                           senderObj["user"], address)
             else :
-                self.__authDict.pop(senderObj["user"])
+                self.__store.removeAuth(senderObj["user"])
+                self.__timers.cancel(("auth", senderObj["user"]))
         return response
 
-    def __loadPickledData(self, message):
+    def __sealTicket(self, user):
         '''
-            __loadPickledData(String):
-                Input   : String (Stream data from socket)
-                Output  : Object
-                Purpose : Convert the stream data to object
+            __sealTicket(String) :
+                Input   : A user that just logged in
+                Output  : [String,String] -> Nonce and resume-ticket encrypted with the key of
+                                             the new session
         '''
-        try:
-            return pickle.loads(message)
-        except Exception as e:
-            print "Error while trying to unpickle data ",e
+        seq = self.__store.nextSequence(user)
+        return self.__encryptSymetric(user, seq, wire.encode("resume-ticket", {
+            "Seq"       : seq,
+            "ticket"    : self.__tickets.issue(user, self.__store.getSession(user)[0]),
+            "lifetime"  : self.__tickets.getLifetime(),
+        }))
+
+    def __withTicket(self, response, user, address):
+        '''
+            __withTicket(List,String,tuple) :
+                Input   : Response to a login (True or the disconnect of the previous session
+                            of the user), the user and its address
+                Output  : The response followed by a resumption ticket, the response unchanged
+                            if tickets are disabled
+        '''
+        if self.__tickets is None:
+            return response
+        iv, message = self.__sealTicket(user)
+        ticket = [wire.encode("sym", {"message": message, "IV": iv}), address]
+        if response[0] is True:
+            return ticket
+        return [[response, ticket], None]
+
+    def __withMail(self, response, user, address):
+        '''
+            __withMail(List,String,tuple) :
+                Input   : Response to a login, the user and its address
+                Output  : The response followed by the first mailbag of the user, the response
+                            unchanged if no mail waits for it
+        '''
+        bag = self.__mailbag(user, address, 0)
+        if bag is None:
+            return response
+        if response[0] is True:
+            return bag
+        if response[1] is None:
+            return [response[0] + [bag], None]
+        return [[response, bag], None]
+
+    def __resume(self, packet, address):
+        '''
+            __resume(Object,tuple) :
+                Input   : A resume packet and the address it came from
+                Output  : The resumed answer (with the next ticket, encrypted with the new
+                            session key), preceded by the disconnect of the previous session
+                            of the user if there is one
+                Purpose : Log a user in again with a ticket, no public key operation and no
+                            puzzle (see resumption.py)
+        '''
+        start = time.time()
+        user = packet["user"]
+        refused = [wire.encode("resumed", {"user": user, "nonce": "", "IV": "", "message": ""}), address]
+        opened = self.__tickets.open(packet["ticket"]) if self.__tickets is not None else None
+        if opened is None or opened[0] != user or len(packet["nonce"]) != NONCE_SIZE or \
+                not hmac.compare_digest(resumeProof(opened[1], user, packet["ticket"], packet["nonce"]),
+                                        packet["proof"]):
+            self.__stats.count("drop.resume")
+            return refused
+        if not self.__findPasswordHashForUser(user) or not self.__store.useTicket(opened[2], opened[3]):
+            self.__stats.count("drop.resumeReplay")
+            return refused
+        serverNonce = os.urandom(NONCE_SIZE)
+        response = [True, address]
+        if self.__store.getSession(user) is not None:
+            response = self.__disconnectUser(user)
+        self.__store.setSession(user, resumedKey(opened[1], packet["nonce"], serverNonce), address)
+        self.__store.removeAuth(user)
+        self.__timers.cancel(("auth", user))
+        self.__timers.schedule(("session", user), self.__sessionTimeout)
+        print "User " + user + " Resumed on " + str(address)
+        iv, message = self.__sealTicket(user)
+        resumed = [wire.encode("resumed", {"user": user, "nonce": serverNonce, "IV": iv,
+                                           "message": message}), address]
+        self.__stats.record("msg.resume", start)
+        if response[0] is True:
+            return self.__withMail(resumed, user, address)
+        return self.__withMail([[response, resumed], None], user, address)
+
+    def __loadPacket(self, message):
+        '''
+            __loadPacket(String):
+                Input   : String (Stream data from socket or a decrypted payload)
+                Output  : Object -> {"type" : packet type, fields ...}
+                          False  -> If the data is not a valid packet
+                Purpose : Convert the stream data to object (see wire.py)
+        '''
+        start = time.time()
+        packet = wire.decode(message)
+        self.__stats.record("wire.decode", start)
+        if packet is None:
+            self.__stats.count("drop.malformed")
             return False
+        return packet
 
-    def __parseStreamData(self, senderObj):
+    def __parseStreamData(self, decryptedResponse, address, callback, offload, start):
         '''
-            __parseStreamData(Object):
-                Input   : Objectified string received on socket
-                Output  : Object (The objectified message after decryption)
-                Purpose : Given the data sent by the client on the wire
-                            the data is un pickled, decrypted and converted
-                             into object for further use
+            __parseStreamData(String,tuple,function,Boolean,float):
+                Input   : The message after decryption with the private key, the address,
+                            function called with the response, True if private key
+                            operations may run on the key pool and the time the packet
+                            was received (for the latency of the message type)
+                Output  : None
+                Purpose : Convert the decrypted data into object and generate the appropriate
+                            response based on the message type
         '''
-        decryptedResponse = self.__decryptMessageUsingPrivateKey(senderObj["message"])
-        decryptedResponse = self.__loadPickledData(decryptedResponse)
-        return decryptedResponse
+        response = [False, False]
+        messageType = None
+        if decryptedResponse is not None:
+            decryptedMessage = self.__loadPacket(decryptedResponse)
+            if decryptedMessage:
+                messageType = decryptedMessage["type"]
+        if messageType is not None:
+            callback = self.__timedResponse("msg." + messageType, start, callback)
+        if messageType == "now-online":
+            response = self.__nowOnlineResponse(decryptedMessage,address)
+        elif messageType == "quiz-response":
+            return self.__challangeResponse(decryptedMessage, address, callback, offload)
+        elif messageType == "complete":
+            with self.__stateLock:
+                response = self.__completeAuth(decryptedMessage,address)
+        callback(response)
 
-    def __newConnection(self, senderObj, address):
+    def __newConnection(self, senderObj, address, callback, offload):
         '''
-            newConnection(Object,tuple) :
-                Input   : Objectified data from sock and address
-                Output  : String (data to be sent to server)
+            newConnection(Object,tuple,function,Boolean) :
+                Input   : Objectified data from sock and address, function called with the
+                            response and True if private key operations may run on the key pool
+                Output  : None (data to be sent to server is passed to callback)
                 Purpose : Parses the incoming message and  generate appropriate response
                             to send to client. Used to establish new connection with client
         '''
-        response = [False, False]
-        decryptedMessage = self.__parseStreamData(senderObj)
-        if decryptedMessage["messageType"] == "now-online":
-            response = self.__nowOnlineResponse(decryptedMessage,address)
-        elif decryptedMessage["messageType"] == "quiz-response":
-            response = self.__challangeResponse(decryptedMessage,address)
-        elif decryptedMessage["messageType"] == "complete":
-            response = self.__completeAuth(decryptedMessage,address)
-        return response
+        start = time.time()
+        def onDecrypted(decryptedResponse):
+            self.__parseStreamData(decryptedResponse, address, callback, offload, start)
+        if not self.__privateKeyOperation("decrypt", senderObj["message"], onDecrypted, offload):
+            callback([False, False])
 
-    def __listUsers(self, senderObj,address):
+    def __timedResponse(self, name, start, callback):
         '''
-            __listUsers(None):
-                Input   : None
-                Output  : Array string of list of all users connected to
-                        server
+            __timedResponse(String,float,function):
+                Input   : Name of the histogram, time the packet was received and the callback
+                Output  : function (callback that first records the latency)
+        '''
+        def timed(response):
+            self.__stats.record(name, start)
+            callback(response)
+        return timed
+
+    def __sessionResponse(self, user, request, address, packetType, fields):
+        '''
+            __sessionResponse(String,Number,tuple,String,Dictionary):
+                Input   : The connected user (found from the address, never from the
+                            request), the Seq of the request answered, the users address,
+                            type and fields (without Seq and request) of the response
+                Output  : [String,tuple] -> The sym packet and whom it is to be sent to
+                          [False,tuple]  -> If the user is no longer connected (its session
+                                            expired or was replaced meanwhile)
+        '''
+        seq = self.__store.nextSequence(user)
+        if seq is None:
+            self.__stats.count("drop.noSession")
+            return [False, address]
+        fields["Seq"] = seq
+        fields["request"] = request
+        iv, message = self.__encryptSymetric(user, seq, wire.encode(packetType, fields))
+        return [wire.encode("sym", {
+                "message": message,
+                "IV":iv
+            }), address]
+
+    def __fitUsers(self, users):
+        '''
+            __fitUsers(List):
+                Input   : List of user names
+                Output  : List (The first users whose names fit in PRESENCE_BUDGET, at least one)
+        '''
+        size = 0
+        for index, user in enumerate(users):
+            size += 2 + len(user)
+            if size > PRESENCE_BUDGET and index > 0:
+                return users[:index]
+        return users
+
+    def __listUsers(self, senderObj, user, address):
+        '''
+            __listUsers(Object,String,tuple):
+                Input   : list request, the user connected from the address and the address
+                Output  : Array string of list of users connected to server, as many
+                        as fit in one datagram (list-page / list-changes give the rest)
                 Purpose : To send response to users list request
         '''
-        response = [False, address]
+        users = self.__fitUsers(self.__store.presencePage("", PRESENCE_PAGE))
+        return self.__sessionResponse(user, senderObj["message"]["Seq"], address, "users", {"users": users})
+
+    def __listPage(self, senderObj, user, address):
+        '''
+            __listPage(Object,String,tuple):
+                Input   : list-page request (users after a name), the user and its address
+                Output  : [String,tuple] -> users-page {version, next, users}, next is the name
+                            to ask the following page with ("" after the last page). version
+                            is read before the page, list-changes from it covers the changes
+                            made while the client was paging
+        '''
         message = senderObj["message"]
-        if message["Nonce"] not in self.__userNonceHistor :
-            self.__userNonceHistor[message["Nonce"]] = True
-            iv = os.urandom(16)
-            message = self.__encryptSymetric( message["user"],
-                pickle.dumps({"users":self.__sessionKeyDict.keys(),"Nonce":int(message["Nonce"])+1}),iv
-            )
-            response =[pickle.dumps({
-                    "message": message,
-                    "IV":iv
-                }), address]
-        return response
+        version = self.__store.presenceVersion()
+        fetched = self.__store.presencePage(message["after"], PRESENCE_PAGE)
+        users = self.__fitUsers(fetched)
+        next = ""
+        if users and (len(users) < len(fetched) or len(fetched) == PRESENCE_PAGE):
+            next = users[-1]
+        return self.__sessionResponse(user, message["Seq"], address, "users-page", {
+            "version"   : version,
+            "next"      : next,
+            "users"     : users,
+        })
 
-    def __encryptSymetric(self, user, message, iv):
+    def __listChanges(self, senderObj, user, address):
         '''
-            __encryptSymetric(Object,String,String):
-                    Input  : String, String, String (The the users key info, message to be encrypted and the IV)
-                    Output : Encrypted message with session key
-                    Purpose : Encrypt message with session keys of client and server(Ksx)
+            __listChanges(Object,String,tuple):
+                Input   : list-changes request (version of the clients mirror), the user and
+                            its address
+                Output  : [String,tuple] -> presence {version, reset, more, joined, left}
+                Purpose : Logins and logouts after the clients version, folded per user so
+                            the answer costs O(changes) and fits in a datagram. more is set
+                            when the client should ask again from version, reset when the
+                            changes are not remembered and the client must page again
         '''
+        message = senderObj["message"]
+        since = message["since"]
+        changes = self.__store.presenceChanges(since, PRESENCE_CHANGES + 1)
+        if changes is None:
+            return self.__sessionResponse(user, message["Seq"], address, "presence", {
+                "version"   : self.__store.presenceVersion(),
+                "reset"     : 1,
+                "more"      : 0,
+                "joined"    : [],
+                "left"      : [],
+            })
+        more = len(changes) > PRESENCE_CHANGES
+        version = since
+        online = {}                             # user : online after the last change sent
+        size = 0
+        for changeVersion, changed, isOnline in changes[:PRESENCE_CHANGES]:
+            if changed not in online:
+                if size + 2 + len(changed) > PRESENCE_BUDGET:
+                    more = True
+                    break
+                size += 2 + len(changed)
+            online[changed] = isOnline
+            version = changeVersion
+        return self.__sessionResponse(user, message["Seq"], address, "presence", {
+            "version"   : version,
+            "reset"     : 0,
+            "more"      : 1 if more else 0,
+            "joined"    : [changed for changed, isOnline in online.items() if isOnline],
+            "left"      : [changed for changed, isOnline in online.items() if not isOnline],
+        })
 
-        s = symetric(self.__sessionKeyDict[user][0])
-        encryptor = s.getEncryptor(iv)
-        return s.encryptMessage(message, encryptor)
+    def __rememberAnswer(self, user, seq, answer):
+        '''
+            __rememberAnswer(String,Number,String):
+                Input   : The user, Seq of its request and the sym packet answering it
+                Purpose : Keep the last ANSWERS_KEPT answers of a user so a request sent
+                            again (the client did not get the answer before its
+                            retransmission timeout) is answered without running it twice
+        '''
+        answers = self.__answers.get(user)
+        if answers is None:
+            answers = collections.deque(maxlen=ANSWERS_KEPT)
+            self.__answers[user] = answers
+        answers.append([seq, answer])
+
+    def __findAnswer(self, user, seq):
+        '''
+            __findAnswer(String,Number):
+                Input   : The user and Seq of a request already seen
+                Output  : String -> The answer sent to it
+                          None   -> If the request had no answer or it is no longer kept
+        '''
+        for answerSeq, answer in self.__answers.get(user, ()):
+            if answerSeq == seq:
+                return answer
+        return None
+
+    def __roomKey(self, user, address, room, request):
+        '''
+            __roomKey(String,tuple,String,Number):
+                Input   : A member, its address, the room and the Seq of the request answered
+                            (0 when the key is pushed because it changed)
+                Output  : [String,tuple] -> room-key {epoch, sender, Key, members} for the member
+        '''
+        epoch, key, members = self.__store.getRoom(room)
+        return self.__sessionResponse(user, request, address, "room-key", {
+            "room"      : room,
+            "epoch"     : epoch,
+            "sender"    : self.__store.roomMember(room, user),
+            "Key"       : key,
+            "members"   : members,
+        })
+
+    def __pushRoomKeys(self, room, members):
+        '''
+            __pushRoomKeys(String,List):
+                Input   : A room whose key changed and its members
+                Output  : List of [String,tuple] (The new key for every connected member)
+        '''
+        pushes = []
+        for member in members:
+            session = self.__store.getSession(member)
+            if session is not None:
+                push = self.__roomKey(member, session[1], room, 0)
+                if push[0]:
+                    pushes.append(push)
+        return pushes
+
+    def __roomJoin(self, senderObj, user, address):
+        '''
+            __roomJoin(Object,String,tuple):
+                Input   : room-join request, the user connected from the address and the address
+                Output  : [String,tuple] -> room-key, the key of the room (created if needed)
+                                            and the sender number of the user
+                                            room-left if the room is full
+                Purpose : Also answers members that saw a post of an epoch they have no key for.
+                            The user named in the request must be the one connected from
+                            its address, as for room-post
+        '''
+        message = senderObj["message"]
+        if user != message["user"]:
+            self.__stats.count("drop.roomJoin")
+            return [False, address]
+        if not message["room"] or \
+                self.__store.joinRoom(message["room"], user, MAX_ROOM_MEMBERS) is None:
+            return self.__sessionResponse(user, message["Seq"], address, "room-left",
+                                          {"room": message["room"]})
+        return self.__roomKey(user, address, message["room"], message["Seq"])
+
+    def __roomLeave(self, senderObj, user, address):
+        '''
+            __roomLeave(Object,String,tuple):
+                Input   : room-leave request, the user connected from the address and the address
+                Output  : [String,tuple] -> room-left
+                          [List,None]    -> room-left and the new key of the room for the
+                                            members left
+        '''
+        message = senderObj["message"]
+        if user != message["user"]:
+            self.__stats.count("drop.roomLeave")
+            return [False, address]
+        members = self.__store.leaveRoom(message["room"], user)
+        answer = self.__sessionResponse(user, message["Seq"], address, "room-left",
+                                        {"room": message["room"]})
+        if not members or not answer[0]:
+            return answer
+        return [[answer] + self.__pushRoomKeys(message["room"], members), None]
+
+    def __roomPost(self, packet, address):
+        '''
+            __roomPost(Object,tuple):
+                Input   : room-post packet and the address it came from
+                Output  : [String,List] -> The post, unchanged, and the addresses of the other
+                                           members
+                          [String,tuple] -> room-key for the sender if the post was encrypted
+                                            with a key that is no longer the room key
+                Purpose : Fan out a message encrypted once with the room key, it is never
+                            decrypted here. The user named in the post must be the one
+                            connected from its address and a member of the room
+        '''
+        start = time.time()
+        user = self.__findUserFromAddress(address)
+        if user is False or user != packet["user"] or \
+                self.__store.roomMember(packet["room"], user) is None:
+            self.__stats.count("drop.roomPost")
+            return [False, False]
+        room = self.__store.getRoom(packet["room"])
+        if packet["epoch"] != room[0]:
+            self.__stats.count("room.stale")
+            return self.__roomKey(user, address, packet["room"], 0)
+        addresses = self.__store.roomAddresses(packet["room"], user)
+        self.__stats.record("msg.room-post", start)
+        if not addresses:
+            return [False, False]
+        del packet["type"]
+        return [wire.encode("room-post", packet), addresses]
+
+    def __mailbag(self, user, address, request):
+        '''
+            __mailbag(String,tuple,Number):
+                Input   : A connected user, its address and the Seq of the request answered
+                            (0 when the mail is pushed, at login or when mail arrives)
+                Output  : [String,tuple] -> mailbag with the oldest mail waiting for the user,
+                                            up to MAILBAG_BUDGET bytes
+                          None           -> If nothing waits and the mailbag is pushed
+                Purpose : Every mail-item carries the key of its mail, derived again from the
+                            sender and the id the sender was given (see mailLog.mailKey)
+        '''
+        mails = self.__mail.pending(user, MAILBAG_BUDGET)
+        if not mails and request == 0:
+            return None
+        items = [wire.encode("mail-item", {
+                    "user"      : sender,
+                    "mailNo"    : mailNo,
+                    "keyId"     : keyId,
+                    "Key"       : self.__mail.mailKey(sender, user, keyId),
+                    "IV"        : iv,
+                    "data"      : data,
+                }) for mailNo, sender, keyId, iv, data in mails]
+        bag = self.__sessionResponse(user, request, address, "mailbag", {"mails": items})
+        if not bag[0] and request == 0:
+            return None
+        return bag
+
+    def __storeMail(self, senderObj, user, address):
+        '''
+            __storeMail(Object,String,tuple):
+                Input   : mail request, the sender connected from the address and the address
+                Output  : [String,tuple] -> mail-stored, stored is 0 if the recipient does not
+                                            exist, the mail is too long or the mailbox is full
+                          [List,None]    -> mail-stored and a mailbag for the recipient if it
+                                            logged in meanwhile
+                Purpose : The sender kept with the mail (and its mail key) is the user
+                            connected from the address, never the name in the request
+        '''
+        message = senderObj["message"]
+        if user != message["user"]:
+            self.__stats.count("drop.mailUser")
+            return [False, address]
+        recipient = message["recipient"]
+        mailNo = None
+        if len(message["data"]) <= MAX_MAIL_SIZE and self.__findPasswordHashForUser(recipient):
+            mailNo = self.__mail.append(recipient, user, message["keyId"], message["IV"], message["data"])
+        if mailNo is None:
+            self.__stats.count("drop.mail")
+        answer = self.__sessionResponse(user, message["Seq"], address, "mail-stored",
+                                        {"stored": int(mailNo is not None)})
+        session = self.__store.getSession(recipient)
+        if mailNo is None or session is None or not answer[0]:
+            return answer
+        bag = self.__mailbag(recipient, session[1], 0)
+        if bag is None:
+            return answer
+        return [[answer, bag], None]
+
+    def __mailAck(self, senderObj, user, address):
+        '''
+            __mailAck(Object,String,tuple):
+                Input   : mail-ack request (the last mailNo the user received), the user
+                            connected from the address and the address
+                Output  : [String,tuple] -> The next mailbag, with no mail once all was delivered
+                Purpose : Only the mailbox of the user connected from the address is
+                            acknowledged
+        '''
+        message = senderObj["message"]
+        if user != message["user"]:
+            self.__stats.count("drop.mailUser")
+            return [False, address]
+        self.__mail.acknowledge(user, message["mailNo"])
+        return self.__mailbag(user, address, message["Seq"])
+
+    def __sessionCipher(self, key):
+        '''
+            __sessionCipher(String):
+                    Input  : The session key of a user
+                    Output : Object (symetric built once per session key)
+        '''
+        cipher = self.__ciphers.get(key)
+        if cipher is None:
+            if len(self.__ciphers) >= MAX_CACHED_CIPHERS:
+                self.__ciphers.clear()
+            cipher = symetric(key, SERVER_TO_CLIENT, CLIENT_TO_SERVER)
+            self.__ciphers[key] = cipher
+        return cipher
+
+    def __encryptSymetric(self, user, seq, message):
+        '''
+            __encryptSymetric(String,Number,String):
+                    Input  : String, Number, String (The user, sequence number of the message
+                                and message to be encrypted)
+                    Output : [String,String] -> The nonce and the message encrypted with session key
+                    Purpose : Encrypt message with session keys of client and server(Ksx)
+        '''
+        start = time.time()
+        encrypted = self.__sessionCipher(self.__store.getSession(user)[0]).encrypt(seq, message)
+        self.__stats.record("aes.encrypt", start)
+        return encrypted
 
 
-    def __genKeyPair(self, senderObj, address):
+    def __genKeyPair(self, senderObj, user, address):
         '''
-            __genKeyPair(Object, tuple):
-                Input   : The objectified string received on socket and the address
-                            of the incoming connection
+            __genKeyPair(Object,String,tuple):
+                Input   : The objectified string received on socket, the user connected
+                            from the address and the address of the incoming connection
                 Output  : [String,tuple] -> The message to be sent and the address
-                            to whom its to be sent
+                            to whom its to be sent (mailbox if the destination is offline)
                 Purpose : Generate a session key for two hosts to communicate
         '''
         encMessage = senderObj["message"]
-        if encMessage["userDestination"] in self.__sessionKeyDict \
-                and encMessage["user"] in self.__sessionKeyDict:
-
-            if encMessage["Nonce"] in self.__userNonceHistor:
-                return [False, address]
-            iv = os.urandom(16)
+        sourceSession = self.__store.getSession(user)
+        destinationSession = self.__store.getSession(encMessage["userDestination"])
+        if destinationSession is not None and sourceSession is not None:
             key = os.urandom(16)
-            ivin = os.urandom(16)
 
             # Generate Token for B
-            token = self.__encryptSymetric(
-                encMessage["userDestination"], pickle.dumps({
+            seq = self.__store.nextSequence(encMessage["userDestination"])
+            if seq is None:
+                return [False, address]
+            ivin, token = self.__encryptSymetric(
+                encMessage["userDestination"], seq, wire.encode("talkto", {
                     "Key"       : key,
-                    "Nonce"     : str(int(binascii.hexlify(os.urandom(8)), base=16)),
-                    "message"   : "talkto",
-                    "user"   : [encMessage["user"], self.__sessionKeyDict[encMessage["user"]][1]]
-                }),
-                ivin)
+                    "Seq"       : seq,
+                    "user"      : user,
+                    "address"   : sourceSession[1]
+                }))
             # Encrypt Ticket and key to send to sender
-            encMessage = self.__encryptSymetric(encMessage["user"],
-                                    pickle.dumps({
+            seq = self.__store.nextSequence(user)
+            if seq is None:
+                return [False, address]
+            iv, encMessage = self.__encryptSymetric(user, seq,
+                                    wire.encode("ticket", {
                                         "Key"       : key,
-                                        "Nonce"     : str(int(binascii.hexlify(os.urandom(8)), base=16)),
+                                        "Seq"       : seq,
+                                        "request"   : encMessage["Seq"],
                                         "ticket"    : token,
                                         "IV"        :ivin,
-                                        "address"   : self.__sessionKeyDict[encMessage["userDestination"]][1]
-                                    }), iv)
+                                        "address"   : destinationSession[1]
+                                    }))
 
-            return [ pickle.dumps({
+            return [ wire.encode("sym", {
                 "message": encMessage,
                 "IV": iv
             }), address]
+        elif sourceSession is not None:
+            # The destination is offline: give the sender a key to leave it mail, or an
+            # empty one if there is no such user
+            keyId, key = 0, ""
+            if self.__findPasswordHashForUser(encMessage["userDestination"]):
+                keyId = struct.unpack("!Q", os.urandom(8))[0]
+                key = self.__mail.mailKey(user, encMessage["userDestination"], keyId)
+            return self.__sessionResponse(user, encMessage["Seq"], address, "mailbox", {
+                "user"      : encMessage["userDestination"],
+                "keyId"     : keyId,
+                "Key"       : key,
+            })
         else:
             return [False, address]
 
@@ -404,16 +1072,25 @@ class Connection:
         '''
             __userLogout(Object,tuple)
                 Input       : Objectified string from user, address from where connection was received
-                Output      : Boolean
-                Purpose     : Safely remove a user from the __sessionKeyDict object
+                Output      : Boolean, or [List,None] -> The new keys of the rooms the user left
+                Purpose     : Safely remove a user from the session store
         '''
-        message = senderObj["message"]
-        if message["Nonce"] not in self.__userNonceHistor:
-            if address in self.__connectedClients:
-                self.__sessionKeyDict.pop(message["user"])
-                self.__userNonceHistor[message["Nonce"]] = True
-                self.__connectedClients.pop(address)
-                print "\nUser " + message["user"] + " Just left\n"
+        user = self.__store.findUserFromAddress(address)
+        if user is not False:
+            pushes = []
+            for room in self.__store.userRooms(user):
+                members = self.__store.leaveRoom(room, user)
+                if members:
+                    pushes.extend(self.__pushRoomKeys(room, members))
+            session = self.__store.getSession(user)
+            self.__store.removeSession(user)
+            self.__answers.pop(user, None)
+            self.__timers.cancel(("session", user))
+            if session is not None:
+                self.__ciphers.pop(session[0], None)
+            print "\nUser " + user + " Just left\n"
+            if pushes:
+                return [pushes, None]
         return True, ""
 
     def __findUserFromAddress(self, address):
@@ -424,10 +1101,7 @@ class Connection:
                         String -> If user name is present
                         Boolean -> If username not present
         '''
-        if address in self.__connectedClients:
-            return self.__connectedClients[address]
-        else:
-            return False
+        return self.__store.findUserFromAddress(address)
     def __establishedConnection(self, senderObj, address):
         '''
              __establishedConnection(Object):
@@ -435,23 +1109,159 @@ class Connection:
                     Output  : The message to be sent to client
                     Purpose : Parse the input message from client and generate appropriate message
         '''
+        start = time.time()
         user = self.__findUserFromAddress(address)
         if user is False:
+            self.__stats.count("drop.unknownAddress")
+            return [False, False]
+        session = self.__store.getSession(user)
+        if session is None:
             return [False, False]
-        s = symetric(self.__sessionKeyDict[user][0])
-        decryptor = s.getDecryptor(senderObj["IV"])
-        senderObj["message"] = pickle.loads (
-            s.decrypt(senderObj["message"],decryptor)
-        )
-        if senderObj["message"]["request"] == "list":
-            return self.__listUsers(senderObj, address)
-        elif senderObj["message"]["request"] == "talk":
-            return self.__genKeyPair(senderObj, address)
-        elif senderObj["message"]["request"] == "logout":
-            return self.__userLogout(senderObj, address)
+        plainText = self.__sessionCipher(session[0]).decrypt(senderObj["IV"], senderObj["message"])
+        self.__stats.record("aes.decrypt", start)
+        if plainText is None:
+            self.__stats.count("drop.aead")
+            return [False, address]
+        senderObj["message"] = self.__loadPacket(plainText)
+        if not senderObj["message"]:
+            return [False, address]
+        seq = senderObj["message"]["Seq"]
+        if not self.__store.checkSequence(user, seq):
+            answer = self.__findAnswer(user, seq)
+            if answer is not None:
+                self.__stats.count("answer.resent")
+                return [answer, address]
+            self.__stats.count("drop.replay")
+            return [False, address]
+        messageType = senderObj["message"]["type"]
+        if messageType == "list":
+            response = self.__listUsers(senderObj, user, address)
+        elif messageType == "list-page":
+            response = self.__listPage(senderObj, user, address)
+        elif messageType == "list-changes":
+            response = self.__listChanges(senderObj, user, address)
+        elif messageType == "talk":
+            response = self.__genKeyPair(senderObj, user, address)
+        elif messageType == "logout":
+            response = self.__userLogout(senderObj, address)
+        elif messageType == "room-join":
+            response = self.__roomJoin(senderObj, user, address)
+        elif messageType == "room-leave":
+            response = self.__roomLeave(senderObj, user, address)
+        elif messageType == "mail":
+            response = self.__storeMail(senderObj, user, address)
+        elif messageType == "mail-ack":
+            response = self.__mailAck(senderObj, user, address)
+        else:
+            return [False, address]
+        if messageType != "logout" and response[0]:
+            # A response to several addresses starts with the answer to the request
+            answer = response[0][0][0] if isinstance(response[0], list) else response[0]
+            self.__rememberAnswer(user, seq, answer)
+        self.__stats.record("msg." + messageType, start)
+        return response
 
 
 
+    def loadData(self, data, address=None):
+        '''
+            loadData(String,tuple):
+                    Input   : String (Input from socket) and the address it came from
+                    Output  : Object -> The objectified packet
+                              False  -> If the packet could not be read (or is a fragment of
+                                        a packet not complete yet)
+                    Purpose : Convert the stream data so the server loop can decide
+                                where the packet should be handled, fragments are kept
+                                until the whole packet has arrived (see fragment.py)
+        '''
+        packet = self.__loadPacket(data)
+        if not packet or packet["type"] != "fragment" or address is None:
+            return packet
+        self.__reassembler.expire()
+        data = self.__reassembler.add(packet, address)
+        if data is None:
+            return False
+        packet = self.__loadPacket(data)
+        if packet and packet["type"] == "fragment":
+            return False
+        return packet
+
+    def isHandshake(self, packet):
+        '''
+            isHandshake(Object):
+                    Input   : Object (Packet returned by loadData)
+                    Output  : Boolean
+                    Purpose : True if the packet needs private key operations (ie. it is part
+                                of the authentication protocol) and should be handled off the
+                                server loop
+        '''
+        return packet["type"] == "asym"
+
+    def offloadsPrivateKey(self):
+        '''
+            offloadsPrivateKey(None):
+                    Output  : Boolean (True if parseObjectAsync runs private key operations
+                                on a key pool instead of the calling thread)
+        '''
+        return self.__keyPool is not None
+
+    def __parseObject(self, packet, address, callback, offload):
+        '''
+            __parseObject(Object,tuple,function,Boolean):
+                    Input   : Packet returned by loadData, incoming address, function called
+                                with the response and True if private key operations may
+                                run on the key pool
+                    Output  : None
+                    Purpose : Calls the appropriate method based on if the request is
+                                from a already authenticated client or if it is from
+                                a client requesting a new connection
+        '''
+        if packet["type"] == "sym":
+            with self.__stateLock:
+                response = self.__establishedConnection(packet,address)
+            callback(response)
+        elif packet["type"] == "room-post":
+            with self.__stateLock:
+                response = self.__roomPost(packet, address)
+            callback(response)
+        elif packet["type"] == "resume":
+            with self.__stateLock:
+                response = self.__resume(packet, address)
+            callback(response)
+        elif packet["type"] == "asym":
+            self.__newConnection(packet, address, callback, offload)
+        else :
+            callback([False, False])
+
+    def parseObjectAsync(self, packet, address, callback):
+        '''
+            parseObjectAsync(Object,tuple,function):
+                    Input   : Packet returned by loadData, incoming address and function called
+                                with [String,tuple] (the response and whom it is to be sent to)
+                    Output  : None
+                    Purpose : Same as parseObject but private key operations are submitted to
+                                the key pool, callback is then called from the pools thread.
+                                Handshakes refused by a full pool are answered with False
+        '''
+        self.__parseObject(packet, address, callback, True)
+
+    def parseObject(self, packet, address):
+        '''
+            parseObject(Object,tuple):
+                    Input   : Object,tuple (Packet returned by loadData and incoming address)
+                    Output  : [String,tuple] -> The response and whom it is to be sent to
+                              [String,List]  -> A room post and the members it is sent to
+                              [List,None]    -> Several [String,tuple] responses
+                    Purpose : Calls the appropriate method based on if the request is
+                                from a already authenticated client or if it is from
+                                a client requesting a new connection
+        '''
+        response = [[False, False]]
+        def done(result):
+            response[0] = result
+        self.__parseObject(packet, address, done, False)
+        return response[0]
+
     def parseData(self, data, address):
         '''
             _parseData(String,tuple):
@@ -461,8 +1271,7 @@ class Connection:
                                 from a already authenticated client or if it is from
                                 a client requesting a new connection
         '''
-        unPickledData = self.__loadPickledData(data)
-        if unPickledData["type"] == "sym":
-            return self.__establishedConnection(unPickledData,address)
-        else :
-            return self.__newConnection(unPickledData,address)
\ No newline at end of file
+        packet = self.loadData(data, address)
+        if not packet:
+            return [False, False]
+        return self.parseObject(packet, address)
\ No newline at end of file
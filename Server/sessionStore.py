@@ -0,0 +1,497 @@
+import os,sqlite3,pickle,threading,time
+from replayWindow import replayWindow
+from presence import presenceDirectory
+from sessionTable import sessionTable
+
+MAX_PRESENCE_LOG = 4096                     # Logins / logouts remembered for list-changes
+USED_TICKETS_PRUNE = 4096                   # Used resumption tickets kept before the expired ones are dropped
+ROOM_KEY_SIZE = 16
+
+class sessionStore:
+    '''
+        sessionStore : Type -> class
+        purpose : Holds the connection state of the server
+                    a) Authentication state of users in the middle of a handshake
+                    b) Session keys and address of authenticated users
+                    c) Sequence numbers of every session (anti replay)
+                    d) Time of the last accepted request of every session (idle expiry)
+                    e) Versioned directory of the connected users (see presence.py)
+                    f) Chat rooms: key, epoch (grows when the key changes) and the
+                        sender number of every member (the nonce direction it uses)
+                    g) Resumption tickets already used, until they expire
+        Note : State lives in the memory of a single server process, a) to d) in one
+                record per user (see sessionTable.py)
+    '''
+    def __init__(self):
+        self.__table            = sessionTable()    # Handshakes and sessions, by username and address
+        self.__presence         = presenceDirectory(MAX_PRESENCE_LOG)
+        self.__rooms            = {}            # room : [epoch, key, next sender number, {username : sender}]
+        self.__userRooms        = {}            # username : set of rooms
+        self.__usedTickets      = {}            # ticket id : time it expires
+
+    def getAuth(self, user):
+        return self.__table.getAuth(user)
+
+    def setAuth(self, user, authInfo):
+        self.__table.setAuth(user, authInfo)
+
+    def removeAuth(self, user):
+        self.__table.removeAuth(user)
+
+    def getSession(self, user):
+        '''
+            getSession(String):
+                Input   : The user name
+                Output  : [key,address] -> If the user is connected
+                          None          -> If the user is not connected
+        '''
+        return self.__table.getSession(user)
+
+    def setSession(self, user, key, address):
+        other = self.__table.findUser(address)
+        if other is not False and other != user:
+            self.removeSession(other)
+        if self.__table.setSession(user, key, address):
+            self.__presence.join(user)
+
+    def removeSession(self, user):
+        if self.__table.removeSession(user):
+            self.__presence.leave(user)
+        for room in list(self.__userRooms.get(user, ())):
+            self.leaveRoom(room, user)
+
+    def getStats(self):
+        '''
+            getStats(None):
+                Output  : Dictionary (Sessions, handshakes in progress and bytes per session)
+        '''
+        return self.__table.getStats()
+
+    def useTicket(self, ticketId, expires):
+        '''
+            useTicket(String,Number):
+                Input   : Id of a resumption ticket and the time it expires
+                Output  : Boolean (False if the ticket was already used)
+        '''
+        if ticketId in self.__usedTickets:
+            return False
+        if len(self.__usedTickets) >= USED_TICKETS_PRUNE:
+            now = time.time()
+            self.__usedTickets = dict((used, until) for used, until in self.__usedTickets.items()
+                                      if until > now)
+        self.__usedTickets[ticketId] = expires
+        return True
+
+    def findUserFromAddress(self, address):
+        '''
+            findUserFromAddress(tuple):
+                Input   : Address of incoming request
+                Output  : String -> If user name is present
+                          False  -> If username not present
+        '''
+        return self.__table.findUser(address)
+
+    def listUsers(self):
+        return [user for user, key, address in self.__table.sessions()]
+
+    def allSessions(self):
+        return dict((user, [key, address]) for user, key, address in self.__table.sessions())
+
+    def presenceVersion(self):
+        return self.__presence.getVersion()
+
+    def presenceChanges(self, since, limit):
+        '''
+            presenceChanges(Number,Number):
+                Input   : Version of the clients mirror and maximum number of changes
+                Output  : List of [version, user, online] -> Changes after since, oldest first
+                          None -> If they are not known any more (the client must page again)
+        '''
+        return self.__presence.changesSince(since, limit)
+
+    def presencePage(self, after, limit):
+        '''
+            presencePage(String,Number):
+                Input   : Last user of the previous page ("" for the first one), page size
+                Output  : List (Connected users after after, sorted by name)
+        '''
+        return self.__presence.page(after, limit)
+
+    def joinRoom(self, room, user, maxMembers):
+        '''
+            joinRoom(String,String,Number):
+                Input   : The room, the user name and the most members a room may have
+                Output  : Number -> Sender number of the user in the room (a room that does
+                                    not exist is created with a new key)
+                          None   -> If the room is full
+        '''
+        entry = self.__rooms.get(room)
+        if entry is None:
+            entry = [1, os.urandom(ROOM_KEY_SIZE), 1, {}]
+            self.__rooms[room] = entry
+        if user not in entry[3]:
+            if len(entry[3]) >= maxMembers:
+                return None
+            entry[3][user] = entry[2]
+            entry[2] += 1
+            self.__userRooms.setdefault(user, set()).add(room)
+        return entry[3][user]
+
+    def leaveRoom(self, room, user):
+        '''
+            leaveRoom(String,String):
+                Input   : The room and the user name
+                Output  : List -> Members left, the room got a new key and epoch so the user
+                                  cannot read what follows (an empty room is removed)
+                          None -> If the user was not a member
+        '''
+        entry = self.__rooms.get(room)
+        if entry is None or user not in entry[3]:
+            return None
+        del entry[3][user]
+        rooms = self.__userRooms[user]
+        rooms.discard(room)
+        if not rooms:
+            del self.__userRooms[user]
+        if not entry[3]:
+            del self.__rooms[room]
+            return []
+        entry[0] += 1
+        entry[1] = os.urandom(ROOM_KEY_SIZE)
+        return entry[3].keys()
+
+    def getRoom(self, room):
+        '''
+            getRoom(String):
+                Input   : The room
+                Output  : [epoch,key,members] -> The current key of the room and its number
+                                                 of members
+                          None                -> If the room does not exist
+        '''
+        entry = self.__rooms.get(room)
+        if entry is None:
+            return None
+        return [entry[0], entry[1], len(entry[3])]
+
+    def roomMember(self, room, user):
+        '''
+            roomMember(String,String):
+                Output  : Number -> Sender number of the user in the room
+                          None   -> If the user is not a member
+        '''
+        entry = self.__rooms.get(room)
+        if entry is None:
+            return None
+        return entry[3].get(user)
+
+    def roomAddresses(self, room, exclude):
+        '''
+            roomAddresses(String,String):
+                Input   : The room and a member to leave out (the sender of a post)
+                Output  : List (Addresses of the other members)
+        '''
+        entry = self.__rooms.get(room)
+        if entry is None:
+            return []
+        addresses = []
+        for user in entry[3]:
+            session = self.__table.getSession(user) if user != exclude else None
+            if session is not None:
+                addresses.append(session[1])
+        return addresses
+
+    def userRooms(self, user):
+        return list(self.__userRooms.get(user, ()))
+
+    def checkSequence(self, user, sequence):
+        '''
+            checkSequence(String,Number):
+                Input   : The user name and the sequence number of a request from the user
+                Output  : Boolean (False if the request is a replay or the user is not connected)
+        '''
+        return self.__table.checkSequence(user, sequence)
+
+    def getLastSeen(self, user):
+        '''
+            getLastSeen(String):
+                Input   : The user name
+                Output  : Number -> Time of the last accepted request (or of the login)
+                          None   -> If the user is not connected
+        '''
+        return self.__table.getLastSeen(user)
+
+    def nextSequence(self, user):
+        '''
+            nextSequence(String):
+                Input   : The user name
+                Output  : Number -> Sequence number for the next message sent to the user
+                          None   -> If the user is not connected
+        '''
+        return self.__table.nextSequence(user)
+
+
+class sqliteSessionStore:
+    '''
+        sqliteSessionStore : Type -> class
+        purpose : Same interface as sessionStore but the state is kept in a local
+                    SQLite file so several server processes (started with -procs)
+                    can serve the same sessions. A session authenticated by one
+                    process can list / talk / logout through any other.
+    '''
+    def __init__(self, path):
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                    check_same_thread=False)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA synchronous=OFF")
+
+    @staticmethod
+    def create(path):
+        '''
+            create(String):
+                Input   : Path of the database file
+                Output  : None
+                Purpose : Create empty tables, called once by the parent process
+                            before the workers are started
+        '''
+        db = sqlite3.connect(path, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript('''
+            DROP TABLE IF EXISTS auth;
+            DROP TABLE IF EXISTS session;
+            CREATE TABLE auth    (user TEXT PRIMARY KEY, state BLOB);
+            CREATE TABLE session (user TEXT PRIMARY KEY, key BLOB, host TEXT, port INTEGER,
+                                  sendSeq INTEGER, recvHighest INTEGER, recvBitmap TEXT,
+                                  lastSeen REAL);
+            CREATE UNIQUE INDEX session_address ON session (host, port);
+            DROP TABLE IF EXISTS presence;
+            CREATE TABLE presence (version INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT,
+                                   online INTEGER);
+            DROP TABLE IF EXISTS room;
+            DROP TABLE IF EXISTS roomMember;
+            CREATE TABLE room       (room TEXT PRIMARY KEY, epoch INTEGER, key BLOB,
+                                     nextSender INTEGER);
+            CREATE TABLE roomMember (room TEXT, user TEXT, sender INTEGER, PRIMARY KEY (room, user));
+            CREATE INDEX roomMember_user ON roomMember (user);
+            DROP TABLE IF EXISTS usedTicket;
+            CREATE TABLE usedTicket (id BLOB PRIMARY KEY, expires REAL);
+        ''')
+        db.close()
+
+    def __execute(self, query, args=()):
+        with self.__lock:
+            return self.__db.execute(query, args).fetchall()
+
+    def getAuth(self, user):
+        rows = self.__execute("SELECT state FROM auth WHERE user = ?", (user,))
+        if not rows:
+            return None
+        return pickle.loads(str(rows[0][0]))
+
+    def setAuth(self, user, authInfo):
+        self.__execute("INSERT OR REPLACE INTO auth VALUES (?, ?)",
+                       (user, sqlite3.Binary(pickle.dumps(authInfo, 2))))
+
+    def removeAuth(self, user):
+        self.__execute("DELETE FROM auth WHERE user = ?", (user,))
+
+    def getSession(self, user):
+        rows = self.__execute("SELECT key, host, port FROM session WHERE user = ?", (user,))
+        if not rows:
+            return None
+        return [str(rows[0][0]), (str(rows[0][1]), rows[0][2])]
+
+    def __logPresence(self, user, online):
+        cursor = self.__db.execute("INSERT INTO presence (user, online) VALUES (?, ?)",
+                                   (user, 1 if online else 0))
+        self.__db.execute("DELETE FROM presence WHERE version <= ?",
+                          (cursor.lastrowid - MAX_PRESENCE_LOG,))
+
+    def setSession(self, user, key, address):
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            rows = self.__db.execute("SELECT user FROM session WHERE (host = ? AND port = ?) OR user = ?",
+                                     (address[0], address[1], user)).fetchall()
+            for row in rows:
+                if row[0] != user:
+                    self.__logPresence(row[0], False)
+                    for room in self.__db.execute("SELECT room FROM roomMember WHERE user = ?",
+                                                  (row[0],)).fetchall():
+                        self.__leaveRoom(room[0], row[0])
+            self.__db.execute("DELETE FROM session WHERE host = ? AND port = ?", address)
+            self.__db.execute("INSERT OR REPLACE INTO session VALUES (?, ?, ?, ?, 0, 0, '0', ?)",
+                              (user, sqlite3.Binary(key), address[0], address[1], time.time()))
+            if user not in [row[0] for row in rows]:
+                self.__logPresence(user, True)
+            self.__db.execute("COMMIT")
+
+    def removeSession(self, user):
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            if self.__db.execute("DELETE FROM session WHERE user = ?", (user,)).rowcount:
+                self.__logPresence(user, False)
+            for row in self.__db.execute("SELECT room FROM roomMember WHERE user = ?", (user,)).fetchall():
+                self.__leaveRoom(row[0], user)
+            self.__db.execute("COMMIT")
+
+    def getStats(self):
+        '''
+            getStats(None):
+                Output  : Dictionary (Sessions and handshakes in progress of every worker)
+        '''
+        return {
+            "sessions"      : self.__execute("SELECT COUNT(*) FROM session")[0][0],
+            "handshakes"    : self.__execute("SELECT COUNT(*) FROM auth")[0][0],
+        }
+
+    def useTicket(self, ticketId, expires):
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                self.__db.execute("DELETE FROM usedTicket WHERE expires < ?", (time.time(),))
+                return self.__db.execute("INSERT OR IGNORE INTO usedTicket VALUES (?, ?)",
+                                         (sqlite3.Binary(ticketId), expires)).rowcount == 1
+            finally:
+                self.__db.execute("COMMIT")
+
+    def findUserFromAddress(self, address):
+        rows = self.__execute("SELECT user FROM session WHERE host = ? AND port = ?", address)
+        if not rows:
+            return False
+        return str(rows[0][0])
+
+    def listUsers(self):
+        return [str(row[0]) for row in self.__execute("SELECT user FROM session")]
+
+    def allSessions(self):
+        rows = self.__execute("SELECT user, key, host, port FROM session")
+        return dict((str(row[0]), [str(row[1]), (str(row[2]), row[3])]) for row in rows)
+
+    def presenceVersion(self):
+        rows = self.__execute("SELECT seq FROM sqlite_sequence WHERE name = 'presence'")
+        return rows[0][0] if rows else 0
+
+    def presenceChanges(self, since, limit):
+        with self.__lock:
+            self.__db.execute("BEGIN")
+            try:
+                rows = self.__db.execute(
+                    "SELECT seq FROM sqlite_sequence WHERE name = 'presence'").fetchall()
+                version = rows[0][0] if rows else 0
+                if since > version:
+                    return None
+                if since == version:
+                    return []
+                oldest = self.__db.execute("SELECT MIN(version) FROM presence").fetchall()[0][0]
+                if oldest is None or since < oldest - 1:
+                    return None
+                return [[row[0], str(row[1]), bool(row[2])] for row in self.__db.execute(
+                    "SELECT version, user, online FROM presence WHERE version > ? ORDER BY version "
+                    "LIMIT ?", (since, limit))]
+            finally:
+                self.__db.execute("COMMIT")
+
+    def presencePage(self, after, limit):
+        return [str(row[0]) for row in self.__execute(
+            "SELECT user FROM session WHERE user > ? ORDER BY user LIMIT ?", (after, limit))]
+
+    def joinRoom(self, room, user, maxMembers):
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.__db.execute("SELECT sender FROM roomMember WHERE room = ? AND user = ?",
+                                         (room, user)).fetchall()
+                if rows:
+                    return rows[0][0]
+                rows = self.__db.execute("SELECT nextSender FROM room WHERE room = ?", (room,)).fetchall()
+                if not rows:
+                    self.__db.execute("INSERT INTO room VALUES (?, 1, ?, 1)",
+                                      (room, sqlite3.Binary(os.urandom(ROOM_KEY_SIZE))))
+                    sender = 1
+                else:
+                    sender = rows[0][0]
+                    members = self.__db.execute("SELECT COUNT(*) FROM roomMember WHERE room = ?",
+                                                (room,)).fetchall()[0][0]
+                    if members >= maxMembers:
+                        return None
+                self.__db.execute("INSERT INTO roomMember VALUES (?, ?, ?)", (room, user, sender))
+                self.__db.execute("UPDATE room SET nextSender = ? WHERE room = ?", (sender + 1, room))
+                return sender
+            finally:
+                self.__db.execute("COMMIT")
+
+    def __leaveRoom(self, room, user):
+        if not self.__db.execute("DELETE FROM roomMember WHERE room = ? AND user = ?",
+                                 (room, user)).rowcount:
+            return None
+        members = [str(row[0]) for row in self.__db.execute(
+            "SELECT user FROM roomMember WHERE room = ?", (room,))]
+        if not members:
+            self.__db.execute("DELETE FROM room WHERE room = ?", (room,))
+            return []
+        self.__db.execute("UPDATE room SET epoch = epoch + 1, key = ? WHERE room = ?",
+                          (sqlite3.Binary(os.urandom(ROOM_KEY_SIZE)), room))
+        return members
+
+    def leaveRoom(self, room, user):
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                return self.__leaveRoom(room, user)
+            finally:
+                self.__db.execute("COMMIT")
+
+    def getRoom(self, room):
+        rows = self.__execute("SELECT epoch, key, (SELECT COUNT(*) FROM roomMember WHERE room = ?) "
+                              "FROM room WHERE room = ?", (room, room))
+        if not rows:
+            return None
+        return [rows[0][0], str(rows[0][1]), rows[0][2]]
+
+    def roomMember(self, room, user):
+        rows = self.__execute("SELECT sender FROM roomMember WHERE room = ? AND user = ?", (room, user))
+        if not rows:
+            return None
+        return rows[0][0]
+
+    def roomAddresses(self, room, exclude):
+        return [(str(row[0]), row[1]) for row in self.__execute(
+            "SELECT host, port FROM roomMember JOIN session ON session.user = roomMember.user "
+            "WHERE room = ? AND roomMember.user != ?", (room, exclude))]
+
+    def userRooms(self, user):
+        return [str(row[0]) for row in self.__execute("SELECT room FROM roomMember WHERE user = ?", (user,))]
+
+    def checkSequence(self, user, sequence):
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.__db.execute(
+                    "SELECT recvHighest, recvBitmap FROM session WHERE user = ?", (user,)).fetchall()
+                if not rows:
+                    return False
+                window = replayWindow(highest=rows[0][0], bitmap=int(rows[0][1]))
+                if not window.check(sequence):
+                    return False
+                highest, bitmap = window.getState()
+                self.__db.execute("UPDATE session SET recvHighest = ?, recvBitmap = ?, lastSeen = ? "
+                                  "WHERE user = ?", (highest, str(bitmap), time.time(), user))
+                return True
+            finally:
+                self.__db.execute("COMMIT")
+
+    def getLastSeen(self, user):
+        rows = self.__execute("SELECT lastSeen FROM session WHERE user = ?", (user,))
+        if not rows:
+            return None
+        return rows[0][0]
+
+    def nextSequence(self, user):
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                self.__db.execute("UPDATE session SET sendSeq = sendSeq + 1 WHERE user = ?", (user,))
+                rows = self.__db.execute("SELECT sendSeq FROM session WHERE user = ?", (user,)).fetchall()
+                return rows[0][0] if rows else None
+            finally:
+                self.__db.execute("COMMIT")
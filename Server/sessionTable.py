@@ -0,0 +1,222 @@
+'''
+        Session table of the server
+
+        Everything the server keeps about one user is one record, an object with
+        __slots__ (no attribute dictionary): the handshake in progress (Auth), and
+        once logged in the session key, the address, the anti replay window of the
+        requests (highest sequence number and bitmap, see replayWindow.checkWindow),
+        the last sequence number sent and the time of the last request.
+
+        A single dictionary indexes the records twice: by user name (a string)
+        and, while the user is logged in, by address (a tuple). Both lookups are
+        one dictionary access and there are no parallel dictionaries to keep in
+        step: a new login from another address moves the record, and whoever was
+        logged in from an address taken by a new login is returned to the caller.
+'''
+
+import sys,time
+from replayWindow import checkWindow
+
+WINDOW_SIZE = 64                        # Requests a session may receive out of order
+
+
+class sessionRecord(object):
+    '''
+        sessionRecord : Type -> class
+        purpose : State of one user, key is None while the user is not logged in
+    '''
+    __slots__ = ("user", "auth", "key", "address", "highest", "bitmap", "sendSequence", "lastSeen")
+
+    def __init__(self, user):
+        self.user = user
+        self.auth = None
+        self.key = None
+        self.address = None
+        self.highest = 0
+        self.bitmap = 0
+        self.sendSequence = 0
+        self.lastSeen = 0.0
+
+
+class sessionTable:
+    '''
+        sessionTable : Type -> class
+        purpose : Handshakes and sessions of the users, found by user name or by address
+        Features : a) One record per user, indexed by name and address in the same
+                        dictionary
+                   b) A record is dropped when the user has neither a session nor a
+                        handshake in progress
+                   c) getStats reports the bytes a session takes (record, the objects
+                        it holds and its share of the index)
+        Note : Not thread safe, the connection serialises access to its state
+    '''
+    def __init__(self):
+        self.__index = {}                       # user name : sessionRecord, address : sessionRecord
+        self.__sessions = 0
+        self.__handshakes = 0
+
+    def __len__(self):
+        return self.__sessions
+
+    def getAuth(self, user):
+        record = self.__index.get(user)
+        return record.auth if record is not None else None
+
+    def setAuth(self, user, authInfo):
+        record = self.__index.get(user)
+        if record is None:
+            record = self.__index[user] = sessionRecord(user)
+        if record.auth is None:
+            self.__handshakes += 1
+        record.auth = authInfo
+
+    def removeAuth(self, user):
+        record = self.__index.get(user)
+        if record is None or record.auth is None:
+            return
+        record.auth = None
+        self.__handshakes -= 1
+        if record.key is None:
+            del self.__index[user]
+
+    def getSession(self, user):
+        '''
+            getSession(String):
+                Input   : The user name
+                Output  : [key,address] -> If the user is connected
+                          None          -> If the user is not connected
+        '''
+        record = self.__index.get(user)
+        if record is None or record.key is None:
+            return None
+        return [record.key, record.address]
+
+    def findUser(self, address):
+        '''
+            findUser(tuple):
+                Input   : Address of an incoming request
+                Output  : String -> The user connected from it
+                          False  -> If no user is
+        '''
+        record = self.__index.get(address)
+        return record.user if record is not None else False
+
+    def setSession(self, user, key, address):
+        '''
+            setSession(String,String,tuple):
+                Input   : The user, the key of its new session and its address
+                Output  : Boolean (True if the user was not connected before)
+                Note    : The caller removes first the session of another user
+                            connected from the same address (see findUser)
+        '''
+        record = self.__index.get(user)
+        if record is None:
+            record = self.__index[user] = sessionRecord(user)
+        joined = record.key is None
+        if joined:
+            self.__sessions += 1
+        elif record.address != address:
+            self.__index.pop(record.address, None)
+        record.key = key
+        record.address = address
+        record.highest = 0
+        record.bitmap = 0
+        record.sendSequence = 0
+        record.lastSeen = time.time()
+        self.__index[address] = record
+        return joined
+
+    def removeSession(self, user):
+        '''
+            removeSession(String):
+                Input   : The user name
+                Output  : Boolean (True if the user was connected)
+        '''
+        record = self.__index.get(user)
+        if record is None or record.key is None:
+            return False
+        self.__index.pop(record.address, None)
+        record.key = None
+        record.address = None
+        self.__sessions -= 1
+        if record.auth is None:
+            del self.__index[user]
+        return True
+
+    def sessions(self):
+        '''
+            sessions(None):
+                Output  : Iterator of [user, key, address] (Every user connected)
+        '''
+        for key, record in self.__index.iteritems():
+            if record.key is not None and not isinstance(key, tuple):
+                yield [record.user, record.key, record.address]
+
+    def checkSequence(self, user, sequence):
+        '''
+            checkSequence(String,Number):
+                Input   : The user name and the sequence number of a request from the user
+                Output  : Boolean (False if the request is a replay or the user is not connected)
+        '''
+        record = self.__index.get(user)
+        if record is None or record.key is None:
+            return False
+        accepted, record.highest, record.bitmap = checkWindow(record.highest, record.bitmap, sequence,
+                                                              WINDOW_SIZE)
+        if accepted:
+            record.lastSeen = time.time()
+        return accepted
+
+    def getLastSeen(self, user):
+        record = self.__index.get(user)
+        if record is None or record.key is None:
+            return None
+        return record.lastSeen
+
+    def nextSequence(self, user):
+        '''
+            nextSequence(String):
+                Input   : The user name
+                Output  : Number -> Sequence number for the next message sent to the user
+                          None   -> If the user is not connected
+        '''
+        record = self.__index.get(user)
+        if record is None or record.key is None:
+            return None
+        record.sendSequence += 1
+        return record.sendSequence
+
+    def sessionBytes(self, sample=1000):
+        '''
+            sessionBytes(Number):
+                Input   : Number of sessions measured
+                Output  : Number (Bytes taken by one session: the record, the objects it
+                            holds and its two entries of the index, averaged over the first
+                            sample sessions; integers shared with others are counted too)
+        '''
+        if not self.__sessions:
+            return 0
+        size = 0
+        measured = 0
+        for key, record in self.__index.iteritems():
+            if record.key is None or isinstance(key, tuple):
+                continue
+            size += sum(sys.getsizeof(part) for part in (
+                record, record.user, record.key, record.address, record.highest, record.bitmap,
+                record.sendSequence, record.lastSeen))
+            size += sum(sys.getsizeof(part) for part in record.address)
+            measured += 1
+            if measured == sample:
+                break
+        return size // measured + 2 * sys.getsizeof(self.__index) // max(len(self.__index), 1)
+
+    def getStats(self):
+        '''
+            getStats(None):
+                Output  : Dictionary (Sessions, handshakes in progress and bytes per session)
+        '''
+        return {
+            "sessions"          : self.__sessions,
+            "handshakes"        : self.__handshakes,
+            "bytesPerSession"   : self.sessionBytes(),
+        }
@@ -0,0 +1,168 @@
+import os,json,time,threading
+
+class latencyHistogram:
+    '''
+        latencyHistogram : Type -> class
+        purpose : Latency distribution in micro seconds with a fixed relative error
+                    (HDR style log linear buckets)
+        Features : a) record is O(1) and never allocates, memory is fixed
+                   b) Values are grouped by power of two and every power of two
+                        is split in 2^precision linear buckets, so percentiles are
+                        within 1/2^precision of the real value
+    '''
+    def __init__(self, precision=5, maxBits=40):
+        '''
+            __init__(Number,Number):
+                Input   : Log2 of the buckets per power of two, log2 of the largest value
+                Output  : None
+        '''
+        self.__precision = precision
+        self.__subMask = (1 << precision) - 1
+        self.__maxValue = (1 << maxBits) - 1
+        self.__counts = [0] * ((maxBits - precision + 1) << precision)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def __index(self, value):
+        shift = value.bit_length() - self.__precision - 1
+        if shift < 0:
+            return value
+        return ((shift + 1) << self.__precision) + ((value >> shift) & self.__subMask)
+
+    def __value(self, index):
+        shift = (index >> self.__precision) - 1
+        if shift < 0:
+            return index
+        return ((self.__subMask + 1) | (index & self.__subMask)) << shift
+
+    def record(self, value):
+        '''
+            record(Number):
+                Input   : Latency in micro seconds
+        '''
+        value = min(int(value), self.__maxValue)
+        self.__counts[self.__index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        '''
+            percentile(float):
+                Input   : 0.5 for the median, 0.99 for p99 ...
+                Output  : Number (Micro seconds, lower bound of the bucket)
+        '''
+        if not self.count:
+            return 0
+        rank = max(int(self.count * fraction + 0.5), 1)
+        seen = 0
+        for index, count in enumerate(self.__counts):
+            seen += count
+            if seen >= rank:
+                return self.__value(index)
+        return self.max
+
+    def summary(self):
+        '''
+            summary(None):
+                Output  : Dictionary (count, mean, p50, p90, p99, p999 and max in micro seconds)
+        '''
+        return {
+            "count"     : self.count,
+            "mean"      : self.total / self.count if self.count else 0,
+            "p50"       : self.percentile(0.5),
+            "p90"       : self.percentile(0.9),
+            "p99"       : self.percentile(0.99),
+            "p999"      : self.percentile(0.999),
+            "max"       : self.max,
+        }
+
+
+class serverStats:
+    '''
+        serverStats : Type -> class
+        purpose : Latency histograms and counters of one server process, dumped to a
+                    JSON file that can be scraped
+        Features : a) record(name, start) adds the time since start to the histogram
+                        name, count(name) bumps a counter
+                   b) Gauges are functions returning a dictionary (pool sizes, puzzle
+                        difficulty ...) evaluated only when the stats are dumped
+                   c) dump writes the file next to it and renames it in place, a
+                        reader never sees half a file
+    '''
+    def __init__(self, path="STATS.json", enabled=True):
+        '''
+            __init__(String,Boolean):
+                Input   : Path of the dump, False to make record and count do nothing
+                Output  : None
+        '''
+        self.__path = path
+        self.__enabled = enabled
+        self.__histograms = {}                  # name : latencyHistogram
+        self.__counters = {}                    # name : Number
+        self.__gauges = {}                      # name : function
+        self.__lock = threading.Lock()
+        self.__started = time.time()
+
+    def record(self, name, start):
+        '''
+            record(String,float):
+                Input   : Name of the histogram and the time.time() when the step started
+        '''
+        if not self.__enabled:
+            return
+        elapsed = (time.time() - start) * 1000000
+        histogram = self.__histograms.get(name)
+        if histogram is None:
+            with self.__lock:
+                histogram = self.__histograms.setdefault(name, latencyHistogram())
+        histogram.record(elapsed)
+
+    def count(self, name):
+        '''
+            count(String):
+                Input   : Name of the counter to increment
+        '''
+        if self.__enabled:
+            self.__counters[name] = self.__counters.get(name, 0) + 1
+
+    def addGauge(self, name, function):
+        '''
+            addGauge(String,function):
+                Input   : Name and function returning the current values (or None)
+        '''
+        self.__gauges[name] = function
+
+    def snapshot(self):
+        '''
+            snapshot(None):
+                Output  : Dictionary {pid, uptime, latency : {name : summary},
+                            counters : {name : Number}, gauges : {name : Dictionary}}
+        '''
+        with self.__lock:
+            histograms = dict(self.__histograms)
+        return {
+            "pid"       : os.getpid(),
+            "uptime"    : round(time.time() - self.__started, 1),
+            "latency"   : dict((name, histogram.summary()) for name, histogram in histograms.items()),
+            "counters"  : dict(self.__counters),
+            "gauges"    : dict((name, function()) for name, function in self.__gauges.items()),
+        }
+
+    def dump(self):
+        '''
+            dump(None):
+                Output  : Boolean (False if the file could not be written)
+                Purpose : Write the snapshot as JSON to the stats file
+        '''
+        tmpPath = self.__path + ".tmp"
+        try:
+            with open(tmpPath, "w") as outfile:
+                json.dump(self.snapshot(), outfile, indent=1, sort_keys=True)
+            os.rename(tmpPath, self.__path)
+        except (IOError, OSError) as e:
+            print "Unable to write stats", e
+            return False
+        return True
@@ -0,0 +1,106 @@
+import time,threading
+
+class timerWheel:
+    '''
+        timerWheel : Type -> class
+        purpose : Hierarchical timing wheel for a very large number of timers
+                    (half open handshakes, idle sessions)
+        Features : a) schedule, cancel and expiring a timer are O(1), a tick only
+                        looks at the timers of one slot, never at all of them
+                   b) levels of slots, level i has a resolution of tick * slots^i.
+                        When a level wraps around the next slot of the level above
+                        is spread over the levels below (cascade)
+                   c) One timer per key, scheduling a key again moves its timer
+        Note : Timers fire in the first advance at or after their deadline, with a
+                resolution of one tick
+    '''
+    def __init__(self, tick=0.1, slotBits=8, levels=4, now=None):
+        '''
+            __init__(float,Number,Number,float):
+                Input   : Seconds per tick, log2 of the slots per level, number of levels
+                            and the start time (time.time() if not given)
+                Output  : None
+        '''
+        self.__tick = tick
+        self.__bits = slotBits
+        self.__mask = (1 << slotBits) - 1
+        self.__levels = levels
+        self.__maxTicks = (1 << (slotBits * levels)) - 1
+        self.__wheel = [[set() for i in range(1 << slotBits)] for level in range(levels)]
+        self.__timers = {}                      # key : [deadline tick, level, slot]
+        self.__start = time.time() if now is None else now
+        self.__current = 0                      # Last tick processed
+        self.__lock = threading.Lock()
+
+    def getTick(self):
+        return self.__tick
+
+    def __len__(self):
+        return len(self.__timers)
+
+    def __place(self, key, deadline):
+        delta = deadline - self.__current
+        level = 0
+        while level < self.__levels - 1 and delta >> (self.__bits * (level + 1)):
+            level += 1
+        slot = (deadline >> (self.__bits * level)) & self.__mask
+        self.__wheel[level][slot].add(key)
+        self.__timers[key] = [deadline, level, slot]
+
+    def __remove(self, key):
+        timer = self.__timers.pop(key, None)
+        if timer is not None:
+            self.__wheel[timer[1]][timer[2]].discard(key)
+
+    def schedule(self, key, delay):
+        '''
+            schedule(Object,float):
+                Input   : Key of the timer (any hashable) and seconds until it fires
+                Output  : None
+        '''
+        ticks = min(max(int(delay / self.__tick + 0.999999), 1), self.__maxTicks)
+        with self.__lock:
+            self.__remove(key)
+            self.__place(key, self.__current + ticks)
+
+    def cancel(self, key):
+        '''
+            cancel(Object):
+                Input   : Key of the timer, nothing happens if there is none
+        '''
+        with self.__lock:
+            self.__remove(key)
+
+    def __cascade(self):
+        for level in range(1, self.__levels):
+            slot = (self.__current >> (self.__bits * level)) & self.__mask
+            keys = self.__wheel[level][slot]
+            self.__wheel[level][slot] = set()
+            for key in keys:
+                self.__place(key, self.__timers[key][0])
+            if slot:
+                return
+
+    def advance(self, now=None):
+        '''
+            advance(float):
+                Input   : Current time (time.time() if not given)
+                Output  : List (Keys of the timers that expired, they are removed)
+        '''
+        if now is None:
+            now = time.time()
+        target = int((now - self.__start) / self.__tick)
+        expired = []
+        with self.__lock:
+            while self.__current < target:
+                self.__current += 1
+                slot = self.__current & self.__mask
+                if slot == 0:
+                    self.__cascade()
+                keys = self.__wheel[0][slot]
+                if keys:
+                    self.__wheel[0][slot] = set()
+                    for key in keys:
+                        del self.__timers[key]
+                    expired.extend(keys)
+        return expired
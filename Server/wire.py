@@ -0,0 +1,186 @@
+'''
+        Binary wire format shared by the client and the server
+
+        Every packet (and every encrypted payload inside a packet) is
+            | version (1 byte) | packet type (1 byte) | fields ... |
+        The fields of each packet type are fixed by the PACKETS table below:
+            U8/U16/U32/U64/I32 : fixed width big endian integers
+            BLOB               : 2 byte length + bytes
+            LONGBLOB           : 4 byte length + bytes (payloads that may be fragmented)
+            INT                : 2 byte length + big endian bytes of a non negative long
+            LIST               : 2 byte count + BLOBs
+            ADDR               : 1 byte length + host + 2 byte port
+        decode never evaluates the input, malformed packets simply return None
+'''
+
+import struct,binascii
+
+VERSION = 7
+
+U8, U16, U32, U64, I32 = "B", "H", "I", "Q", "i"
+BLOB, LONGBLOB, INT, LIST, ADDR = "blob", "longblob", "int", "list", "addr"
+
+PACKETS = {
+    # Outer packets (sent as is on the socket)
+    "asym"          : (1,  [("user", BLOB), ("message", BLOB)]),
+    "sym"           : (2,  [("IV", BLOB), ("message", BLOB)]),
+    "quiz"          : (3,  [("challange", BLOB), ("answer", BLOB), ("space", U32), ("timestamp", U32)]),
+    "initiateSecret": (4,  [("hash", INT), ("pubKey", INT), ("verifyServer", BLOB)]),
+    "client"        : (5,  [("IV", BLOB), ("data", LONGBLOB)]),
+    "fragment"      : (6,  [("msgId", U32), ("index", U16), ("count", U16), ("data", BLOB)]),
+    "room-post"     : (7,  [("user", BLOB), ("room", BLOB), ("epoch", U32), ("IV", BLOB),
+                            ("data", LONGBLOB)]),
+    "resume"        : (8,  [("user", BLOB), ("ticket", BLOB), ("nonce", BLOB), ("proof", BLOB)]),
+    "resumed"       : (9,  [("user", BLOB), ("nonce", BLOB), ("IV", BLOB), ("message", BLOB)]),
+
+    # Encrypted with the servers public key
+    "now-online"    : (10, [("user", BLOB)]),
+    "quiz-response" : (11, [("user", BLOB), ("answer", I32), ("pubKey", INT), ("challange", BLOB),
+                            ("space", U32), ("timestamp", U32)]),
+    "complete"      : (12, [("user", BLOB), ("hash", INT)]),
+
+    # Client -> server, encrypted with the session key
+    "list"          : (20, [("user", BLOB), ("Seq", U64)]),
+    "talk"          : (21, [("user", BLOB), ("Seq", U64), ("userDestination", BLOB)]),
+    "logout"        : (22, [("user", BLOB), ("Seq", U64)]),
+    "list-changes"  : (23, [("user", BLOB), ("Seq", U64), ("since", U64)]),
+    "list-page"     : (24, [("user", BLOB), ("Seq", U64), ("after", BLOB)]),
+    "room-join"     : (25, [("user", BLOB), ("Seq", U64), ("room", BLOB)]),
+    "room-leave"    : (26, [("user", BLOB), ("Seq", U64), ("room", BLOB)]),
+    "mail"          : (27, [("user", BLOB), ("Seq", U64), ("recipient", BLOB), ("keyId", U64), ("IV", BLOB),
+                            ("data", BLOB)]),
+    "mail-ack"      : (28, [("user", BLOB), ("Seq", U64), ("mailNo", U64)]),
+
+    # Server -> client, encrypted with the session key (request is the Seq of the request answered)
+    "users"         : (30, [("Seq", U64), ("request", U64), ("users", LIST)]),
+    "ticket"        : (31, [("Seq", U64), ("request", U64), ("Key", BLOB), ("ticket", BLOB), ("IV", BLOB),
+                            ("address", ADDR)]),
+    "talkto"        : (32, [("Seq", U64), ("Key", BLOB), ("user", BLOB), ("address", ADDR)]),
+    "disconnect"    : (33, [("Seq", U64)]),
+    "presence"      : (34, [("Seq", U64), ("request", U64), ("version", U64), ("reset", U8), ("more", U8),
+                            ("joined", LIST), ("left", LIST)]),
+    "users-page"    : (35, [("Seq", U64), ("request", U64), ("version", U64), ("next", BLOB), ("users", LIST)]),
+    "room-key"      : (36, [("Seq", U64), ("request", U64), ("room", BLOB), ("epoch", U32), ("sender", U32),
+                            ("Key", BLOB), ("members", U32)]),
+    "room-left"     : (37, [("Seq", U64), ("request", U64), ("room", BLOB)]),
+    "resume-ticket" : (38, [("Seq", U64), ("ticket", BLOB), ("lifetime", U32)]),
+    "mailbox"       : (39, [("Seq", U64), ("request", U64), ("user", BLOB), ("keyId", U64), ("Key", BLOB)]),
+    "mail-stored"   : (46, [("Seq", U64), ("request", U64), ("stored", U8)]),
+    "mailbag"       : (47, [("Seq", U64), ("request", U64), ("mails", LIST)]),
+
+    # Client -> client, encrypted with the key issued by the server
+    "chat"          : (40, [("user", BLOB), ("Seq", U64), ("msgNo", U64), ("chat", LONGBLOB)]),
+    "refused"       : (41, [("user", BLOB), ("Seq", U64)]),
+    "left"          : (42, [("user", BLOB), ("Seq", U64)]),
+    "ack"           : (43, [("user", BLOB), ("Seq", U64), ("cumulative", U64), ("sack", U64)]),
+
+    # Member -> members of a room (inside room-post), encrypted with the room key
+    "room-chat"     : (44, [("user", BLOB), ("postNo", U64), ("chat", LONGBLOB)]),
+
+    # Server -> client, one mail of a mailbag (IV and data are encrypted with the mail key)
+    "mail-item"     : (45, [("user", BLOB), ("mailNo", U64), ("keyId", U64), ("Key", BLOB), ("IV", BLOB),
+                            ("data", BLOB)]),
+}
+
+_header = struct.Struct("!BB")
+_length = struct.Struct("!H")
+_longLength = struct.Struct("!I")
+_byId = dict((packetId, (name, fields)) for name, (packetId, fields) in PACKETS.items())
+_fixed = dict((kind, struct.Struct("!" + kind)) for kind in (U8, U16, U32, U64, I32))
+
+
+def _longToBytes(number):
+    if number == 0:
+        return ""
+    hexString = "%x" % number
+    if len(hexString) % 2:
+        hexString = "0" + hexString
+    return binascii.unhexlify(hexString)
+
+
+def _blob(value):
+    value = str(value)
+    return _length.pack(len(value)) + value
+
+
+def encode(packetType, fields):
+    '''
+        encode(String,Dictionary):
+            Input   : Name of the packet type and the value of every field
+            Output  : String (The framed packet)
+    '''
+    packetId, layout = PACKETS[packetType]
+    parts = [_header.pack(VERSION, packetId)]
+    for name, kind in layout:
+        value = fields[name]
+        if kind in _fixed:
+            parts.append(_fixed[kind].pack(int(value)))
+        elif kind == BLOB:
+            parts.append(_blob(value))
+        elif kind == LONGBLOB:
+            value = str(value)
+            parts.append(_longLength.pack(len(value)))
+            parts.append(value)
+        elif kind == INT:
+            parts.append(_blob(_longToBytes(long(value))))
+        elif kind == LIST:
+            parts.append(_length.pack(len(value)))
+            parts.extend(_blob(item) for item in value)
+        elif kind == ADDR:
+            host = str(value[0])
+            parts.append(chr(len(host)) + host + _length.pack(value[1]))
+    return "".join(parts)
+
+
+def _readBlob(data, offset, length=_length):
+    size = length.unpack_from(data, offset)[0]
+    offset += length.size
+    if offset + size > len(data):
+        raise ValueError("blob past end of packet")
+    return data[offset:offset + size], offset + size
+
+
+def decode(data):
+    '''
+        decode(String):
+            Input   : A framed packet
+            Output  : Dictionary -> {"type" : packet type, field : value ...}
+                      None       -> If the packet is malformed or of an unknown version / type
+    '''
+    try:
+        version, packetId = _header.unpack_from(data, 0)
+        if version != VERSION or packetId not in _byId:
+            return None
+        packetType, layout = _byId[packetId]
+        obj = {"type": packetType}
+        offset = _header.size
+        for name, kind in layout:
+            if kind in _fixed:
+                obj[name] = _fixed[kind].unpack_from(data, offset)[0]
+                offset += _fixed[kind].size
+            elif kind == BLOB:
+                obj[name], offset = _readBlob(data, offset)
+            elif kind == LONGBLOB:
+                obj[name], offset = _readBlob(data, offset, _longLength)
+            elif kind == INT:
+                value, offset = _readBlob(data, offset)
+                obj[name] = long(binascii.hexlify(value), 16) if value else 0L
+            elif kind == LIST:
+                count = _length.unpack_from(data, offset)[0]
+                offset += 2
+                items = []
+                for i in range(count):
+                    item, offset = _readBlob(data, offset)
+                    items.append(item)
+                obj[name] = items
+            elif kind == ADDR:
+                size = ord(data[offset])
+                host = data[offset + 1:offset + 1 + size]
+                offset += 1 + size
+                obj[name] = (host, _length.unpack_from(data, offset)[0])
+                offset += 2
+        if offset != len(data):
+            return None
+        return obj
+    except (struct.error, ValueError, IndexError, TypeError):
+        return None